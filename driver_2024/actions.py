@@ -0,0 +1,198 @@
+#------------------------------------------------------------------------------
+# Motor de acciones de las señales. Cada señal se traduce en una línea temporal
+# de pasos (cambios de velocidad, secuencias de giro, patrones de luces) que un
+# planificador ejecuta en su propio hilo, de forma que la detección nunca se
+# bloquea. Una acción en curso puede cancelarse y una señal de mayor prioridad
+# (por ejemplo un semáforo en rojo) interrumpe la maniobra que se esté haciendo.
+#------------------------------------------------------------------------------
+
+import logging
+import threading
+import time
+import metrics
+
+
+class Timeline(object):
+    ''' Pasos de una acción, cada uno con su instante relativo al inicio en segundos '''
+
+    def __init__(self, name, priority=0, exclusive=True):
+        self.name = name
+        self.priority = priority
+        self.exclusive = exclusive  # las no exclusivas (p. ej. luces) se ejecutan a la vez que otras
+        self.steps = []
+        self.cancel_steps = []
+
+    def at(self, offset, function, *args):
+        self.steps.append((offset, function, args))
+        return self
+
+    def on_cancel(self, function, *args):
+        ''' Paso que se ejecuta si la acción se interrumpe antes de terminar '''
+
+        self.cancel_steps.append((function, args))
+        return self
+
+    def ramp(self, start, setter, initial, final, duration, steps=5):
+        ''' Cambio gradual de un valor (velocidad, ángulo) en varios pasos '''
+
+        for i in range(1, steps + 1):
+            value = initial + (final - initial) * i / steps
+            self.at(start + duration * i / steps, setter, int(round(value)))
+        return self
+
+    def sequence(self, start, setter, values, interval):
+        ''' Aplica los valores uno tras otro separados por un intervalo fijo '''
+
+        for i, value in enumerate(values):
+            self.at(start + i * interval, setter, value)
+        return self
+
+    def pattern(self, start, end, setter, frames):
+        ''' Repite los fotogramas (valor, duración) desde start hasta end '''
+
+        offset = start
+        while offset < end:
+            for value, duration in frames:
+                if offset >= end:
+                    break
+                self.at(offset, setter, value)
+                offset += duration
+        return self
+
+    @property
+    def duration(self):
+        return max((offset for offset, _, _ in self.steps), default=0)
+
+    def run(self, clock=time.monotonic, sleep=time.sleep):
+        ''' Ejecuta la línea temporal bloqueando el hilo actual, como hacían antes las señales '''
+
+        start = clock()
+        for offset, function, args in sorted(self.steps, key=lambda step: step[0]):
+            delay = start + offset - clock()
+            if delay > 0:
+                sleep(delay)
+            function(*args)
+
+
+class _RunningTimeline(object):
+
+    def __init__(self, timeline, start):
+        self.timeline = timeline
+        self.start = start
+        self.pending = sorted(timeline.steps, key=lambda step: step[0])
+        self.next_step = 0
+
+    @property
+    def finished(self):
+        return self.next_step >= len(self.pending)
+
+    def next_time(self):
+        return self.start + self.pending[self.next_step][0]
+
+
+class ActionExecutor(object):
+    ''' Planificador de líneas temporales con prioridades y cancelación '''
+
+    def __init__(self, clock=time.monotonic, threaded=True):
+        self.clock = clock
+        self._metrics = metrics.get_metrics()
+        self._condition = threading.Condition()
+        self._current = None
+        self._background = []
+        self._running = True
+        self._thread = None
+        if threaded:
+            self._thread = threading.Thread(target=self._run, name='actions', daemon=True)
+            self._thread.start()
+
+    @property
+    def current(self):
+        ''' Nombre de la acción exclusiva en curso, o None '''
+
+        with self._condition:
+            return self._current.timeline.name if self._current is not None else None
+
+    def submit(self, timeline):
+        ''' Programa la acción; devuelve False si la descarta otra de mayor prioridad '''
+
+        if timeline is None or not timeline.steps:
+            return False
+
+        with self._condition:
+            running = _RunningTimeline(timeline, self.clock())
+            if not timeline.exclusive:
+                self._background.append(running)
+            else:
+                if self._current is not None:
+                    if timeline.priority < self._current.timeline.priority:
+                        logging.debug(f"Ignorando {timeline.name}: está en curso {self._current.timeline.name}")
+                        return False
+                    logging.debug(f"{timeline.name} interrumpe a {self._current.timeline.name}")
+                    self._cancel(self._current)
+                self._current = running
+            self._condition.notify_all()
+        return True
+
+    def cancel(self):
+        ''' Interrumpe la acción exclusiva en curso '''
+
+        with self._condition:
+            if self._current is not None:
+                self._cancel(self._current)
+                self._current = None
+            self._condition.notify_all()
+
+    def _cancel(self, running):
+        for function, args in running.timeline.cancel_steps:
+            self._call(function, args)
+
+    def _call(self, function, args):
+        try:
+            function(*args)
+        except Exception:
+            logging.exception('Error ejecutando un paso de una acción')
+
+    def run_pending(self, now=None):
+        ''' Ejecuta los pasos vencidos y devuelve el instante del siguiente (o None) '''
+
+        if now is None:
+            now = self.clock()
+
+        with self._condition:
+            timelines = [self._current] + self._background if self._current is not None else list(self._background)
+            due = []
+            for running in timelines:
+                while not running.finished and running.next_time() <= now:
+                    due.append((running.next_time(), running.pending[running.next_step]))
+                    running.next_step += 1
+
+            if self._current is not None and self._current.finished:
+                self._current = None
+            self._background = [running for running in self._background if not running.finished]
+
+            # Los pasos se ejecutan en orden temporal aunque vengan de acciones distintas
+            due.sort(key=lambda item: item[0])
+            for scheduled, (_, function, args) in due:
+                self._metrics.observe('sign_action_delay', max(now - scheduled, 0))
+                start = metrics.now()
+                self._call(function, args)
+                self._metrics.since('sign_action', start)
+
+            pending = [running.next_time() for running in timelines if not running.finished]
+            return min(pending) if pending else None
+
+    def _run(self):
+        with self._condition:
+            while self._running:
+                next_time = self.run_pending()
+                timeout = None if next_time is None else max(0, next_time - self.clock())
+                self._condition.wait(timeout)
+
+    def stop(self, cancel=True):
+        if cancel:
+            self.cancel()
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(1)
@@ -4,73 +4,111 @@
 # utilizando un modelo de aprendizaje profundo compilado en formato .tflite.
 #------------------------------------------------------------------------------
 
-import cv2
+from lazy import lazy_import
+cv2 = lazy_import('cv2')
 import numpy as np
 import logging
-import math
 import time
-from pycoral.utils import edgetpu
-from pycoral.adapters import common
-from signals import *
+import settings
+from backends import LANE_MODEL_SPEC, SIGNAL_MODEL_SPEC, input_tensor
+from runner import get_runner, PRIORIDAD_DIRECCION, PRIORIDAD_SENALES
+from preprocessing import LanePreprocessor, SignalPreprocessor
+from postprocessing import DetectionPostprocessor, SteeringPostprocessor
+from tracker import SignTracker
+from roi import RoiLayout
+from actions import ActionExecutor
+import metrics
+from steering import SteeringController
+from signals import Signal
+from overlay import HeadingOverlay, heading_line_points
+from behaviors import load_behaviors
 
 class LaneFollower(object):
 
     def __init__(self,
                  car=None,
-                 model_path='/home/pi/Smart-Pi-Car/models/lane-navigation-model-finetuned.tflite'):
+                 model_path=None,
+                 backend=None,
+                 runner=None,
+                 clock=time.monotonic):
         logging.info('Poniendo a punto el procesador (LaneFollower)')
 
+        if model_path is None:
+            model_path = settings.get('lane_model', '/home/pi/Smart-Pi-Car/models/lane-navigation-model-finetuned.tflite')
+
         self.car = car
         self.curr_steering_angle = 90
+        self.controller = self.make_controller(self.curr_steering_angle, clock)
         
-        # Inicializa el intérprete de Tensorflow
-        self.interpreter = edgetpu.make_interpreter(model_path)
-        self.interpreter.allocate_tensors()
+        # El intérprete lo carga el runner que ejecuta todos los modelos del backend
+        self.runner = runner if runner is not None else get_runner(backend)
+        # Cada instancia tiene su intérprete y su nombre en el runner ('lane', 'lane_2'...)
+        self.model, self.interpreter = self.runner.load('lane', model_path, LANE_MODEL_SPEC, PRIORIDAD_DIRECCION)
+        self.preprocessor = LanePreprocessor(self.interpreter)
+        # Línea de dirección dibujada en buffers reutilizados
+        self.overlay = HeadingOverlay()
+        # Salida en float o en uint8/int8 con su escala y punto cero (modelo cuantizado)
+        self.postprocessor = SteeringPostprocessor(self.interpreter)
+        self.metrics = metrics.get_metrics()
+
+
+    @staticmethod
+    def make_controller(initial_angle=90, clock=time.monotonic):
+        ''' Límite de giro en grados por segundo, filtro y compensación de la latencia.
+            El servidor de inferencia crea uno igual para cada coche '''
+
+        return SteeringController.from_settings(initial_angle=initial_angle, clock=clock)
 
 
-    def follow_lane(self, frame):
-        ''' Método principal de la clase, llama a los demás '''
+    def warm_up(self, iterations=2):
+        ''' Inferencias con la entrada a cero antes de arrancar: la primera reserva
+            memoria y, en el Edge TPU, sube el modelo al acelerador '''
+
+        input_tensor(self.interpreter).fill(0)
+        for _ in range(iterations):
+            self.runner.invoke(self.model)
+
+
+    def follow_lane(self, frame, render=True, timestamp=None):
+        ''' Método principal de la clase, llama a los demás.
+            Con render=False no dibuja la línea de dirección y devuelve el mismo fotograma.
+            timestamp es el instante de captura del fotograma (time.monotonic) '''
 
         new_steering_angle = self.compute_steering_angle(frame)
-        self.curr_steering_angle = self.stabilize_steering_angle(new_steering_angle)
+        self.curr_steering_angle = self.stabilize_steering_angle(new_steering_angle, timestamp)
         logging.debug(f"Ángulo de giro: {self.curr_steering_angle} grados")
 
         if self.car is not None:
+            start = metrics.now()
             self.car.front_wheels.turn(self.curr_steering_angle)
-        final_frame = display_heading_line(frame, self.curr_steering_angle)
+            self.metrics.since('actuate', start)
+        if not render:
+            return frame
+        final_frame = self.overlay.render(frame, self.curr_steering_angle)
 
         return final_frame
 
 
-    def stabilize_steering_angle(self, new_steering_angle):
-        ''' Acota el ángulo de giro a un máximo de 3 grados respecto al anterior '''
+    def stabilize_steering_angle(self, new_steering_angle, timestamp=None):
+        ''' Acota la velocidad de giro en grados por segundo (no por fotograma) y,
+            si está configurado, suaviza el ángulo y lo extrapola al instante del giro '''
 
-        stabilized_steering_angle = new_steering_angle
-        max_angle_deviation = 3
-        angle_deviation = new_steering_angle - self.curr_steering_angle
-        if angle_deviation > max_angle_deviation:
-            stabilized_steering_angle = self.curr_steering_angle + max_angle_deviation
-        elif angle_deviation < -max_angle_deviation:
-            stabilized_steering_angle = self.curr_steering_angle - max_angle_deviation
-        return stabilized_steering_angle
+        return self.controller.update(new_steering_angle, timestamp)
             
 
     def compute_steering_angle(self, frame):
         ''' Calcula el ángulo de giro mediante el modelo '''
         
-        input_frame = img_preprocess(frame)
-        common.set_input(self.interpreter, input_frame)
+        start = metrics.now()
+        self.preprocessor(frame)
+        start = self.metrics.since('preprocess', start, 'lane')
 
-        output_details = self.interpreter.get_output_details()[0]
-        
-        #start = time.time()
-        self.interpreter.invoke()
-        #end = time.time()
-        
-        #logging.info(end-start)
-        steering_angle = self.interpreter.get_tensor(output_details['index'])
+        wait, _ = self.runner.invoke(self.model)
+        self.metrics.observe('queue_wait', wait, 'lane')
+        start = self.metrics.since('invoke', start, 'lane')
 
-        steering_angle = int(steering_angle + 0.5) # redondeo
+        steering_angle = self.postprocessor()
+        self.metrics.since('postprocess', start, 'lane')
         return steering_angle
 
 
@@ -78,74 +116,125 @@ class TrafficSignDetector(object):
     
     def __init__(self,
                     car=None,
-                    model_path='/home/pi/Smart-Pi-Car_2024/models/ultimo.tflite'):
+                    model_path=None,
+                    backend=None,
+                    runner=None,
+                    clock=time.monotonic,
+                    actions=None):
         
         logging.info('Poniendo a punto el procesador (TrafficSignDetector)')
+
+        if model_path is None:
+            model_path = settings.get('signal_model', '/home/pi/Smart-Pi-Car_2024/models/ultimo.tflite')
         
         self.car = car
         self.threshold = 0.6
                                 
-        self.traffic_objects = {0: Stop(),
-                                1: Velocity(30),
-                                2: Velocity(60),
-                                3: Ceda(),
-                                4: Luces(),
-                                5: Obras(),
-                                6: Recto(),
-                                7: Izquierda(),
-                                8: Derecha(),
-                                9: Verde(),
-                                10: Rojo()}                     
-        
-        # Inicializa el intérprete de Tensorflow
-        self.interpreter = edgetpu.make_interpreter(model_path)
-        
-        self.interpreter.allocate_tensors()
+        # El intérprete lo carga el runner que ejecuta todos los modelos del backend
+        self.runner = runner if runner is not None else get_runner(backend)
+        # Cada instancia tiene su intérprete y su nombre en el runner ('signs', 'signs_2'...)
+        self.model, self.interpreter = self.runner.load('signs', model_path, SIGNAL_MODEL_SPEC, PRIORIDAD_SENALES)
+        self.preprocessor = SignalPreprocessor(self.interpreter)
+        self.postprocessor = DetectionPostprocessor(self.interpreter, self.threshold)
+        # Zonas del fotograma que ve el modelo (por defecto, el fotograma entero)
+        self.layout = RoiLayout.from_settings()
+        self.tracker = SignTracker()
+        self.metrics = metrics.get_metrics()
+
+        # Las acciones de las señales se ejecutan en su propio hilo sin frenar la detección
+        # (el simulador pasa uno sin hilo que avanza con su reloj)
+        self.actions = actions if actions is not None else ActionExecutor(clock)
         
-        with open('/home/pi/Smart-Pi-Car_2024/models/labelmap.txt', 'r') as f:
+        labelmap_path = settings.get('labelmap', settings.LABELMAP_PATH)
+        with open(labelmap_path, 'r') as f:
             self.labels = [line.strip() for line in f.readlines()]
+
+        # Comportamiento ante cada señal (behaviors.json), indexado por id de clase
+        self.behaviors = load_behaviors(clock=clock).compile(self.labels)
+
+
+    def warm_up(self, iterations=2):
+        ''' Inferencias con la entrada a cero antes de arrancar '''
+
+        input_tensor(self.interpreter).fill(0)
+        for _ in range(iterations):
+            self.runner.invoke(self.model)
   
         
-    def detect_signal(self, frame):
-        input_frame = img_preprocess(frame, signal = True)
-        common.set_input(self.interpreter, input_frame)
-        
-        output_details = self.interpreter.get_output_details()
-        #start = time.time()
-        self.interpreter.invoke()
-        #end = time.time()
-        #logging.info(end-start)
-
-        boxes = self.interpreter.get_tensor(output_details[1]['index'])[0]
-        classes = self.interpreter.get_tensor(output_details[3]['index'])[0]
-        scores = self.interpreter.get_tensor(output_details[0]['index'])[0]
-        
-        detections = []
+    def detect_signal(self, frame, timestamp=None):
+        ''' timestamp es el instante de captura del fotograma; por defecto, el actual '''
 
-        for i in range(len(scores)):
-            if ((scores[i] > self.threshold)):  
-                object_name = self.labels[int(classes[i])] 
-                detections.append([object_name, scores[i], boxes[i], int(classes[i])])
+        detections = self.detect(frame)
+                
+        # Solo se actúa ante señales confirmadas en varios fotogramas, una vez por señal
+        confirmed = self.confirm(detections, timestamp)
                 
         signal_detected = 'Nada'   
         
         if(len(detections)>0):
-            signal_detected = detections[0][0]
+            signal_detected = self.labels[detections[0]['class_id']]
+            self.metrics.count('detection', label=signal_detected)
             logging.debug(signal_detected)
             logging.debug(detections[0])
-            
-            signal = self.traffic_objects[int(detections[0][3])]
 
-            if signal.esta_cerca(detections[0]):
-                logging.debug('La señal está cerca, interpretándola...')
-                signal.play(self.car)
-            else:
-                logging.debug('Se detectó la señal, pero está demasiado lejos, ignorándola...')
+        if len(confirmed) > 0:
+            logging.debug('La señal está confirmada y cerca, interpretándola...')
+            self.act(confirmed)
+        elif len(detections) > 0:
+            logging.debug('Se detectó la señal, pero está demasiado lejos o sin confirmar, esperando...')
         
         return signal_detected                       
 
+    def detect(self, frame):
+        ''' Detecciones de todas las ventanas en píxeles del fotograma, ordenadas por
+            confianza x proximidad y sin duplicados entre teselas '''
+
+        height, width = frame.shape[:2]
+        collect_time = 0
+        for window in self.layout.windows(width, height, self.preprocessor.width, self.preprocessor.height):
+            start = metrics.now()
+            self.preprocessor(frame, window)
+            start = self.metrics.since('preprocess', start, 'signs')
+
+            wait, _ = self.runner.invoke(self.model)
+            self.metrics.observe('queue_wait', wait, 'signs')
+            start = self.metrics.since('invoke', start, 'signs')
+
+            self.postprocessor.collect(window)
+            collect_time += metrics.now() - start
+
+        start = metrics.now()
+        detections = self.postprocessor()
+        self.metrics.observe('postprocess', collect_time + metrics.now() - start, 'signs')
+        return detections
+
+    def confirm(self, detections, timestamp=None, tracker=None):
+        ''' Pistas confirmadas y cercanas que aún no se han atendido. tracker es el de
+            este detector salvo que se dé otro (el servidor guarda uno por coche) '''
+
+        tracker = self.tracker if tracker is None else tracker
+        return tracker.update(detections, timestamp, is_near=Signal.esta_cerca)
+
+    def act(self, confirmed):
+        ''' Lanza la acción de cada pista confirmada, de más a menos confianza. Una pista
+            se da por atendida si su acción se acepta o si no hay nada que hacer; si la
+            rechaza otra acción de mayor prioridad, se reintenta en el siguiente fotograma '''
+
+        for track in confirmed:
+            logging.debug(track)
+            class_id = int(track['class_id'])
+            behavior = self.behaviors[class_id]
+            timeline = behavior.timeline(self.car) if behavior is not None else None
+            if timeline is None:
+                self.tracker.mark_fired(track['track_id'])
+            elif self.actions.submit(timeline):
+                self.tracker.mark_fired(track['track_id'])
+                self.metrics.count('sign_action', label=self.labels[class_id])
+
 def img_preprocess(image, signal=False):
-    ''' Ajusta el fotograma a la entrada del modelo '''
+    ''' Ajusta el fotograma a la entrada del modelo.
+        Versión original que reserva memoria en cada fotograma; los modelos usan
+        ahora los preprocesadores de preprocessing.py y se mantiene como referencia '''
 
     if(signal):
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -162,18 +251,15 @@ def img_preprocess(image, signal=False):
 
 
 def display_heading_line(frame, steering_angle, line_color=(0, 0, 255), line_width=5):
-    ''' Muestra por pantalla una línea en la dirección a la que se dirije el coche '''
+    ''' Muestra por pantalla una línea en la dirección a la que se dirije el coche.
+        Versión original que reserva dos fotogramas en cada llamada; LaneFollower usa
+        ahora HeadingOverlay (overlay.py) y se mantiene como referencia '''
     
     heading_image = np.zeros_like(frame)
     height, width, _ = frame.shape
 
-    steering_angle_radian = steering_angle / 180.0 * math.pi
-    x1 = int(width / 2)
-    y1 = height
-    x2 = int(x1 - height / 2 / math.tan(steering_angle_radian))
-    y2 = int(height / 2)
-
-    cv2.line(heading_image, (x1, y1), (x2, y2), line_color, line_width)
+    start, end = heading_line_points(steering_angle, width, height)
+    cv2.line(heading_image, start, end, line_color, line_width)
     heading_image = cv2.addWeighted(frame, 0.8, heading_image, 1, 1)
 
     return heading_image
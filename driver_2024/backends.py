@@ -0,0 +1,140 @@
+#------------------------------------------------------------------------------
+# Backends de inferencia para los modelos .tflite del coche:
+# - edgetpu: intérprete de pycoral sobre el Coral USB Accelerator
+# - cpu: intérprete de tflite_runtime / ai_edge_litert / tf.lite con XNNPACK
+# - mock: intérprete falso que no carga el modelo, para pruebas sin hardware
+# El backend se escoge en el fichero config (inference_backend) y los hilos
+# de la CPU con inference_threads. Con edgetpu, los intérpretes que reciben el
+# mismo delegado comparten el contexto del acelerador (ver runner.py).
+#------------------------------------------------------------------------------
+
+import logging
+import numpy as np
+import settings
+
+BACKENDS = ('edgetpu', 'cpu', 'mock')
+
+# Descripción de los tensores de cada modelo, usada por el backend mock
+LANE_MODEL_SPEC = {
+    'inputs': [('input', (1, 66, 200, 3), np.float32, (0.0, 0))],
+    'outputs': [('steering_angle', (1, 1), np.float32, (0.0, 0))],
+}
+
+SIGNAL_MODEL_SPEC = {
+    'inputs': [('input', (1, 320, 320, 3), np.uint8, (1.0 / 255, 0))],
+    'outputs': [('scores', (1, 10), np.float32, (0.0, 0)),
+                ('boxes', (1, 10, 4), np.float32, (0.0, 0)),
+                ('count', (1,), np.float32, (0.0, 0)),
+                ('classes', (1, 10), np.float32, (0.0, 0))],
+}
+
+
+class MockInterpreter(object):
+    ''' Imita la interfaz de tf.lite.Interpreter con tensores a cero '''
+
+    def __init__(self, spec):
+        self._tensors = {}
+        self._input_details = self._make_details(spec['inputs'], 0)
+        self._output_details = self._make_details(spec['outputs'], len(spec['inputs']))
+        self.invocations = 0
+
+    def _make_details(self, tensors, first_index):
+        details = []
+        for i, (name, shape, dtype, quantization) in enumerate(tensors):
+            index = first_index + i
+            details.append({'name': name,
+                            'index': index,
+                            'shape': np.array(shape, dtype=np.int32),
+                            'dtype': dtype,
+                            'quantization': quantization})
+            self._tensors[index] = np.zeros(shape, dtype=dtype)
+        return details
+
+    def allocate_tensors(self):
+        pass
+
+    def get_input_details(self):
+        return self._input_details
+
+    def get_output_details(self):
+        return self._output_details
+
+    def set_tensor(self, index, value):
+        np.copyto(self._tensors[index], value, casting='unsafe')
+
+    def get_tensor(self, index):
+        return self._tensors[index].copy()
+
+    def tensor(self, index):
+        return lambda: self._tensors[index]
+
+    def invoke(self):
+        self.invocations += 1
+
+
+def _cpu_interpreter_class():
+    ''' Busca un intérprete de TensorFlow Lite para CPU entre los paquetes instalados '''
+
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        import tensorflow as tf
+        return tf.lite.Interpreter
+    except ImportError:
+        raise ImportError('No se encontró ai_edge_litert, tflite_runtime ni tensorflow para el backend cpu')
+
+
+def make_interpreter(model_path, spec=None, backend=None, num_threads=None, device=None, delegate=None):
+    ''' Crea el intérprete del modelo con el backend indicado o el del fichero config '''
+
+    if backend is None:
+        backend = settings.get('inference_backend', 'edgetpu')
+    if num_threads is None:
+        num_threads = settings.get('inference_threads', 4, int)
+
+    logging.info(f"Cargando {model_path} con el backend {backend}")
+
+    if backend == 'edgetpu':
+        from pycoral.utils import edgetpu
+        interpreter = edgetpu.make_interpreter(model_path, device=device, delegate=delegate)
+    elif backend == 'cpu':
+        # XNNPACK viene activado por defecto en los intérpretes de CPU
+        Interpreter = _cpu_interpreter_class()
+        interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+    elif backend == 'mock':
+        if spec is None:
+            raise ValueError('El backend mock necesita la descripción de los tensores del modelo')
+        interpreter = MockInterpreter(spec)
+    else:
+        raise ValueError(f"Backend de inferencia desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+def load_edgetpu_delegate(device=None):
+    ''' Delegado del Edge TPU para compartirlo entre varios intérpretes '''
+
+    from pycoral.utils import edgetpu
+    return edgetpu.load_edgetpu_delegate({'device': device} if device else None)
+
+
+def input_tensor(interpreter, index=0):
+    ''' Vista sobre el tensor de entrada sin la dimensión del lote '''
+
+    tensor_index = interpreter.get_input_details()[index]['index']
+    return interpreter.tensor(tensor_index)()[0]
+
+
+def set_input(interpreter, data):
+    ''' Copia los datos en el tensor de entrada (equivale a pycoral.adapters.common.set_input) '''
+
+    input_tensor(interpreter)[:, :] = data
@@ -0,0 +1,281 @@
+#------------------------------------------------------------------------------
+# Comportamiento del coche ante cada señal, leído de behaviors.json (o de un
+# YAML si está instalado PyYAML) en lugar de una clase por señal. Cada regla va
+# por el nombre de la etiqueta de labelmap.txt y da la prioridad, el tiempo de
+# espera entre dos disparos, la condición (en marcha o parado) y los pasos de la
+# línea temporal. Las reglas se validan y se compilan al arrancar en una lista
+# indexada por el id de clase: al detectar una señal solo queda crear su línea.
+# Valores especiales: $speed (velocidad al ver la señal), $straight (ángulo
+# recto) y $meter (segundos para recorrer un metro; parado, stopped_seconds).
+#------------------------------------------------------------------------------
+
+import json
+import logging
+import os
+import time
+import settings
+from actions import Timeline
+from leds import get_controller
+from signals import (Signal, set_speed, set_following, turn,
+                     PRIORIDAD_BAJA, PRIORIDAD_MANIOBRA, PRIORIDAD_STOP, PRIORIDAD_SEMAFORO)
+
+BEHAVIORS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'behaviors.json')
+
+PRIORIDADES = {'baja': PRIORIDAD_BAJA,
+               'maniobra': PRIORIDAD_MANIOBRA,
+               'stop': PRIORIDAD_STOP,
+               'semaforo': PRIORIDAD_SEMAFORO}
+
+CONDITIONS = {'always': lambda context: True,
+              'moving': lambda context: context['speed'] > 0,
+              'stopped': lambda context: context['speed'] <= 0}
+
+CONTEXT = ('speed', 'straight', 'meter')
+
+NEGRO = (0, 0, 0)
+
+# En un metro tarda 10 segundos con una velocidad de 20
+DEFAULT_CONSTANTS = {'meter_seconds': 10, 'meter_speed': 20, 'stopped_seconds': 5}
+
+
+def _speed(timeline, offset, car, leds, value):
+    timeline.at(offset, set_speed, car, value)
+
+
+def _follow(timeline, offset, car, leds, value):
+    timeline.at(offset, set_following, car, bool(value))
+
+
+def _turn(timeline, offset, car, leds, value):
+    timeline.at(offset, turn, car, value)
+
+
+def _ramp_speed(timeline, offset, car, leds, to, duration, steps=5, **kwargs):
+    initial = kwargs.get('from')
+    timeline.ramp(offset, lambda speed: set_speed(car, speed), initial, to, duration, steps)
+
+
+def _steer_sequence(timeline, offset, car, leds, values, interval):
+    timeline.sequence(offset, lambda angle: turn(car, angle), values, interval)
+
+
+def _lights(timeline, offset, car, leds, color):
+    timeline.at(offset, leds.fill, color)
+
+
+def _lights_off(timeline, offset, car, leds):
+    timeline.at(offset, leds.off)
+
+
+def _blink(timeline, offset, car, leds, pattern, until):
+    timeline.pattern(offset, until, leds.show, pattern)
+
+
+def toggle_lights(car, leds, color):
+    car.lights = not car.lights
+    leds.fill(color if car.lights else NEGRO)
+
+
+def _toggle_lights(timeline, offset, car, leds, color):
+    # El cambio de estado va en el paso: si la acción se descarta, las luces no cambian
+    timeline.at(offset, toggle_lights, car, leds, color)
+
+
+# Acción: (función, parámetros obligatorios, opcionales, usa los leds, admitida en on_cancel)
+ACTIONS = {'speed': (_speed, ('value',), (), False, True),
+           'follow': (_follow, ('value',), (), False, True),
+           'turn': (_turn, ('value',), (), False, True),
+           'ramp_speed': (_ramp_speed, ('from', 'to', 'duration'), ('steps',), False, False),
+           'steer_sequence': (_steer_sequence, ('values', 'interval'), (), False, False),
+           'lights': (_lights, ('color',), (), True, True),
+           'lights_off': (_lights_off, (), (), True, True),
+           'blink': (_blink, ('pattern', 'until'), (), True, False),
+           'toggle_lights': (_toggle_lights, ('color',), (), True, False)}
+
+
+class _CancelSteps(object):
+    ''' Hace que las acciones de on_cancel se añadan como pasos de cancelación '''
+
+    def __init__(self, timeline):
+        self.timeline = timeline
+
+    def at(self, offset, function, *args):
+        self.timeline.on_cancel(function, *args)
+
+
+class Behavior(Signal):
+    ''' Regla ya compilada de una señal '''
+
+    def __init__(self, label, priority, exclusive, when, cooldown, log, steps, cancel_steps,
+                 constants, clock=time.monotonic):
+        self.label = label
+        self.priority = priority
+        self.exclusive = exclusive
+        self.when = when
+        self.cooldown = cooldown
+        self.log = log
+        self.steps = steps
+        self.cancel_steps = cancel_steps
+        self.constants = constants
+        self.clock = clock
+        self.last_fired = None
+
+    def context(self, car):
+        speed = car.back_wheels._speed
+        if speed > 0:
+            meter = self.constants['meter_seconds'] * self.constants['meter_speed'] / speed
+        else:
+            meter = self.constants['stopped_seconds']
+        return {'speed': speed, 'straight': car.STRAIGHT_ANGLE, 'meter': meter}
+
+    def timeline(self, car):
+        now = self.clock()
+        if self.last_fired is not None and now - self.last_fired < self.cooldown:
+            return None
+
+        context = self.context(car)
+        if not self.when(context):
+            return None
+        if self.log:
+            logging.debug(self.log)
+
+        leds = get_controller()
+        timeline = Timeline(self.label, self.priority, self.exclusive)
+        for emit in self.steps:
+            emit(timeline, car, leds, context)
+        cancel = _CancelSteps(timeline)
+        for emit in self.cancel_steps:
+            emit(cancel, car, leds, context)
+
+        if not timeline.steps:
+            return None
+        # La espera entre disparos cuenta desde que la acción empieza, no desde que se
+        # crea: si el ejecutor la descarta, la señal puede volver a intentarlo
+        timeline.steps.insert(0, (0, self._fired, ()))
+        return timeline
+
+    def _fired(self):
+        self.last_fired = self.clock()
+
+
+class BehaviorTable(object):
+    ''' Reglas de behaviors.json validadas y compiladas, por nombre de etiqueta '''
+
+    def __init__(self, spec, clock=time.monotonic):
+        self.constants = dict(DEFAULT_CONSTANTS, **spec.get('constants', {}))
+        self.colors = {name: tuple(color) for name, color in spec.get('colors', {}).items()}
+        self.patterns = {name: [(tuple(self._color(color, name) for color in colors), duration)
+                                for colors, duration in frames]
+                         for name, frames in spec.get('patterns', {}).items()}
+        self.behaviors = {str(label): self._compile_rule(str(label), rule, clock)
+                          for label, rule in spec.get('behaviors', {}).items()}
+
+    def _color(self, color, where):
+        if isinstance(color, str):
+            if color not in self.colors:
+                raise ValueError(f"{where}: color desconocido {color}")
+            return self.colors[color]
+        return tuple(color)
+
+    def _value(self, value, where):
+        ''' Función del contexto que devuelve el valor, resolviendo $speed, $straight y $meter '''
+
+        if isinstance(value, str) and value.startswith('$'):
+            name = value[1:]
+            if name not in CONTEXT:
+                raise ValueError(f"{where}: valor desconocido {value} (opciones: ${', $'.join(CONTEXT)})")
+            return lambda context: context[name]
+        return lambda context: value
+
+    def _compile_step(self, step, where, cancel=False):
+        step = dict(step)
+        action = step.pop('do', None)
+        if action not in ACTIONS:
+            raise ValueError(f"{where}: acción desconocida {action} (opciones: {', '.join(ACTIONS)})")
+        function, required, optional, uses_leds, cancelable = ACTIONS[action]
+        if cancel and not cancelable:
+            raise ValueError(f"{where}: {action} no se admite en on_cancel")
+
+        offset = self._value(step.pop('at', 0), where)
+        when = step.pop('when', 'always')
+        if when not in CONDITIONS:
+            raise ValueError(f"{where}: condición desconocida {when} (opciones: {', '.join(CONDITIONS)})")
+        condition = CONDITIONS[when]
+
+        missing = [name for name in required if name not in step]
+        unknown = [name for name in step if name not in required + optional]
+        if missing or unknown:
+            raise ValueError(f"{where}: {action} necesita {', '.join(required) or 'ningún parámetro'}"
+                             f" (faltan: {missing}, sobran: {unknown})")
+
+        # Colores y patrones se resuelven ya; el resto puede depender del contexto
+        params = {}
+        for name, value in step.items():
+            if name == 'color':
+                color = self._color(value, where)
+                params[name] = lambda context, color=color: color
+            elif name == 'pattern':
+                if value not in self.patterns:
+                    raise ValueError(f"{where}: patrón desconocido {value}")
+                pattern = self.patterns[value]
+                params[name] = lambda context, pattern=pattern: pattern
+            else:
+                params[name] = self._value(value, where)
+        params = tuple(params.items())
+
+        def emit(timeline, car, leds, context):
+            if not condition(context) or (uses_leds and not leds.available):
+                return
+            function(timeline, offset(context), car, leds,
+                     **{name: resolve(context) for name, resolve in params})
+
+        return emit
+
+    def _compile_rule(self, label, rule, clock):
+        where = f"Señal {label}"
+        priority = rule.get('priority', 'baja')
+        if not isinstance(priority, int):
+            if priority not in PRIORIDADES:
+                raise ValueError(f"{where}: prioridad desconocida {priority} (opciones: {', '.join(PRIORIDADES)})")
+            priority = PRIORIDADES[priority]
+        when = rule.get('when', 'always')
+        if when not in CONDITIONS:
+            raise ValueError(f"{where}: condición desconocida {when} (opciones: {', '.join(CONDITIONS)})")
+
+        steps = [self._compile_step(step, f"{where}, paso {i}") for i, step in enumerate(rule.get('steps', []))]
+        cancel_steps = [self._compile_step(step, f"{where}, on_cancel {i}", cancel=True)
+                        for i, step in enumerate(rule.get('on_cancel', []))]
+
+        return Behavior(label, priority, rule.get('exclusive', True), CONDITIONS[when],
+                        float(rule.get('cooldown', 0)), rule.get('log'), steps, cancel_steps,
+                        self.constants, clock)
+
+    def compile(self, labels):
+        ''' Lista indexada por id de clase (None para las señales sin regla) '''
+
+        table = [self.behaviors.get(label) for label in labels]
+        for label in labels:
+            if label not in self.behaviors:
+                logging.warning(f"La señal {label} no tiene comportamiento, se ignora")
+        for label in self.behaviors:
+            if label not in labels:
+                logging.warning(f"El comportamiento {label} no corresponde a ninguna etiqueta de labelmap.txt")
+        return table
+
+
+def read_spec(path):
+    with open(path, 'r') as f:
+        if path.endswith(('.yaml', '.yml')):
+            # PyYAML es opcional: solo hace falta para escribir las reglas en YAML
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def load_behaviors(path=None, clock=time.monotonic):
+    ''' Reglas del fichero behaviors (por defecto, driver_2024/behaviors.json) '''
+
+    if path is None:
+        path = settings.get('behaviors', BEHAVIORS_PATH)
+    logging.info(f"Cargando los comportamientos de {path}")
+    return BehaviorTable(read_spec(path), clock)
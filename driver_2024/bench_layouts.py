@@ -0,0 +1,298 @@
+#------------------------------------------------------------------------------
+# Compara dos formas de repartir captura, carril y señales:
+# - threads: las tres etapas en hilos de un mismo proceso unidas por colas de un
+#   solo hueco (pipeline.py), como en SmartPiCar
+# - processes: cada etapa en su propio proceso; la captura publica en el anillo
+#   de memoria compartida (frame_ring.py) y los lectores usan el fotograma sin
+#   copiarlo
+# La captura lee fotogramas grabados a la cadencia de la cámara y puede añadir
+# trabajo en Python puro por fotograma (--python-load-ms) para imitar el registro
+# y el control que compiten por el GIL. Muestra en JSON los ángulos por segundo,
+# la latencia desde la captura hasta el ángulo (p50/p95/p99), las detecciones
+# por segundo, los fotogramas perdidos o pisados y los lectores parados.
+# Uso:
+#   python3 bench_layouts.py --seconds 10 --backend cpu
+#   python3 bench_layouts.py --layouts processes --python-load-ms 10 --fps 60
+#------------------------------------------------------------------------------
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import numpy as np
+import settings
+from backends import make_interpreter, LANE_MODEL_SPEC, SIGNAL_MODEL_SPEC
+from frame_ring import FrameRing
+from hal import FileCamera
+from pipeline import Frame, Pipeline
+from postprocessing import DetectionPostprocessor, SteeringPostprocessor
+from preprocessing import LanePreprocessor, SignalPreprocessor
+from roi import RoiLayout
+
+LAYOUTS = ('threads', 'processes')
+
+LANE_CONSUMER = 0
+SIGNS_CONSUMER = 1
+
+
+def python_load(milliseconds):
+    ''' Trabajo en Python puro que retiene el GIL durante unos milisegundos '''
+
+    end = time.perf_counter() + milliseconds / 1000
+    total = 0
+    while time.perf_counter() < end:
+        for i in range(200):
+            total += i * i
+    return total
+
+
+def lane_step(lane_model, backend):
+    ''' Función que calcula el ángulo de un fotograma, con el preprocesado del coche '''
+
+    interpreter = make_interpreter(lane_model, LANE_MODEL_SPEC, backend)
+    preprocessor = LanePreprocessor(interpreter)
+    postprocessor = SteeringPostprocessor(interpreter)
+
+    def step(image):
+        preprocessor(image)
+        interpreter.invoke()
+        return postprocessor()
+    return step
+
+
+def signs_step(signal_model, backend):
+    ''' Función que detecta las señales de un fotograma en todas las ventanas configuradas '''
+
+    interpreter = make_interpreter(signal_model, SIGNAL_MODEL_SPEC, backend)
+    preprocessor = SignalPreprocessor(interpreter)
+    postprocessor = DetectionPostprocessor(interpreter)
+    layout = RoiLayout.from_settings()
+
+    def step(image):
+        height, width = image.shape[:2]
+        for window in layout.windows(width, height, preprocessor.width, preprocessor.height):
+            preprocessor(image, window)
+            interpreter.invoke()
+            postprocessor.collect(window)
+        return postprocessor()
+    return step
+
+
+def _summary(latencies, detections, seconds):
+    latencies = np.asarray(latencies) * 1000
+    summary = {'angles': int(latencies.size),
+               'angles_per_sec': latencies.size / seconds,
+               'detections_per_sec': detections / seconds}
+    if latencies.size:
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+        summary.update({'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99),
+                        'max_ms': float(latencies.max())})
+    return summary
+
+
+# Hilos
+
+def run_threads(source, seconds, fps, load_ms, lane_model, signal_model, backend):
+    camera = FileCamera(source, fps=fps)
+    lane = lane_step(lane_model, backend)
+    signs = signs_step(signal_model, backend)
+    latencies = []
+    detections = [0]
+    seq = [0]
+
+    def capture():
+        ok, image = camera.read()
+        if not ok:
+            return None
+        frame = Frame.publish(seq[0], image)
+        seq[0] += 1
+        python_load(load_ms)
+        return frame
+
+    def steer(frame):
+        lane(frame.image)
+        latencies.append(time.monotonic() - frame.timestamp('capture'))
+
+    def detect(frame):
+        signs(frame.image)
+        detections[0] += 1
+
+    pipeline = Pipeline()
+    pipeline.add_stage('capture', capture, outputs=('lane', 'signs'))
+    pipeline.add_stage('lane', steer, source='lane')
+    pipeline.add_stage('signs', detect, source='signs')
+
+    start = time.monotonic()
+    pipeline.start()
+    time.sleep(seconds)
+    pipeline.stop()
+    elapsed = time.monotonic() - start
+
+    stats = pipeline.stats()
+    result = _summary(latencies, detections[0], elapsed)
+    result.update({'layout': 'threads',
+                   'captured': seq[0],
+                   'dropped': stats['dropped']})
+    return result
+
+
+# Procesos
+
+def _consumer(name, consumer, make_step, model, backend, ready, stop, results):
+    ring = FrameRing.attach(name)
+    step = make_step(model, backend)
+    ring.register(consumer)
+    ready.set()
+
+    latencies = []
+    processed = 0
+    overruns = 0
+    while not stop.is_set():
+        frame = ring.read(consumer, timeout=0.1)
+        if frame is None:
+            continue
+        step(frame.image)
+        # El fotograma se usa sin copiarlo: si lo pisaron durante el preprocesado, no vale
+        if not ring.valid(frame, consumer):
+            overruns += 1
+            continue
+        latencies.append(time.monotonic() - frame.timestamp)
+        processed += 1
+
+    ring.unregister(consumer)
+    ring.close()
+    results.put((consumer, {'processed': processed, 'overruns': overruns, 'latencies': latencies}))
+
+
+def collect_results(results, workers, timeout):
+    ''' Resultado de cada lector; falla si alguno termina sin enviarlo o no llega a tiempo '''
+
+    outcomes = {}
+    deadline = time.monotonic() + timeout
+    while len(outcomes) < len(workers):
+        try:
+            consumer, outcome = results.get(timeout=0.5)
+            outcomes[consumer] = outcome
+            continue
+        except queue.Empty:
+            pass
+        missing = [process for consumer, (process, _) in workers.items() if consumer not in outcomes]
+        if all(not process.is_alive() for process in missing):
+            # Terminaron sin dejar nada en la cola (el resultado ya estaría en la tubería)
+            names = ', '.join(f"{process.name} (código {process.exitcode})" for process in missing)
+            raise RuntimeError(f"Los procesos {names} terminaron sin enviar su resultado")
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"Sin resultado de {', '.join(process.name for process in missing)} en {timeout} s")
+    return outcomes
+
+
+def run_processes(source, seconds, fps, load_ms, lane_model, signal_model, backend, slots=4,
+                  stall_seconds=0.5, result_timeout=10.0):
+    camera = FileCamera(source, fps=fps)
+    ring = FrameRing(slots=slots, shape=(camera.size[1], camera.size[0], 3))
+
+    # spawn y no fork: cada proceso carga su propio intérprete y no hereda hilos
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    results = context.Queue()
+    workers = {}
+    for consumer, make_step, model in ((LANE_CONSUMER, lane_step, lane_model),
+                                       (SIGNS_CONSUMER, signs_step, signal_model)):
+        ready = context.Event()
+        process = context.Process(target=_consumer,
+                                  args=(ring.name, consumer, make_step, model, backend, ready, stop, results))
+        process.start()
+        workers[consumer] = (process, ready)
+
+    try:
+        for process, ready in workers.values():
+            while not ready.wait(0.5):
+                if not process.is_alive():
+                    raise RuntimeError(f"El proceso {process.name} terminó antes de empezar")
+
+        # La captura corre en este proceso
+        captured = 0
+        stalled = set()
+        start = time.monotonic()
+        end = start + seconds
+        while time.monotonic() < end:
+            ok, image = camera.read()
+            if not ok:
+                break
+            ring.publish(image)
+            captured += 1
+            python_load(load_ms)
+            stalled.update(ring.stalled(stall_seconds))
+        elapsed = time.monotonic() - start
+        stats = ring.stats()
+        stop.set()
+
+        outcomes = collect_results(results, workers, result_timeout)
+    finally:
+        stop.set()
+        for process, _ in workers.values():
+            process.join(1)
+            if process.is_alive():
+                logging.warning(f"El proceso {process.name} no terminó, se detiene")
+                process.terminate()
+                process.join(1)
+        ring.close()
+        ring.unlink()
+
+    lane = outcomes[LANE_CONSUMER]
+    signs = outcomes[SIGNS_CONSUMER]
+    result = _summary(lane['latencies'], signs['processed'], elapsed)
+    result.update({'layout': 'processes',
+                   'captured': captured,
+                   'overruns': {'lane': lane['overruns'], 'signs': signs['overruns']},
+                   'lag': {('lane' if consumer == LANE_CONSUMER else 'signs'): values['lag']
+                           for consumer, values in stats['consumers'].items()},
+                   'stalled': sorted('lane' if consumer == LANE_CONSUMER else 'signs' for consumer in stalled)})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Etapas del coche en hilos o en procesos')
+    parser.add_argument('--layouts', default=','.join(LAYOUTS), help='disposiciones separadas por comas')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--python-load-ms', type=float, default=5.0,
+                        help='trabajo en Python puro de la captura por fotograma')
+    parser.add_argument('--slots', type=int, default=4, help='huecos del anillo de fotogramas')
+    parser.add_argument('--source', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         '..', 'imagenes', 'test'),
+                        help='vídeo, carpeta o patrón de imágenes grabadas')
+    parser.add_argument('--backend', choices=('edgetpu', 'cpu', 'mock'))
+    parser.add_argument('--output', help='fichero JSON donde guardar el informe')
+    args = parser.parse_args()
+
+    lane_model = settings.get('lane_model', '/home/pi/Smart-Pi-Car/models/lane-navigation-model-finetuned.tflite')
+    signal_model = settings.get('signal_model', '/home/pi/Smart-Pi-Car_2024/models/ultimo.tflite')
+
+    report = {'source': args.source, 'fps': args.fps, 'python_load_ms': args.python_load_ms,
+              'cpus': os.cpu_count(), 'runs': []}
+    for layout in args.layouts.split(','):
+        if layout == 'threads':
+            result = run_threads(args.source, args.seconds, args.fps, args.python_load_ms,
+                                 lane_model, signal_model, args.backend)
+        elif layout == 'processes':
+            result = run_processes(args.source, args.seconds, args.fps, args.python_load_ms,
+                                   lane_model, signal_model, args.backend, args.slots)
+        else:
+            parser.error(f"Disposición desconocida: {layout} (opciones: {', '.join(LAYOUTS)})")
+        report['runs'].append(result)
+        logging.info(f"{layout}: {result['angles_per_sec']:.1f} ángulos/s, p99 {result.get('p99_ms', 0):.1f} ms")
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(asctime)s: %(message)s')
+    main()
@@ -0,0 +1,85 @@
+#------------------------------------------------------------------------------
+# Benchmark del postprocesado de detecciones con 10, 100 y 300 cajas:
+# bucle original de detect_signal frente a postprocessing.postprocess, que elige
+# según las cajas seleccionadas, y a su versión vectorizada sola.
+# Uso: python3 bench_postprocessing.py [repeticiones]
+#------------------------------------------------------------------------------
+
+import sys
+import time
+import numpy as np
+from postprocessing import postprocess, postprocess_vectorized
+
+LABELS = ['stop', '30', '60', 'ceda', 'luces', 'obras', 'recto', 'izq', 'der', 'verde', 'rojo']
+
+
+def original(scores, boxes, classes, threshold=0.6):
+    ''' Bucle de detect_signal antes del postprocesado vectorizado '''
+
+    detections = []
+    for i in range(len(scores)):
+        if ((scores[i] > threshold)):
+            object_name = LABELS[int(classes[i])]
+            detections.append([object_name, scores[i], boxes[i], int(classes[i])])
+    return detections
+
+
+def iou(a, b):
+    h = min(a[2], b[2]) - max(a[0], b[0])
+    w = min(a[3], b[3]) - max(a[1], b[1])
+    if h <= 0 or w <= 0:
+        return 0.0
+    intersection = h * w
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union
+
+
+def original_nms(scores, boxes, classes, threshold=0.6, iou_threshold=0.5, near_height=0.32):
+    ''' El mismo trabajo que postprocess (NMS por clase y orden por proximidad) con bucles de Python '''
+
+    detections = sorted(original(scores, boxes, classes, threshold), key=lambda d: -d[1])
+    kept = []
+    for detection in detections:
+        if all(d[3] != detection[3] or iou(d[2], detection[2]) <= iou_threshold for d in kept):
+            kept.append(detection)
+    return sorted(kept, key=lambda d: -d[1] * min((d[2][2] - d[2][0]) / near_height, 1))
+
+
+def random_outputs(n, rng):
+    ''' Salidas del modelo simuladas, con cajas agrupadas para que la NMS tenga trabajo '''
+
+    centers = rng.uniform(0.1, 0.9, (max(1, n // 5), 2))
+    center = centers[rng.integers(0, len(centers), n)] + rng.normal(0, 0.01, (n, 2))
+    size = rng.uniform(0.05, 0.4, (n, 1))
+    boxes = np.hstack([center - size / 2, center + size / 2]).astype(np.float32)
+    scores = np.sort(rng.uniform(0, 1, n).astype(np.float32))[::-1].copy()
+    classes = rng.integers(0, len(LABELS), n).astype(np.float32)
+    return scores, boxes, classes
+
+
+def vectorized(scores, boxes, classes, threshold=0.6):
+    return postprocess_vectorized(scores, boxes, classes, np.flatnonzero(scores > threshold))
+
+
+def measure(function, args, repetitions):
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        function(*args)
+    return (time.perf_counter() - start) / repetitions * 1e6
+
+
+def main(repetitions):
+    rng = np.random.default_rng(0)
+    for n in (10, 100, 300):
+        args = random_outputs(n, rng)
+        loop_us = measure(original, args, repetitions)
+        loop_nms_us = measure(original_nms, args, repetitions)
+        postprocess_us = measure(postprocess, args, repetitions)
+        vectorized_us = measure(vectorized, args, repetitions)
+        print(f"{n:4d} cajas  bucle sin NMS {loop_us:8.1f} us  bucle con NMS {loop_nms_us:8.1f} us  "
+              f"postprocess {postprocess_us:8.1f} us  vectorizado {vectorized_us:8.1f} us  "
+              f"detecciones {len(original(*args))} -> {len(postprocess(*args))} ({len(original_nms(*args))})")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
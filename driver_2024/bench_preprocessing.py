@@ -0,0 +1,63 @@
+#------------------------------------------------------------------------------
+# Microbenchmark del preprocesado: compara img_preprocess + set_input (versión original)
+# con los preprocesadores de preprocessing.py, en tiempo y en memoria reservada por fotograma.
+# Uso: python3 bench_preprocessing.py [imagen] [repeticiones]
+#------------------------------------------------------------------------------
+
+import sys
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from backends import make_interpreter, set_input, LANE_MODEL_SPEC, SIGNAL_MODEL_SPEC
+from preprocessing import LanePreprocessor, SignalPreprocessor
+from autonomous_driver_2024 import img_preprocess
+
+
+def measure(function, frame, repetitions):
+    ''' Microsegundos por llamada '''
+
+    for _ in range(10):
+        function(frame)
+
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        function(frame)
+    return (time.perf_counter() - start) / repetitions * 1e6
+
+
+def measure_peak(function, frame):
+    ''' Memoria máxima reservada durante una llamada '''
+
+    function(frame)
+    tracemalloc.start()
+    function(frame)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(image_path, repetitions):
+    frame = cv2.imread(image_path) if image_path else None
+    if frame is None:
+        frame = np.random.randint(0, 256, (240, 320, 3), dtype=np.uint8)
+    frame = cv2.resize(frame, (320, 240))
+
+    for name, spec, signal, preprocessor_class in (('lane', LANE_MODEL_SPEC, False, LanePreprocessor),
+                                                    ('signal', SIGNAL_MODEL_SPEC, True, SignalPreprocessor)):
+        interpreter = make_interpreter(None, spec, 'mock')
+        preprocessor = preprocessor_class(interpreter)
+
+        def original(image):
+            set_input(interpreter, img_preprocess(image, signal=signal))
+
+        for label, function in (('img_preprocess', original), ('preprocessor', preprocessor)):
+            us = measure(function, frame, repetitions)
+            peak = measure_peak(function, frame)
+            print(f"{name:7s} {label:15s} {us:9.1f} us/fotograma  {peak / 1024:9.1f} KiB reservados")
+
+
+if __name__ == '__main__':
+    image_path = sys.argv[1] if len(sys.argv) > 1 else '../imagenes/test/test_1.jpg'
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    main(image_path, repetitions)
@@ -0,0 +1,140 @@
+#------------------------------------------------------------------------------
+# Cámara con hilo de captura propio. El hilo vacía continuamente la cola del
+# driver (V4L2) y guarda solo el último fotograma con el instante de captura,
+# de forma que el coche nunca gira con fotogramas atrasados varios buffers.
+# Admite cualquier fuente de cv2.VideoCapture (cámara, vídeo, URL) y lleva la
+# cuenta de fotogramas perdidos y de la latencia desde la captura hasta el giro.
+#------------------------------------------------------------------------------
+
+import logging
+import threading
+import time
+from collections import deque
+from lazy import lazy_import
+cv2 = lazy_import('cv2')
+import numpy as np
+from hal import Camera
+
+
+class ThreadedCamera(Camera):
+
+    def __init__(self,
+                 source=0,
+                 width=320,
+                 height=240,
+                 fourcc='MJPG',
+                 fps=30,
+                 buffer_size=1,
+                 pace=False,
+                 latency_samples=1000):
+        self.source = source
+        self.capture = cv2.VideoCapture(source)
+
+        if fourcc:
+            self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        if width and height:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps:
+            self.capture.set(cv2.CAP_PROP_FPS, fps)
+        if buffer_size:
+            # No todos los backends lo admiten; con V4L2 reduce los buffers en cola
+            self.capture.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+
+        # Con un vídeo, pace imita la cadencia de la cámara en vez de leerlo de golpe
+        self.pace = pace
+        self.fps = fps
+
+        self._condition = threading.Condition()
+        self._frame = None
+        self._timestamp = None
+        self._seq = 0
+        self._read_seq = 0
+        self._running = self.capture.isOpened()
+
+        self.captured = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=latency_samples)
+
+        self._thread = threading.Thread(target=self._run, name='camera', daemon=True)
+        if self._running:
+            self._thread.start()
+        else:
+            logging.error(f"No se pudo abrir la cámara {source}")
+
+    def _run(self):
+        interval = 1.0 / self.fps if self.pace and self.fps else 0
+        next_time = time.monotonic()
+
+        while self._running:
+            if interval:
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_time = max(next_time + interval, time.monotonic())
+
+            # El instante se toma al recoger el fotograma, antes de decodificarlo
+            if not self.capture.grab():
+                break
+            timestamp = time.monotonic()
+            ok, frame = self.capture.retrieve()
+            if not ok:
+                break
+
+            with self._condition:
+                if self._seq > self._read_seq:
+                    self.dropped += 1
+                self._frame = frame
+                self._timestamp = timestamp
+                self._seq += 1
+                self.captured += 1
+                self._condition.notify_all()
+
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+    def read_timestamped(self, timeout=1.0):
+        ''' Espera un fotograma nuevo y devuelve (ok, fotograma, instante de captura) '''
+
+        with self._condition:
+            if self._seq == self._read_seq and self._running:
+                self._condition.wait_for(lambda: self._seq > self._read_seq or not self._running, timeout)
+            if self._seq == self._read_seq:
+                return False, None, None
+            self._read_seq = self._seq
+            return True, self._frame, self._timestamp
+
+    def read(self):
+        ok, frame, _ = self.read_timestamped()
+        return ok, frame
+
+    def report_actuation(self, capture_timestamp, now=None):
+        ''' Anota la latencia entre la captura de un fotograma y el giro calculado con él '''
+
+        if capture_timestamp is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        self.latencies.append(now - capture_timestamp)
+
+    def stats(self):
+        latencies = np.asarray(self.latencies) * 1000
+        stats = {'captured': self.captured, 'dropped': self.dropped}
+        if latencies.size:
+            stats['latency_p50_ms'] = float(np.percentile(latencies, 50))
+            stats['latency_p95_ms'] = float(np.percentile(latencies, 95))
+            stats['latency_max_ms'] = float(latencies.max())
+        return stats
+
+    def isOpened(self):
+        return self._running or self._seq > self._read_seq
+
+    def set(self, prop, value):
+        return self.capture.set(prop, value)
+
+    def release(self):
+        self._running = False
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(1)
+        self.capture.release()
@@ -0,0 +1,280 @@
+#------------------------------------------------------------------------------
+# Evaluación offline de los modelos con un conjunto grabado, sin conducir el coche.
+# - steering: error absoluto medio del ángulo frente a las etiquetas a%03d de los
+#   nombres de fichero de los modos entrenamiento_* (o de un conjunto de recorder.py)
+# - signs: precisión, exhaustividad y AP por clase (clases de labelmap.txt) frente
+#   a un CSV de anotaciones filename,width,height,class,xmin,ymin,xmax,ymax
+# La inferencia se reparte en lotes entre procesos, cada uno con su intérprete,
+# para aprovechar todos los núcleos del servidor.
+# Uso:
+#   python3 evaluate.py steering ../footage --backend cpu
+#   python3 evaluate.py signs ../imagenes/test --annotations anotaciones.csv --backend cpu
+#------------------------------------------------------------------------------
+
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+import settings
+from backends import make_interpreter, LANE_MODEL_SPEC, SIGNAL_MODEL_SPEC
+from preprocessing import LanePreprocessor, SignalPreprocessor
+from postprocessing import DetectionPostprocessor, SteeringPostprocessor, box_iou
+from roi import RoiLayout
+from recorder import DatasetReader
+
+ANGLE_PATTERN = re.compile(r'-a(\d+)\.\w+$')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+FRAME_SIZE = (320, 240)
+
+# Estado de cada proceso: el intérprete se crea una vez por proceso
+_worker = {}
+
+
+def _init_worker(task, model_path, backend, threads):
+    interpreter = make_interpreter(model_path,
+                                   LANE_MODEL_SPEC if task == 'steering' else SIGNAL_MODEL_SPEC,
+                                   backend,
+                                   threads)
+    _worker['task'] = task
+    _worker['interpreter'] = interpreter
+    if task == 'steering':
+        _worker['preprocessor'] = LanePreprocessor(interpreter)
+        _worker['postprocessor'] = SteeringPostprocessor(interpreter)
+    else:
+        _worker['preprocessor'] = SignalPreprocessor(interpreter)
+        # Umbral bajo para recorrer toda la curva; el umbral real se aplica después
+        _worker['postprocessor'] = DetectionPostprocessor(interpreter, threshold=0.05)
+        # Las mismas regiones que en el coche
+        _worker['layout'] = RoiLayout.from_settings()
+    _worker['readers'] = {}
+
+
+def _load(source):
+    ''' Fotograma a partir de una ruta o de (carpeta del conjunto, índice) '''
+
+    if isinstance(source, tuple):
+        directory, i = source
+        readers = _worker.setdefault('readers', {})
+        if directory not in readers:
+            readers[directory] = DatasetReader(directory)
+        image = readers[directory].frame(i)
+    else:
+        image = cv2.imread(source)
+    if image is not None and image.shape[1::-1] != FRAME_SIZE:
+        image = cv2.resize(image, FRAME_SIZE)
+    return image
+
+
+def _run_batch(sources):
+    ''' Inferencia de un lote en el proceso: ángulos o detecciones en píxeles del fotograma '''
+
+    interpreter = _worker['interpreter']
+    preprocessor = _worker['preprocessor']
+    results = []
+    for source in sources:
+        image = _load(source)
+        if image is None:
+            results.append(None)
+            continue
+        if _worker['task'] == 'steering':
+            preprocessor(image)
+            interpreter.invoke()
+            results.append(_worker['postprocessor'].value())
+        else:
+            postprocessor = _worker['postprocessor']
+            for window in _worker['layout'].windows(*FRAME_SIZE, preprocessor.width, preprocessor.height):
+                preprocessor(image, window)
+                interpreter.invoke()
+                postprocessor.collect(window)
+            results.append(postprocessor())
+    return results
+
+
+def run_inference(task, sources, model_path, backend=None, workers=None, batch_size=16):
+    ''' Reparte los lotes entre procesos y devuelve los resultados en orden y las imágenes/s '''
+
+    workers = workers or os.cpu_count()
+    batches = [sources[i:i + batch_size] for i in range(0, len(sources), batch_size)]
+
+    start = time.perf_counter()
+    # Un hilo por intérprete: el paralelismo lo ponen los procesos
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(task, model_path, backend, 1)) as pool:
+        results = [result for batch in pool.map(_run_batch, batches) for result in batch]
+    elapsed = time.perf_counter() - start
+
+    return results, len(sources) / elapsed if elapsed > 0 else 0.0
+
+
+def steering_dataset(path):
+    ''' (fuentes, ángulos) de una carpeta de imágenes etiquetadas o de un conjunto de recorder.py '''
+
+    if os.path.exists(os.path.join(path, 'dataset.json')):
+        reader = DatasetReader(path)
+        return [(path, i) for i in range(len(reader))], reader.index['angle'].astype(np.float64)
+
+    sources, angles = [], []
+    for image_path in sorted(glob.glob(os.path.join(path, '**', '*'), recursive=True)):
+        match = ANGLE_PATTERN.search(os.path.basename(image_path))
+        if match and image_path.lower().endswith(IMAGE_EXTENSIONS):
+            sources.append(image_path)
+            angles.append(float(match.group(1)))
+    return sources, np.array(angles)
+
+
+def evaluate_steering(path, model_path, backend=None, workers=None, batch_size=16):
+    sources, angles = steering_dataset(path)
+    if not sources:
+        raise ValueError(f"No hay imágenes etiquetadas con el ángulo en {path}")
+
+    predictions, images_per_sec = run_inference('steering', sources, model_path, backend, workers, batch_size)
+    valid = np.array([prediction is not None for prediction in predictions])
+    if not valid.any():
+        raise ValueError(f"No se pudo leer ninguna de las {len(sources)} imágenes de {path}")
+    predicted = np.array([int(prediction + 0.5) for prediction in predictions if prediction is not None], dtype=np.float64)
+    errors = np.abs(predicted - angles[valid])
+
+    return {'task': 'steering',
+            'images': int(valid.sum()),
+            'unreadable': int((~valid).sum()),
+            'images_per_sec': images_per_sec,
+            'mae': float(errors.mean()),
+            'rmse': float(np.sqrt((errors ** 2).mean())),
+            'max_error': float(errors.max()),
+            'within_3_deg': float((errors <= 3).mean())}
+
+
+def read_annotations(path, labels):
+    ''' Cajas reales por imagen, en píxeles del fotograma de 320x240 y con el id de clase de labelmap.txt '''
+
+    annotations = {}
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            name = row['class'].strip()
+            if name not in labels:
+                logging.warning(f"Clase {name} no está en labelmap.txt, se ignora")
+                continue
+            scale_x = FRAME_SIZE[0] / float(row['width'])
+            scale_y = FRAME_SIZE[1] / float(row['height'])
+            box = (float(row['ymin']) * scale_y, float(row['xmin']) * scale_x,
+                   float(row['ymax']) * scale_y, float(row['xmax']) * scale_x)
+            annotations.setdefault(row['filename'], []).append((labels.index(name), box))
+    return annotations
+
+
+def average_precision(recall, precision):
+    ''' Área bajo la curva precisión-exhaustividad interpolada (como en Pascal VOC) '''
+
+    recall = np.concatenate([[0.0], recall, [1.0]])
+    precision = np.concatenate([[0.0], precision, [0.0]])
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    changes = np.flatnonzero(recall[1:] != recall[:-1])
+    return float(np.sum((recall[changes + 1] - recall[changes]) * precision[changes + 1]))
+
+
+def evaluate_signs(images_dir, annotations_path, model_path, labels, backend=None, workers=None,
+                   batch_size=16, threshold=0.6, iou_threshold=0.5):
+    annotations = read_annotations(annotations_path, labels)
+    filenames = sorted(annotations)
+    sources = [os.path.join(images_dir, filename) for filename in filenames]
+
+    outputs, images_per_sec = run_inference('signs', sources, model_path, backend, workers, batch_size)
+
+    # Por clase: (confianza, acierto) de cada detección y número de cajas reales
+    scored = {class_id: [] for class_id in range(len(labels))}
+    positives = np.zeros(len(labels), dtype=np.int64)
+
+    for filename, detections in zip(filenames, outputs):
+        truth = annotations[filename]
+        truth_classes = np.array([class_id for class_id, _ in truth])
+        truth_boxes = np.array([box for _, box in truth], dtype=np.float32)
+        np.add.at(positives, truth_classes, 1)
+        if detections is None:
+            continue
+
+        matched = np.zeros(len(truth), dtype=bool)
+        for detection in detections[np.argsort(-detections['score'])]:
+            box = np.array([[detection['ymin'], detection['xmin'], detection['ymax'], detection['xmax']]],
+                           dtype=np.float32)
+            same_class = truth_classes == detection['class_id']
+            hit = False
+            if same_class.any():
+                iou = box_iou(np.concatenate([box, truth_boxes]))[0, 1:]
+                iou[~same_class | matched] = 0
+                best = int(np.argmax(iou))
+                if iou[best] >= iou_threshold:
+                    matched[best] = True
+                    hit = True
+            scored[int(detection['class_id'])].append((float(detection['score']), hit))
+
+    per_class = {}
+    for class_id, name in enumerate(labels):
+        detections = np.array(sorted(scored[class_id], key=lambda item: -item[0]), dtype=np.float64).reshape(-1, 2)
+        hits = detections[:, 1]
+        true_positives = np.cumsum(hits)
+        false_positives = np.cumsum(1 - hits)
+        recall = true_positives / max(positives[class_id], 1)
+        precision = true_positives / np.maximum(true_positives + false_positives, 1)
+
+        above = detections[:, 0] > threshold
+        tp_at_threshold = hits[above].sum()
+        per_class[name] = {'ground_truth': int(positives[class_id]),
+                           'precision': float(tp_at_threshold / above.sum()) if above.any() else 0.0,
+                           'recall': float(tp_at_threshold / positives[class_id]) if positives[class_id] else 0.0,
+                           'ap': average_precision(recall, precision) if positives[class_id] else None}
+
+    aps = [metrics['ap'] for metrics in per_class.values() if metrics['ap'] is not None]
+    return {'task': 'signs',
+            'images': len(filenames),
+            'images_per_sec': images_per_sec,
+            'iou_threshold': iou_threshold,
+            'threshold': threshold,
+            'map': float(np.mean(aps)) if aps else 0.0,
+            'classes': per_class}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluación offline de los modelos del coche')
+    parser.add_argument('task', choices=('steering', 'signs'))
+    parser.add_argument('dataset', help='carpeta con las imágenes (o conjunto de recorder.py para steering)')
+    parser.add_argument('--annotations', help='CSV de anotaciones de las señales')
+    parser.add_argument('--model', help='por defecto, el del fichero config')
+    parser.add_argument('--labelmap', help='por defecto, el del fichero config')
+    parser.add_argument('--backend', choices=('edgetpu', 'cpu', 'mock'))
+    parser.add_argument('--workers', type=int, help='procesos; por defecto, uno por núcleo')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', help='fichero JSON donde guardar el informe')
+    args = parser.parse_args()
+
+    if args.task == 'steering':
+        model_path = args.model or settings.get('lane_model', '/home/pi/Smart-Pi-Car/models/lane-navigation-model-finetuned.tflite')
+        report = evaluate_steering(args.dataset, model_path, args.backend, args.workers, args.batch_size)
+    else:
+        if not args.annotations:
+            parser.error('signs necesita --annotations')
+        model_path = args.model or settings.get('signal_model', '/home/pi/Smart-Pi-Car_2024/models/ultimo.tflite')
+        labelmap_path = args.labelmap or settings.get('labelmap', settings.LABELMAP_PATH)
+        with open(labelmap_path) as f:
+            labels = [line.strip() for line in f.readlines()]
+        report = evaluate_signs(args.dataset, args.annotations, model_path, labels, args.backend,
+                                args.workers, args.batch_size)
+
+    report['model'] = model_path
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
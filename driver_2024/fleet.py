@@ -0,0 +1,506 @@
+#------------------------------------------------------------------------------
+# Servidor de inferencia para varios coches en la misma pista. Un solo equipo
+# carga el modelo del carril y el detector de señales y los coches le envían
+# sus fotogramas por TCP (en bruto o en JPEG) con un plazo por petición:
+# - las peticiones de todos los coches se agrupan en lotes dinámicos: se espera
+#   a más peticiones solo mientras no peligre el plazo de la más urgente, y las
+#   que llegan fuera de plazo se devuelven sin calcular
+# - con la CPU el modelo del carril procesa el lote en una sola inferencia
+#   (intérpretes de 1, 2, 4... imágenes); el detector de señales, de tamaño
+#   fijo, recorre el lote imagen a imagen
+# - cada coche conserva su estado: su controlador de la dirección, con su
+#   curr_steering_angle, y su tracker de señales
+# Las acciones de las señales las sigue ejecutando cada coche con lo que recibe.
+# Uso:
+#   python3 fleet.py --port 8770 --backend cpu --max-batch 8
+# y en los coches FleetClient(host, 8770, 'picar-1'). Ver fleet_bench.py.
+#------------------------------------------------------------------------------
+
+import argparse
+import logging
+import socket
+import struct
+import threading
+import time
+from lazy import lazy_import
+cv2 = lazy_import('cv2')
+import numpy as np
+import settings
+import metrics
+from actions import ActionExecutor
+from autonomous_driver_2024 import LaneFollower, TrafficSignDetector
+from backends import make_interpreter, LANE_MODEL_SPEC
+from runner import ModelRunner
+from preprocessing import LanePreprocessor
+from postprocessing import SteeringPostprocessor, DETECTION_DTYPE
+from tracker import SignTracker, TRACK_DTYPE
+
+TASK_LANE = 0
+TASK_SIGNS = 1
+TASKS = {TASK_LANE: 'lane', TASK_SIGNS: 'signs'}
+
+ENCODING_RAW = 0
+ENCODING_JPEG = 1
+
+STATUS_OK = 0
+STATUS_EXPIRED = 1
+STATUS_ERROR = 2
+
+# Cada mensaje va precedido de su longitud
+LENGTH = struct.Struct('!I')
+# Petición: número, tarea, codificación, ancho, alto, plazo en ms
+REQUEST = struct.Struct('!IBBHHf')
+# Respuesta: número, tarea, estado, ángulo, ms en el servidor, detecciones, señales confirmadas
+RESPONSE = struct.Struct('!IBBhfHH')
+# Ningún mensaje legítimo supera una petición con un fotograma de 640x480 en bruto
+MAX_MESSAGE = REQUEST.size + 640 * 480 * 3
+
+
+def _recv_exact(connection, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = connection.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError('Conexión cerrada')
+        received += n
+    return buffer
+
+
+def _recv_message(connection):
+    (size,) = LENGTH.unpack(_recv_exact(connection, LENGTH.size))
+    # La longitud viene del otro extremo: se comprueba antes de reservar nada
+    if size > MAX_MESSAGE:
+        logging.warning(f"Mensaje de {size} bytes (máximo {MAX_MESSAGE}), se cierra la conexión")
+        raise ConnectionError(f'Mensaje demasiado largo: {size} bytes')
+    return _recv_exact(connection, size)
+
+
+def _send_message(connection, *parts):
+    connection.sendmsg([LENGTH.pack(sum(len(part) for part in parts))] + list(parts))
+
+
+class _Request(object):
+    __slots__ = ('client', 'seq', 'task', 'image', 'received', 'deadline')
+
+    def __init__(self, client, seq, task, image, received, deadline):
+        self.client = client
+        self.seq = seq
+        self.task = task
+        self.image = image
+        self.received = received
+        self.deadline = deadline
+
+
+class ClientState(object):
+    ''' Estado de un coche en el servidor; se conserva si el coche se vuelve a conectar '''
+
+    def __init__(self, name, clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.curr_steering_angle = 90
+        self.controller = LaneFollower.make_controller(self.curr_steering_angle, clock)
+        self.tracker = SignTracker()
+        self.connection = None
+        self.send_lock = threading.Lock()
+
+    def steer(self, measured, timestamp):
+        self.curr_steering_angle = self.controller.update(measured, timestamp)
+        return self.curr_steering_angle
+
+    def respond(self, request, status, angle=-1, detections=None, confirmed=None):
+        detections = np.empty(0, dtype=DETECTION_DTYPE) if detections is None else detections
+        confirmed = np.empty(0, dtype=TRACK_DTYPE) if confirmed is None else confirmed
+        header = RESPONSE.pack(request.seq, request.task, status, angle,
+                               (self.clock() - request.received) * 1000, len(detections), len(confirmed))
+        with self.send_lock:
+            if self.connection is None:
+                return
+            try:
+                _send_message(self.connection, header, detections.tobytes(), confirmed.tobytes())
+            except OSError:
+                logging.debug(f"No se pudo responder a {self.name}")
+
+
+class BatchedLaneModel(object):
+    ''' Modelo del carril para lotes: las imágenes sueltas van por el LaneFollower y,
+        si el modelo admite lote variable y se ejecuta en la CPU, hay además un
+        intérprete por tamaño (2, 4... hasta max_batch) '''
+
+    def __init__(self, follower, model_path, max_batch=8):
+        self.follower = follower
+        runner = follower.runner
+        self._sizes = {1: None}
+
+        details = follower.interpreter.get_input_details()[0]
+        signature = details.get('shape_signature')
+        if runner.backend == 'cpu' and signature is not None and signature[0] == -1:
+            size = 2
+            while size <= max_batch:
+                batched = make_interpreter(model_path, LANE_MODEL_SPEC, runner.backend)
+                batched.resize_tensor_input(details['index'], [size] + [int(d) for d in details['shape'][1:]])
+                batched.allocate_tensors()
+                self._sizes[size] = (batched, LanePreprocessor(batched), SteeringPostprocessor(batched))
+                size *= 2
+        self.max_batch = max(self._sizes)
+
+    def __call__(self, images):
+        ''' Ángulos (sin estabilizar) de las imágenes '''
+
+        angles = []
+        for start in range(0, len(images), self.max_batch):
+            chunk = images[start:start + self.max_batch]
+            size = min(size for size in self._sizes if size >= len(chunk))
+            if size == 1:
+                angles.append(self.follower.compute_steering_angle(chunk[0]))
+                continue
+            interpreter, preprocessor, postprocessor = self._sizes[size]
+            for i, image in enumerate(chunk):
+                preprocessor(image, index=i)
+            interpreter.invoke()
+            angles.extend(int(angle) for angle in postprocessor.angles(len(chunk)))
+        return angles
+
+
+class MicroBatcher(object):
+    ''' Cola de un modelo compartida por todos los coches. Espera a juntar max_batch
+        peticiones como mucho max_wait segundos, y menos si el plazo de la más urgente
+        no deja margen para calcular el lote (estimado con el coste medio por imagen) '''
+
+    def __init__(self, name, run_batch, max_batch=8, max_wait=0.005, clock=time.monotonic):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.clock = clock
+        self.cost = 0.0  # segundos por imagen, media exponencial
+        self._metrics = metrics.get_metrics()
+        self._queue = []
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"fleet-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, request):
+        with self._condition:
+            self._queue.append(request)
+            self._condition.notify()
+
+    def _next_batch(self):
+        with self._condition:
+            while self._running and not self._queue:
+                self._condition.wait()
+            if not self._running:
+                return None
+
+            while len(self._queue) < self.max_batch:
+                earliest = min(request.deadline for request in self._queue)
+                limit = min(self._queue[0].received + self.max_wait,
+                            earliest - self.cost * (len(self._queue) + 1))
+                remaining = limit - self.clock()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            # Las más urgentes primero
+            self._queue.sort(key=lambda request: request.deadline)
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+
+            now = self.clock()
+            live = []
+            for request in batch:
+                if request.deadline < now:
+                    self._metrics.count('fleet_expired', label=self.name)
+                    request.client.respond(request, STATUS_EXPIRED)
+                else:
+                    live.append(request)
+            if not live:
+                continue
+
+            start = metrics.now()
+            try:
+                self.run_batch(live)
+            except Exception:
+                logging.exception(f"Error en un lote de {self.name}")
+                for request in live:
+                    request.client.respond(request, STATUS_ERROR)
+            elapsed = metrics.now() - start
+            self.cost += 0.2 * (elapsed / len(live) - self.cost)
+
+            self._metrics.observe('fleet_batch', elapsed, self.name)
+            self._metrics.count('fleet_batches', label=self.name)
+            self._metrics.count('fleet_requests', len(live), label=self.name)
+            for request in live:
+                self._metrics.observe('fleet_latency', self.clock() - request.received, self.name)
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join(1)
+
+
+class FleetServer(object):
+    ''' Servidor TCP: un hilo por coche recibe sus fotogramas y un hilo por modelo los calcula '''
+
+    def __init__(self, port=8770, host='127.0.0.1', backend=None, lane_model=None, signal_model=None,
+                 max_batch=8, max_wait=0.005, clock=time.monotonic):
+        if lane_model is None:
+            lane_model = settings.get('lane_model', '/home/pi/Smart-Pi-Car/models/lane-navigation-model-finetuned.tflite')
+        if signal_model is None:
+            signal_model = settings.get('signal_model', '/home/pi/Smart-Pi-Car_2024/models/ultimo.tflite')
+
+        self.clock = clock
+        self.runner = ModelRunner(backend)
+        # Los mismos modelos, preprocesados y reglas que en el coche; el estado de cada
+        # coche (controlador y tracker) va en su ClientState
+        self.lane_follower = LaneFollower(None, lane_model, runner=self.runner, clock=clock)
+        self.lane = BatchedLaneModel(self.lane_follower, lane_model, max_batch)
+        # Las acciones las ejecuta cada coche: el servidor no necesita su hilo
+        self.detector = TrafficSignDetector(None, signal_model, runner=self.runner, clock=clock,
+                                            actions=ActionExecutor(clock, threaded=False))
+
+        self.clients = {}
+        self._clients_lock = threading.Lock()
+        self.batchers = {TASK_LANE: MicroBatcher('lane', self._run_lane, max_batch, max_wait, clock),
+                         TASK_SIGNS: MicroBatcher('signs', self._run_signs, max_batch, max_wait, clock)}
+
+        self._server = socket.create_server((host, port))
+        self.port = self._server.getsockname()[1]
+        self._running = True
+        threading.Thread(target=self._accept, name='fleet-accept', daemon=True).start()
+        logging.info(f"Servidor de inferencia en {host}:{self.port} (lotes de hasta {self.lane.max_batch} en el carril)")
+
+    def _run_lane(self, requests):
+        angles = self.lane([request.image for request in requests])
+        for request, angle in zip(requests, angles):
+            request.client.respond(request, STATUS_OK, request.client.steer(angle, request.received))
+
+    def _run_signs(self, requests):
+        ''' El detector tiene un tamaño de lote fijo: las imágenes del lote van una a una '''
+
+        for request in requests:
+            detections = self.detector.detect(request.image)
+            confirmed = self.detector.confirm(detections, request.received, request.client.tracker)
+            # Las pistas confirmadas se mandan una sola vez: actuar es cosa del coche
+            for track in confirmed:
+                request.client.tracker.mark_fired(track['track_id'])
+            request.client.respond(request, STATUS_OK, detections=detections, confirmed=confirmed)
+
+    def _accept(self):
+        while self._running:
+            try:
+                connection, address = self._server.accept()
+            except OSError:
+                break
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(connection, address), daemon=True).start()
+
+    def _serve(self, connection, address):
+        client = None
+        try:
+            name = bytes(_recv_message(connection)).decode()
+            with self._clients_lock:
+                if name not in self.clients:
+                    self.clients[name] = ClientState(name, self.clock)
+                client = self.clients[name]
+            with client.send_lock:
+                client.connection = connection
+            logging.info(f"Coche {name} conectado desde {address[0]}")
+
+            while self._running:
+                message = _recv_message(connection)
+                received = self.clock()
+                if len(message) < REQUEST.size:
+                    logging.warning(f"Petición de {name} sin cabecera completa ({len(message)} bytes), se ignora")
+                    continue
+                seq, task, encoding, width, height, deadline_ms = REQUEST.unpack_from(message)
+                request = _Request(client, seq, task, None, received, received + deadline_ms / 1000)
+                request.image = self._decode(memoryview(message)[REQUEST.size:], encoding, width, height)
+                if request.image is None or task not in self.batchers:
+                    logging.debug(f"Petición {seq} de {name} no válida (tarea {task}, codificación {encoding})")
+                    client.respond(request, STATUS_ERROR)
+                    continue
+                self.batchers[task].submit(request)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if client is not None:
+                with client.send_lock:
+                    client.connection = None
+                logging.info(f"Coche {client.name} desconectado")
+            connection.close()
+
+    @staticmethod
+    def _decode(payload, encoding, width, height):
+        ''' Imagen BGR de la petición, o None si no se puede leer '''
+
+        if encoding == ENCODING_JPEG:
+            if len(payload) == 0:
+                return None
+            return cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if encoding == ENCODING_RAW and width > 0 and height > 0 and len(payload) == width * height * 3:
+            return np.frombuffer(payload, dtype=np.uint8).reshape(height, width, 3)
+        return None
+
+    def stats(self):
+        ''' Peticiones, lotes, tamaño medio del lote, fuera de plazo y latencia (ms) por tarea '''
+
+        snapshot = metrics.get_metrics().snapshot()
+        stats = {}
+        for name in TASKS.values():
+            requests = snapshot['counters'].get(f"fleet_requests/{name}", 0)
+            batches = snapshot['counters'].get(f"fleet_batches/{name}", 0)
+            task = {'requests': requests,
+                    'batches': batches,
+                    'mean_batch': requests / batches if batches else 0.0,
+                    'expired': snapshot['counters'].get(f"fleet_expired/{name}", 0)}
+            latency = snapshot['stages'].get(f"fleet_latency/{name}", {})
+            task.update({key: value for key, value in latency.items() if key.endswith('_ms')})
+            stats[name] = task
+        return stats
+
+    def close(self):
+        self._running = False
+        self._server.close()
+        for batcher in self.batchers.values():
+            batcher.stop()
+        self.runner.stop()
+        with self._clients_lock:
+            for client in self.clients.values():
+                with client.send_lock:
+                    if client.connection is not None:
+                        client.connection.close()
+
+
+class FleetResult(object):
+    ''' Respuesta de una petición; result() espera a que llegue '''
+
+    def __init__(self, sent):
+        self.sent = sent
+        self.status = None
+        self.steering_angle = None
+        self.detections = None
+        self.confirmed = None
+        self.server_ms = None
+        self.latency = None
+        self._done = threading.Event()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError('Sin respuesta del servidor de inferencia')
+        return self
+
+
+class FleetClient(object):
+    ''' Conexión de un coche con el servidor. Admite varias peticiones en vuelo '''
+
+    def __init__(self, host, port, name, encoding=ENCODING_JPEG, jpeg_quality=80, clock=time.monotonic):
+        self.name = name
+        self.encoding = encoding
+        self.jpeg_quality = jpeg_quality
+        self.clock = clock
+        self._connection = socket.create_connection((host, port))
+        self._connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._seq = 0
+        _send_message(self._connection, name.encode())
+        self._thread = threading.Thread(target=self._receive, name='fleet-client', daemon=True)
+        self._thread.start()
+
+    def submit(self, task, image, deadline_ms=100):
+        height, width = image.shape[:2]
+        if self.encoding == ENCODING_JPEG:
+            ok, payload = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not ok:
+                raise ValueError('No se pudo comprimir el fotograma')
+        else:
+            payload = np.ascontiguousarray(image)
+
+        with self._send_lock:
+            self._seq = (self._seq + 1) & 0xFFFFFFFF
+            seq = self._seq
+            result = self._pending[seq] = FleetResult(self.clock())
+            _send_message(self._connection, REQUEST.pack(seq, task, self.encoding, width, height, deadline_ms),
+                          memoryview(payload).cast('B'))
+        return result
+
+    def steer(self, image, deadline_ms=50, timeout=1.0):
+        ''' Ángulo estabilizado por el servidor con el estado de este coche (None si llega tarde) '''
+
+        result = self.submit(TASK_LANE, image, deadline_ms).result(timeout)
+        return result.steering_angle if result.status == STATUS_OK else None
+
+    def detect(self, image, deadline_ms=200, timeout=1.0):
+        ''' (detecciones, señales confirmadas para actuar), o None si llega tarde '''
+
+        result = self.submit(TASK_SIGNS, image, deadline_ms).result(timeout)
+        return (result.detections, result.confirmed) if result.status == STATUS_OK else None
+
+    def _receive(self):
+        try:
+            while True:
+                message = _recv_message(self._connection)
+                received = self.clock()
+                seq, task, status, angle, server_ms, detections, confirmed = RESPONSE.unpack_from(message)
+                with self._send_lock:
+                    result = self._pending.pop(seq, None)
+                if result is None:
+                    continue
+                offset = RESPONSE.size
+                end = offset + detections * DETECTION_DTYPE.itemsize
+                result.detections = np.frombuffer(message, dtype=DETECTION_DTYPE, count=detections, offset=offset)
+                result.confirmed = np.frombuffer(message, dtype=TRACK_DTYPE, count=confirmed, offset=end)
+                result.status = status
+                result.steering_angle = angle if task == TASK_LANE and status == STATUS_OK else None
+                result.server_ms = server_ms
+                result.latency = received - result.sent
+                result._done.set()
+        except (ConnectionError, OSError):
+            pass
+
+    def close(self):
+        try:
+            self._connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._connection.close()
+        self._thread.join(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor de inferencia para varios coches')
+    parser.add_argument('--port', type=int, default=settings.get('fleet_port', 8770, int))
+    # Por defecto solo desde este equipo; --host 0.0.0.0 para atender a los coches de la red
+    parser.add_argument('--host', default=settings.get('fleet_host', '127.0.0.1'))
+    parser.add_argument('--backend', choices=('edgetpu', 'cpu', 'mock'))
+    parser.add_argument('--max-batch', type=int, default=settings.get('fleet_max_batch', 8, int))
+    parser.add_argument('--max-wait-ms', type=float, default=settings.get('fleet_max_wait_ms', 5.0, float))
+    args = parser.parse_args()
+
+    server = FleetServer(args.port, args.host, args.backend, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+    exporters = metrics.start_exporters()
+    try:
+        while True:
+            time.sleep(10)
+            logging.info(f"Servidor de inferencia: {server.stats()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        for exporter in exporters:
+            exporter.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(asctime)s: %(message)s')
+    main()
@@ -0,0 +1,161 @@
+#------------------------------------------------------------------------------
+# Generador de carga para el servidor de inferencia (fleet.py). Simula N coches,
+# cada uno en su propio proceso, que envían fotogramas grabados (vídeo, carpeta
+# o conjunto) a la frecuencia de la cámara: el carril en cada fotograma,
+# esperando el ángulo como el coche real, y las señales cada sign_every
+# fotogramas sin esperar. Para cada número de coches muestra en JSON las
+# peticiones por segundo, la latencia vista por el coche (p50/p95/p99), las
+# respuestas fuera de plazo y el tamaño medio de los lotes del servidor.
+# Uso:
+#   python3 fleet_bench.py --cars 1,2,4,8 --seconds 10 --backend cpu
+#   python3 fleet_bench.py --cars 4 --host 192.168.1.20 --port 8770   (servidor ya arrancado)
+#------------------------------------------------------------------------------
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+import numpy as np
+from hal import FileCamera
+from fleet import FleetServer, FleetClient, TASK_LANE, TASK_SIGNS, STATUS_OK, ENCODING_RAW, ENCODING_JPEG
+
+
+def _car(index, host, port, source, seconds, fps, sign_every, deadline_ms, sign_deadline_ms, encoding, results):
+    camera = FileCamera(source, fps=fps)
+    client = FleetClient(host, port, f"car-{index}", encoding)
+    lane, signs = [], []
+    lane_late = 0
+    frames = 0
+
+    start = time.monotonic()
+    end = start + seconds
+    while time.monotonic() < end:
+        ok, image = camera.read()
+        if not ok:
+            break
+        if frames % sign_every == 0:
+            signs.append(client.submit(TASK_SIGNS, image, sign_deadline_ms))
+        result = client.submit(TASK_LANE, image, deadline_ms).result(5.0)
+        if result.status == STATUS_OK:
+            lane.append(result.latency)
+        else:
+            lane_late += 1
+        frames += 1
+
+    sign_latencies = []
+    sign_late = 0
+    for result in signs:
+        result.result(5.0)
+        if result.status == STATUS_OK:
+            sign_latencies.append(result.latency)
+        else:
+            sign_late += 1
+    elapsed = time.monotonic() - start
+    client.close()
+    results.put({'seconds': elapsed, 'frames': frames, 'lane': lane, 'lane_late': lane_late,
+                 'signs': sign_latencies, 'sign_late': sign_late})
+
+
+def _summary(latencies, late, seconds):
+    latencies = np.asarray(latencies) * 1000
+    summary = {'responses': int(latencies.size),
+               'per_sec': latencies.size / seconds,
+               'late': late}
+    if latencies.size:
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+        summary.update({'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99),
+                        'max_ms': float(latencies.max())})
+    return summary
+
+
+def run(cars, host, port, source, seconds, fps, sign_every, deadline_ms, sign_deadline_ms, encoding):
+    # spawn y no fork: el proceso principal ya tiene los hilos del servidor
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=_car,
+                                  args=(i, host, port, source, seconds, fps, sign_every,
+                                        deadline_ms, sign_deadline_ms, encoding, results))
+                 for i in range(cars)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    # Sin contar el arranque de los procesos
+    elapsed = max(outcome['seconds'] for outcome in outcomes)
+
+    return {'cars': cars,
+            'frames': sum(outcome['frames'] for outcome in outcomes),
+            'lane': _summary([t for outcome in outcomes for t in outcome['lane']],
+                             sum(outcome['lane_late'] for outcome in outcomes), elapsed),
+            'signs': _summary([t for outcome in outcomes for t in outcome['signs']],
+                              sum(outcome['sign_late'] for outcome in outcomes), elapsed)}
+
+
+def _batches(before, after):
+    ''' Lotes y tamaño medio de cada tarea entre dos llamadas a FleetServer.stats() '''
+
+    report = {}
+    for task in after:
+        requests = after[task]['requests'] - before[task]['requests']
+        batches = after[task]['batches'] - before[task]['batches']
+        report[task] = {'batches': batches, 'mean_batch': requests / batches if batches else 0.0}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Carga de varios coches sobre el servidor de inferencia')
+    parser.add_argument('--cars', default='1,2,4,8', help='números de coches separados por comas')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--sign-every', type=int, default=10, help='fotogramas entre peticiones de señales')
+    parser.add_argument('--deadline-ms', type=float, default=50.0, help='plazo del ángulo de giro')
+    parser.add_argument('--sign-deadline-ms', type=float, default=200.0)
+    parser.add_argument('--encoding', choices=('jpeg', 'raw'), default='jpeg')
+    parser.add_argument('--source', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         '..', 'imagenes', 'test'),
+                        help='vídeo, carpeta o patrón de imágenes grabadas')
+    parser.add_argument('--host', help='servidor ya arrancado; si no, se arranca uno aquí')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--backend', choices=('edgetpu', 'cpu', 'mock'))
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--output', help='fichero JSON donde guardar el informe')
+    args = parser.parse_args()
+
+    server = None
+    host, port = args.host, args.port
+    if host is None:
+        server = FleetServer(port, '127.0.0.1', args.backend, max_batch=args.max_batch,
+                             max_wait=args.max_wait_ms / 1000)
+        host, port = '127.0.0.1', server.port
+
+    encoding = ENCODING_JPEG if args.encoding == 'jpeg' else ENCODING_RAW
+    report = {'source': args.source, 'fps': args.fps, 'deadline_ms': args.deadline_ms,
+              'encoding': args.encoding, 'runs': []}
+    try:
+        for cars in [int(n) for n in args.cars.split(',')]:
+            before = server.stats() if server is not None else None
+            result = run(cars, host, port, args.source, args.seconds, args.fps, args.sign_every,
+                         args.deadline_ms, args.sign_deadline_ms, encoding)
+            if server is not None:
+                result['server'] = _batches(before, server.stats())
+            report['runs'].append(result)
+            logging.info(f"{cars} coches: {result['lane']['per_sec']:.1f} ángulos/s, "
+                         f"p99 {result['lane'].get('p99_ms', 0):.1f} ms")
+    finally:
+        if server is not None:
+            server.close()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(asctime)s: %(message)s')
+    main()
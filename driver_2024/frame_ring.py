@@ -0,0 +1,244 @@
+#------------------------------------------------------------------------------
+# Anillo de fotogramas en memoria compartida (multiprocessing.shared_memory) para
+# repartir las etapas del coche entre procesos sin copiar los fotogramas y sin
+# que compitan por el GIL. Hay un solo productor (la captura) y varios lectores
+# (carril, señales...):
+# - cada hueco es un fotograma de 240x320x3 con su número y su instante de captura
+# - publicación estilo seqlock: el contador del hueco es impar mientras se
+#   escribe; el lector lo anota antes de usar el fotograma y comprueba después
+#   que no ha cambiado, así sabe si lo pisaron mientras lo usaba (sin bloqueos)
+# - cada lector deja su latido y el último fotograma leído; stalled() señala los
+#   que llevan demasiado tiempo sin leer mientras la captura sigue publicando
+# Los contadores son de 32 bits para que las lecturas sean atómicas también en
+# la Raspberry con sistema de 32 bits.
+#------------------------------------------------------------------------------
+
+import time
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+MAGIC = 0x46524E47  # 'FRNG'
+
+HEADER_DTYPE = np.dtype([('magic', np.uint32),
+                         ('slots', np.uint32),
+                         ('height', np.uint32),
+                         ('width', np.uint32),
+                         ('channels', np.uint32),
+                         ('max_consumers', np.uint32),
+                         ('head', np.uint32),            # fotogramas publicados (número del último)
+                         ('producer_heartbeat', np.float64)], align=True)
+
+SLOT_DTYPE = np.dtype([('version', np.uint32),           # impar mientras se escribe
+                       ('seq', np.uint32),
+                       ('timestamp', np.float64)], align=True)
+
+CONSUMER_DTYPE = np.dtype([('active', np.uint32),
+                           ('last_seq', np.uint32),
+                           ('overruns', np.uint32),      # fotogramas pisados mientras se usaban
+                           ('heartbeat', np.float64)], align=True)
+
+ALIGNMENT = 64
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _attach(name):
+    ''' Conecta con la memoria sin apuntarla en el resource_tracker: solo el creador
+        la borra. Antes de Python 3.13 no se puede pedir (track=False) y el tracker
+        la borraría al salir cualquier proceso que se conecte '''
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class RingFrame(object):
+    ''' Fotograma leído del anillo: la imagen es una vista de solo lectura sobre la memoria compartida '''
+
+    __slots__ = ('seq', 'slot', 'version', 'timestamp', 'image')
+
+    def __init__(self, seq, slot, version, timestamp, image):
+        self.seq = seq
+        self.slot = slot
+        self.version = version
+        self.timestamp = timestamp
+        self.image = image
+
+
+class FrameRing(object):
+
+    def __init__(self, name=None, slots=8, shape=(240, 320, 3), max_consumers=4, create=True,
+                 clock=time.monotonic):
+        self.clock = clock
+        self.creator = create
+
+        if create:
+            size = self._layout(slots, shape, max_consumers)
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self._map(slots, shape, max_consumers)
+            self.header['magic'] = MAGIC
+            self.header['slots'] = slots
+            self.header['height'], self.header['width'], self.header['channels'] = shape
+            self.header['max_consumers'] = max_consumers
+        else:
+            self._shm = _attach(name)
+            header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self._shm.buf)
+            if header['magic'] != MAGIC:
+                raise ValueError(f"{name} no es un anillo de fotogramas")
+            self._map(int(header['slots']),
+                      (int(header['height']), int(header['width']), int(header['channels'])),
+                      int(header['max_consumers']))
+
+        self.name = self._shm.name
+        self._writing = None
+
+    @classmethod
+    def attach(cls, name, clock=time.monotonic):
+        ''' Conecta con un anillo creado por otro proceso '''
+
+        return cls(name, create=False, clock=clock)
+
+    @staticmethod
+    def _layout(slots, shape, max_consumers):
+        offset = _align(HEADER_DTYPE.itemsize)
+        offset = _align(offset + SLOT_DTYPE.itemsize * slots)
+        offset = _align(offset + CONSUMER_DTYPE.itemsize * max_consumers)
+        return offset + slots * int(np.prod(shape))
+
+    def _map(self, slots, shape, max_consumers):
+        buffer = self._shm.buf
+        self.slots = slots
+        self.shape = shape
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buffer)
+        offset = _align(HEADER_DTYPE.itemsize)
+        self.slot_meta = np.ndarray((slots,), dtype=SLOT_DTYPE, buffer=buffer, offset=offset)
+        offset = _align(offset + SLOT_DTYPE.itemsize * slots)
+        self.consumers = np.ndarray((max_consumers,), dtype=CONSUMER_DTYPE, buffer=buffer, offset=offset)
+        offset = _align(offset + CONSUMER_DTYPE.itemsize * max_consumers)
+        self.frames = np.ndarray((slots,) + tuple(shape), dtype=np.uint8, buffer=buffer, offset=offset)
+
+    # Productor
+
+    def begin(self):
+        ''' Hueco del siguiente fotograma para escribir en él directamente (p. ej. la cámara) '''
+
+        seq = (int(self.header['head']) + 1) & 0xFFFFFFFF
+        slot = seq % self.slots
+        self.slot_meta['version'][slot] += 1  # impar: escribiendo
+        self._writing = (seq, slot)
+        return self.frames[slot]
+
+    def commit(self, timestamp=None):
+        ''' Publica el fotograma escrito en el hueco de begin() y devuelve su número '''
+
+        seq, slot = self._writing
+        self._writing = None
+        now = self.clock()
+        self.slot_meta['seq'][slot] = seq
+        self.slot_meta['timestamp'][slot] = now if timestamp is None else timestamp
+        self.slot_meta['version'][slot] += 1  # par: listo
+        self.header['head'] = seq
+        self.header['producer_heartbeat'] = now
+        return seq
+
+    def publish(self, image, timestamp=None):
+        np.copyto(self.begin(), image)
+        return self.commit(timestamp)
+
+    # Lectores
+
+    def register(self, consumer=None):
+        ''' Reserva un puesto de lector y devuelve su índice. Si varios procesos se
+            registran a la vez, conviene que cada uno indique el suyo '''
+
+        if consumer is None:
+            free = np.flatnonzero(self.consumers['active'] == 0)
+            if not len(free):
+                raise RuntimeError('No quedan puestos de lector en el anillo')
+            consumer = int(free[0])
+        self.consumers[consumer] = (1, self.header['head'], 0, self.clock())
+        return consumer
+
+    def unregister(self, consumer):
+        self.consumers['active'][consumer] = 0
+
+    def read(self, consumer, timeout=None, poll=0.001):
+        ''' Último fotograma posterior al que leyó consumer; None si no llega ninguno a tiempo.
+            La imagen solo es fiable si valid() lo confirma después de usarla '''
+
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            now = self.clock()
+            self.consumers['heartbeat'][consumer] = now
+            head = int(self.header['head'])
+            if head != int(self.consumers['last_seq'][consumer]):
+                slot = head % self.slots
+                version = int(self.slot_meta['version'][slot])
+                if version % 2 == 0:
+                    seq = int(self.slot_meta['seq'][slot])
+                    timestamp = float(self.slot_meta['timestamp'][slot])
+                    if seq == head and int(self.slot_meta['version'][slot]) == version:
+                        self.consumers['last_seq'][consumer] = seq
+                        image = self.frames[slot]
+                        image.flags.writeable = False
+                        return RingFrame(seq, slot, version, timestamp, image)
+            if deadline is not None and now >= deadline:
+                return None
+            time.sleep(poll)
+
+    def valid(self, frame, consumer=None):
+        ''' True si el hueco no se ha vuelto a escribir desde que se leyó el fotograma '''
+
+        ok = int(self.slot_meta['version'][frame.slot]) == frame.version
+        if not ok and consumer is not None:
+            self.consumers['overruns'][consumer] += 1
+        return ok
+
+    def copy(self, frame, out=None):
+        ''' Copia del fotograma, o None si lo pisaron durante la copia '''
+
+        if out is None:
+            out = frame.image.copy()
+        else:
+            np.copyto(out, frame.image)
+        return out if self.valid(frame) else None
+
+    # Vigilancia
+
+    def stalled(self, max_age=0.5, now=None):
+        ''' Lectores activos sin latido en max_age segundos mientras la captura publica '''
+
+        if now is None:
+            now = self.clock()
+        active = self.consumers['active'] == 1
+        old = now - self.consumers['heartbeat'] > max_age
+        producing = now - float(self.header['producer_heartbeat']) <= max_age
+        return [int(consumer) for consumer in np.flatnonzero(active & old)] if producing else []
+
+    def stats(self, now=None):
+        if now is None:
+            now = self.clock()
+        head = int(self.header['head'])
+        return {'head': head,
+                'consumers': {int(consumer): {'lag': (head - int(self.consumers['last_seq'][consumer])) & 0xFFFFFFFF,
+                                              'overruns': int(self.consumers['overruns'][consumer]),
+                                              'age_s': now - float(self.consumers['heartbeat'][consumer])}
+                              for consumer in np.flatnonzero(self.consumers['active'] == 1)}}
+
+    def close(self):
+        # Las vistas de NumPy impiden cerrar la memoria: se sueltan antes
+        self.header = self.slot_meta = self.consumers = self.frames = None
+        self._shm.close()
+
+    def unlink(self):
+        if self.creator:
+            self._shm.unlink()
@@ -0,0 +1,440 @@
+#------------------------------------------------------------------------------
+# Capa de abstracción del hardware del coche: cámara, tracción (ruedas traseras),
+# dirección (ruedas delanteras), servos de la cámara, luces y pantalla.
+# - picar: el hardware real del Picar-V con OpenCV para la cámara y la pantalla
+#          (o sin pantalla, con display = headless; ver headless.py)
+# - sim: cámara que lee de un vídeo o carpeta y actuadores que solo guardan
+#        las órdenes con su instante, para ejecutar drive() sin el coche
+# La implementación se escoge con la clave hardware del fichero config.
+#------------------------------------------------------------------------------
+
+import glob
+import logging
+import os
+import time
+from collections import namedtuple
+from lazy import lazy_import
+cv2 = lazy_import('cv2')
+import settings
+from leds import LedController, FakeBlinkStick, get_controller
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+Hardware = namedtuple('Hardware', ['camera', 'back_wheels', 'front_wheels',
+                                   'horizontal_servo', 'vertical_servo', 'leds', 'display'])
+
+
+class Camera(object):
+    ''' Interfaz de la cámara, la misma que cv2.VideoCapture '''
+
+    def read(self):
+        raise NotImplementedError
+
+    def read_timestamped(self):
+        ''' (ok, fotograma, instante de captura) '''
+        ok, image = self.read()
+        return ok, image, time.monotonic()
+
+    def report_actuation(self, capture_timestamp):
+        ''' Aviso de que se ha girado con el fotograma capturado en capture_timestamp '''
+        pass
+
+    def isOpened(self):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+
+class Drive(object):
+    ''' Interfaz de la tracción: velocidad de 0 a 100 '''
+
+    _speed = 0
+
+    @property
+    def speed(self):
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed):
+        raise NotImplementedError
+
+
+class Steering(object):
+    ''' Interfaz de la dirección: 45 (izquierda) - 90 (recto) - 135 (derecha) '''
+
+    turning_offset = 0
+
+    def turn(self, angle):
+        raise NotImplementedError
+
+
+class DedupSteering(Steering):
+    ''' Dirección que solo envía los cambios de ángulo: el modelo repite casi siempre
+        los mismos ángulos enteros y cada orden es una escritura por I2C.
+        Con el servo de picar el pulso PWM de cada ángulo sale de una tabla '''
+
+    def __init__(self, steering, min_angle=45, max_angle=135):
+        self.steering = steering
+        self.min_angle = min_angle
+        self.max_angle = max_angle
+        self.angle = None
+        self.sent = 0
+        self.skipped = 0
+        self._pulses = self._pulse_table()
+
+    def _pulse_table(self):
+        ''' Pulso de cada ángulo entero de min_angle a max_angle, como Servo.write de picar '''
+
+        servo = getattr(self.steering, 'wheel', None)
+        if servo is None or not all(hasattr(servo, name) for name in ('_angle_to_analog', 'pwm', 'channel')):
+            return None
+        return [servo._angle_to_analog(angle) + servo.offset
+                for angle in range(self.min_angle, self.max_angle + 1)]
+
+    @property
+    def turning_offset(self):
+        return self.steering.turning_offset
+
+    @turning_offset.setter
+    def turning_offset(self, offset):
+        self.steering.turning_offset = offset
+        self._pulses = self._pulse_table()
+        self.angle = None
+
+    def turn(self, angle):
+        angle = int(round(min(max(angle, self.min_angle), self.max_angle)))
+        if angle == self.angle:
+            self.skipped += 1
+            return
+        if self._pulses is not None:
+            servo = self.steering.wheel
+            servo.pwm.write(servo.channel, 0, self._pulses[angle - self.min_angle])
+        else:
+            self.steering.turn(angle)
+        self.angle = angle
+        self.sent += 1
+
+    def __getattr__(self, name):
+        return getattr(self.steering, name)
+
+
+class Servo(object):
+    ''' Interfaz de los servos de la cámara '''
+
+    offset = 0
+
+    def write(self, angle):
+        raise NotImplementedError
+
+
+class Display(object):
+    ''' Interfaz de la pantalla y el teclado '''
+
+    # True si la pantalla dibuja ella misma la línea de dirección con el ángulo que recibe
+    draws_heading = False
+
+    def show(self, image, steering_angle=None):
+        raise NotImplementedError
+
+    def key(self, delay=1):
+        ''' Código de la tecla pulsada (0xFF si ninguna), esperando delay ms '''
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class OpenCVDisplay(Display):
+
+    def __init__(self, window='Video'):
+        self.window = window
+
+    def show(self, image, steering_angle=None):
+        cv2.imshow(self.window, image)
+
+    def key(self, delay=1):
+        return cv2.waitKey(delay) & 0xFF
+
+    def close(self):
+        cv2.destroyAllWindows()
+
+
+class CommandRecorder(object):
+    ''' Guarda cada orden recibida como (instante, valor) '''
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.commands = []
+
+    def record(self, value):
+        self.commands.append((self.clock(), value))
+
+    def command_rate(self):
+        ''' Órdenes por segundo entre la primera y la última '''
+
+        if len(self.commands) < 2:
+            return 0.0
+        elapsed = self.commands[-1][0] - self.commands[0][0]
+        return (len(self.commands) - 1) / elapsed if elapsed > 0 else float('inf')
+
+
+class FileCamera(Camera):
+    ''' Cámara simulada que lee un vídeo, una carpeta de imágenes o un patrón glob '''
+
+    def __init__(self, source, size=(320, 240), fps=None, loop=True, clock=time.monotonic, sleep=time.sleep):
+        self.size = size
+        self.fps = fps
+        self.loop = loop
+        self.clock = clock
+        self.sleep = sleep
+        self.frames_read = 0
+        self._next_time = None
+        self._capture = None
+        self._paths = None
+        self._index = 0
+        self._opened = True
+
+        if os.path.isdir(source):
+            self._paths = sorted(path for path in glob.glob(os.path.join(source, '*'))
+                                 if path.lower().endswith(IMAGE_EXTENSIONS))
+        elif any(char in source for char in '*?['):
+            self._paths = sorted(glob.glob(source))
+        else:
+            self._capture = cv2.VideoCapture(source)
+            self._opened = self._capture.isOpened()
+
+        if self._paths is not None:
+            # Las imágenes se cargan una vez para no medir el disco en cada fotograma
+            self._images = [self._resize(cv2.imread(path)) for path in self._paths]
+            self._images = [image for image in self._images if image is not None]
+            self._opened = len(self._images) > 0
+
+    def _resize(self, image):
+        if image is None or self.size is None or image.shape[1::-1] == self.size:
+            return image
+        return cv2.resize(image, self.size)
+
+    def _pace(self):
+        ''' Con fps, espera lo necesario para imitar la cadencia de una cámara real '''
+
+        if not self.fps:
+            return
+        now = self.clock()
+        if self._next_time is None:
+            self._next_time = now
+        delay = self._next_time - now
+        if delay > 0:
+            self.sleep(delay)
+        self._next_time = max(self._next_time + 1.0 / self.fps, now)
+
+    def read(self):
+        if not self._opened:
+            return False, None
+        self._pace()
+
+        if self._capture is not None:
+            ok, image = self._capture.read()
+            if not ok and self.loop:
+                self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, image = self._capture.read()
+            if not ok:
+                self._opened = False
+                return False, None
+            image = self._resize(image)
+        else:
+            if self._index >= len(self._images):
+                if not self.loop:
+                    self._opened = False
+                    return False, None
+                self._index = 0
+            # Copia: cada lectura devuelve un array nuevo, como cv2.VideoCapture
+            image = self._images[self._index].copy()
+            self._index += 1
+
+        self.frames_read += 1
+        return True, image
+
+    def isOpened(self):
+        return self._opened
+
+    def release(self):
+        self._opened = False
+        if self._capture is not None:
+            self._capture.release()
+
+
+class RecordingDrive(Drive, CommandRecorder):
+
+    def __init__(self, clock=time.monotonic):
+        CommandRecorder.__init__(self, clock)
+        self._speed = 0
+
+    @property
+    def speed(self):
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed):
+        self._speed = speed
+        self.record(speed)
+
+
+class RecordingSteering(Steering, CommandRecorder):
+
+    def __init__(self, clock=time.monotonic, min_angle=45, max_angle=135):
+        CommandRecorder.__init__(self, clock)
+        self.min_angle = min_angle
+        self.max_angle = max_angle
+        self.angle = 90
+
+    def turn(self, angle):
+        # Mismos límites que picar.front_wheels
+        self.angle = min(max(angle, self.min_angle), self.max_angle)
+        self.record(self.angle)
+
+
+class RecordingServo(Servo, CommandRecorder):
+
+    def __init__(self, clock=time.monotonic):
+        CommandRecorder.__init__(self, clock)
+
+    def write(self, angle):
+        self.record(angle)
+
+
+class SimDisplay(Display):
+    ''' Pantalla que no muestra nada; pulsa q tras max_frames fotogramas o max_seconds segundos '''
+
+    def __init__(self, max_frames=None, max_seconds=None, keys=None, clock=time.monotonic):
+        self.max_frames = max_frames
+        self.max_seconds = max_seconds
+        self.keys = dict(keys or {})  # fotograma -> tecla
+        self.clock = clock
+        self.frames_shown = 0
+        self._start = None
+
+    def show(self, image, steering_angle=None):
+        self.frames_shown += 1
+
+    def key(self, delay=1):
+        if self._start is None:
+            self._start = self.clock()
+        if self.max_frames is not None and self.frames_shown >= self.max_frames:
+            return ord('q')
+        if self.max_seconds is not None and self.clock() - self._start >= self.max_seconds:
+            return ord('q')
+        key = self.keys.pop(self.frames_shown, None)
+        return ord(key) if key else 0xFF
+
+
+def make_picar_hardware(straight_angle=90, width=320, height=240):
+    ''' Hardware real del Picar-V '''
+
+    import picar
+    from camera import ThreadedCamera
+
+    picar.setup()
+
+    logging.debug("Preparando la cámara...")
+    camera = ThreadedCamera(settings.get('camera_source', 0, int),
+                            width,
+                            height,
+                            fourcc=settings.get('camera_fourcc', 'MJPG'),
+                            fps=settings.get('camera_fps', 30, int),
+                            buffer_size=settings.get('camera_buffer_size', 1, int))
+
+    horizontal_servo = picar.Servo.Servo(1)
+    horizontal_servo.offset = 20  # calibra el servo al centro
+    horizontal_servo.write(straight_angle)
+
+    vertical_servo = picar.Servo.Servo(2)
+    vertical_servo.offset = 0  # calibra el servo al centro
+    vertical_servo.write(straight_angle)
+    logging.debug("Cámara lista.")
+
+    logging.debug("Preparando las ruedas...")
+    back_wheels = picar.back_wheels.Back_Wheels()
+    back_wheels.speed = 0  # El rango de velocidad es 0 - 100
+
+    front_wheels = picar.front_wheels.Front_Wheels()
+    front_wheels.turning_offset = -10  # calibra el servo al centro
+    front_wheels.turn(straight_angle)  # El ángulo de giro es 45 (izquierda) - 90 (recto) - 135 (derecha)
+    front_wheels = DedupSteering(front_wheels)
+    logging.debug("Ruedas listas.")
+
+    return Hardware(camera, back_wheels, front_wheels, horizontal_servo, vertical_servo,
+                    get_controller(), make_display())
+
+
+def make_sim_hardware(source=None, fps=None, max_frames=None, max_seconds=None, straight_angle=90):
+    ''' Hardware simulado: cámara desde fichero y actuadores que registran las órdenes '''
+
+    if source is None:
+        source = settings.get('sim_source', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         '..', 'imagenes', 'test'))
+    if fps is None:
+        fps = settings.get('sim_fps', None, float)
+    if max_frames is None:
+        max_frames = settings.get('sim_max_frames', None, int)
+    if max_seconds is None:
+        max_seconds = settings.get('sim_max_seconds', None, float)
+
+    front_wheels = DedupSteering(RecordingSteering())
+    front_wheels.turn(straight_angle)
+
+    return Hardware(FileCamera(source, fps=fps),
+                    RecordingDrive(),
+                    front_wheels,
+                    RecordingServo(),
+                    RecordingServo(),
+                    LedController(FakeBlinkStick()),
+                    SimDisplay(max_frames, max_seconds))
+
+
+def make_display(kind=None):
+    ''' Pantalla configurada en display: opencv (por defecto) o headless '''
+
+    if kind is None:
+        kind = settings.get('display', 'opencv')
+
+    if kind == 'opencv':
+        return OpenCVDisplay()
+    if kind == 'headless':
+        from headless import HeadlessDisplay, StdinCommands, SocketCommands, MjpegPreview
+        command_port = settings.get('command_port', 0, int)
+        preview_port = settings.get('preview_port', 0, int)
+        commands = SocketCommands(command_port) if command_port else StdinCommands()
+        preview = MjpegPreview(preview_port, settings.get('preview_fps', 5, float)) if preview_port else None
+        return HeadlessDisplay(commands, preview)
+    raise ValueError(f"Pantalla desconocida: {kind} (opciones: opencv, headless)")
+
+
+def make_hardware(kind=None, **kwargs):
+    ''' Crea el hardware configurado en hardware: picar (por defecto) o sim '''
+
+    if kind is None:
+        kind = settings.get('hardware', 'picar')
+
+    if kind == 'picar':
+        return make_picar_hardware(**kwargs)
+    if kind == 'sim':
+        return make_sim_hardware(**kwargs)
+    raise ValueError(f"Hardware desconocido: {kind} (opciones: picar, sim)")
+
+
+def command_report(hardware):
+    ''' Número de órdenes y órdenes por segundo de cada actuador simulado '''
+
+    report = {}
+    for name in ('back_wheels', 'front_wheels', 'horizontal_servo', 'vertical_servo'):
+        actuator = getattr(hardware, name)
+        skipped = None
+        if isinstance(actuator, DedupSteering):
+            skipped = actuator.skipped
+            actuator = actuator.steering
+        if isinstance(actuator, CommandRecorder):
+            report[name] = {'commands': len(actuator.commands), 'rate_hz': actuator.command_rate()}
+            if skipped is not None:
+                report[name]['skipped'] = skipped
+    return report
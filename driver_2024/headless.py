@@ -0,0 +1,206 @@
+#------------------------------------------------------------------------------
+# Modo sin pantalla para el coche. Sustituye cv2.imshow/cv2.waitKey por:
+# - un canal de órdenes que no bloquea: las teclas de siempre (q, p, g, a, d, t)
+#   escritas por la entrada estándar o enviadas a un socket local, p. ej.
+#   echo p | nc 127.0.0.1 8765
+# - una vista previa MJPEG opcional a baja frecuencia, servida desde su propio
+#   hilo, que dibuja la línea de dirección sobre un buffer reutilizado.
+# El bucle de conducción solo deja una referencia al último fotograma: ni el
+# dibujo ni la compresión JPEG están en el camino del giro.
+#------------------------------------------------------------------------------
+
+import logging
+import queue
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from lazy import lazy_import
+cv2 = lazy_import('cv2')
+import numpy as np
+from hal import Display
+from overlay import draw_heading_line
+
+
+class CommandChannel(object):
+    ''' Teclas recibidas por un hilo aparte y leídas sin bloquear '''
+
+    def __init__(self):
+        self._keys = queue.Queue()
+
+    def push(self, text):
+        for char in text.strip():
+            self._keys.put(ord(char))
+
+    def key(self, timeout=0):
+        ''' Código de la siguiente tecla (0xFF si ninguna), esperando como mucho timeout segundos '''
+
+        try:
+            if timeout > 0:
+                return self._keys.get(timeout=timeout)
+            return self._keys.get_nowait()
+        except queue.Empty:
+            return 0xFF
+
+    def close(self):
+        pass
+
+
+class StdinCommands(CommandChannel):
+    ''' Una o varias teclas por línea de la entrada estándar '''
+
+    def __init__(self, stream=None):
+        super().__init__()
+        self.stream = stream if stream is not None else sys.stdin
+        threading.Thread(target=self._run, name='stdin-commands', daemon=True).start()
+
+    def _run(self):
+        for line in self.stream:
+            self.push(line)
+
+
+class SocketCommands(CommandChannel):
+    ''' Servidor TCP local: cada carácter recibido es una tecla '''
+
+    def __init__(self, port, host='127.0.0.1'):
+        super().__init__()
+        self._server = socket.create_server((host, port))
+        self.port = self._server.getsockname()[1]
+        self._running = True
+        threading.Thread(target=self._run, name='socket-commands', daemon=True).start()
+        logging.info(f"Órdenes por el socket {host}:{self.port}")
+
+    def _run(self):
+        while self._running:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        with connection:
+            while self._running:
+                data = connection.recv(64)
+                if not data:
+                    break
+                self.push(data.decode(errors='ignore'))
+
+    def close(self):
+        self._running = False
+        self._server.close()
+
+
+class MjpegPreview(object):
+    ''' Vista previa MJPEG en http://<coche>:port/ a como mucho fps fotogramas por segundo '''
+
+    def __init__(self, port, fps=5, quality=70, host='0.0.0.0'):
+        self.interval = 1.0 / fps
+        self.quality = quality
+        self.encoded = 0
+
+        self._latest = None    # (fotograma, ángulo) que deja el bucle de conducción
+        self._buffer = None    # copia sobre la que se dibuja, reutilizada
+        self._jpeg = None
+        self._clients = 0
+        self._condition = threading.Condition()
+        self._running = True
+
+        preview = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+                self.end_headers()
+                preview._serve(self.wfile)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='preview-http', daemon=True).start()
+        threading.Thread(target=self._run, name='preview', daemon=True).start()
+        logging.info(f"Vista previa en http://{host}:{self.server.server_address[1]}/")
+
+    def update(self, image, steering_angle=None):
+        ''' Solo guarda la referencia: los fotogramas del pipeline son de solo lectura '''
+
+        self._latest = (image, steering_angle)
+
+    def _render(self):
+        image, steering_angle = self._latest
+        if self._buffer is None or self._buffer.shape != image.shape:
+            self._buffer = np.empty_like(image)
+        np.copyto(self._buffer, image)
+        if steering_angle is not None:
+            draw_heading_line(self._buffer, steering_angle)
+        ok, jpeg = cv2.imencode('.jpg', self._buffer, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return jpeg.tobytes() if ok else None
+
+    def _run(self):
+        next_time = time.monotonic()
+        while self._running:
+            next_time += self.interval
+            time.sleep(max(next_time - time.monotonic(), 0))
+            # Sin nadie mirando no se dibuja ni se comprime nada
+            if not self._clients or self._latest is None:
+                continue
+            jpeg = self._render()
+            if jpeg is None:
+                continue
+            with self._condition:
+                self._jpeg = jpeg
+                self.encoded += 1
+                self._condition.notify_all()
+
+    def _serve(self, output):
+        with self._condition:
+            self._clients += 1
+        try:
+            last = None
+            while self._running:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._jpeg is not last or not self._running, 1.0)
+                    jpeg = last = self._jpeg
+                if jpeg is None:
+                    continue
+                output.write(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                             + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._condition:
+                self._clients -= 1
+
+    def close(self):
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class HeadlessDisplay(Display):
+    ''' Pantalla sin ventana: órdenes por stdin o socket y vista previa opcional '''
+
+    # El coche no dibuja la línea de dirección: si hay vista previa, la dibuja ella
+    draws_heading = True
+
+    def __init__(self, commands=None, preview=None):
+        self.commands = commands if commands is not None else StdinCommands()
+        self.preview = preview
+
+    def show(self, image, steering_angle=None):
+        if self.preview is not None:
+            self.preview.update(image, steering_angle)
+
+    def key(self, delay=1):
+        return self.commands.key(delay / 1000)
+
+    def close(self):
+        self.commands.close()
+        if self.preview is not None:
+            self.preview.close()
@@ -0,0 +1,45 @@
+#------------------------------------------------------------------------------
+# Importación diferida de los módulos pesados (cv2, los modelos, el hardware).
+# lazy_import devuelve un módulo vacío que importa el real la primera vez que
+# se usa uno de sus atributos, así el programa arranca y valida los argumentos
+# sin esperar a OpenCV. Es seguro usarlo desde varios hilos a la vez.
+#------------------------------------------------------------------------------
+
+import importlib
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_lock'] = threading.Lock()
+        self.__dict__['_lazy_loaded'] = False
+
+    def _load(self):
+        with self._lazy_lock:
+            if not self._lazy_loaded:
+                module = importlib.import_module(self.__name__)
+                # A partir de aquí los atributos se leen directamente, sin pasar por __getattr__
+                self.__dict__.update(module.__dict__)
+                self.__dict__['_lazy_loaded'] = True
+
+    def __getattr__(self, attribute):
+        self._load()
+        try:
+            return self.__dict__[attribute]
+        except KeyError:
+            raise AttributeError(f"module '{self.__name__}' has no attribute '{attribute}'") from None
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+def preload(*modules):
+    ''' Importa ya los módulos diferidos indicados (p. ej. en un hilo durante el arranque) '''
+
+    for module in modules:
+        if isinstance(module, LazyModule):
+            module._load()
@@ -0,0 +1,157 @@
+#------------------------------------------------------------------------------
+# Controlador de las luces (BlinkStick de 4 leds).
+# El dispositivo se busca una sola vez y cada fotograma de luces se envía en una
+# única escritura USB con set_led_data; si el fotograma no cambia, no se envía.
+# Incluye un dispositivo falso en memoria para comprobar los patrones sin hardware.
+#------------------------------------------------------------------------------
+
+import logging
+import threading
+import time
+import settings
+
+LED_COUNT = 4
+OFF = ((0, 0, 0),) * LED_COUNT
+
+
+class FakeBlinkStick(object):
+    ''' BlinkStick en memoria que guarda cada escritura con su instante '''
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.writes = []
+
+    def set_led_data(self, channel, data):
+        self.writes.append((self.clock(), channel, list(data)))
+
+    def set_color(self, channel=0, index=0, red=0, green=0, blue=0, **kwargs):
+        data = list(self.frames()[-1]) if self.writes else [(0, 0, 0)] * LED_COUNT
+        data[index] = (red, green, blue)
+        self.set_led_data(channel, [value for r, g, b in data for value in (g, r, b)])
+
+    def frames(self):
+        ''' Colores (r, g, b) de cada led en cada escritura '''
+
+        return [tuple((data[i + 1], data[i], data[i + 2]) for i in range(0, len(data), 3))
+                for _, _, data in self.writes]
+
+
+class LedController(object):
+    ''' Envía fotogramas de colores a los leds con una escritura por fotograma '''
+
+    def __init__(self, device=None, channel=0):
+        self.channel = channel
+        self._device = device
+        self._opened = device is not None
+        self._last_frame = None
+        self._lock = threading.Lock()
+        self._device_lock = threading.Lock()
+        self.writes = 0
+        self.skipped = 0
+
+    @property
+    def device(self):
+        ''' El dispositivo se busca la primera vez que se usa, y solo esa vez, aunque
+            lo pidan a la vez el hilo de las acciones y el de las señales '''
+
+        if not self._opened:
+            with self._device_lock:
+                if not self._opened:
+                    self._device = open_device()
+                    self._opened = True
+        return self._device
+
+    @property
+    def available(self):
+        return self.device is not None
+
+    def show(self, colors):
+        ''' Muestra un fotograma: una tupla de (r, g, b) por led '''
+
+        frame = tuple(tuple(color) for color in colors)
+        with self._lock:
+            if frame == self._last_frame:
+                self.skipped += 1
+                return
+            device = self.device
+            if device is None:
+                return
+
+            # La BlinkStick espera los colores en orden GRB
+            data = [value for red, green, blue in frame for value in (green, red, blue)]
+            try:
+                device.set_led_data(self.channel, data)
+            except Exception:
+                logging.exception('Error escribiendo en la BlinkStick')
+                return
+            self._last_frame = frame
+            self.writes += 1
+
+    def fill(self, color):
+        self.show((color,) * LED_COUNT)
+
+    def off(self):
+        self.show(OFF)
+
+    def play(self, frames, duration, clock=time.monotonic, sleep=time.sleep):
+        ''' Reproduce los fotogramas (colores, segundos) en bucle durante duration, bloqueando '''
+
+        start = clock()
+        end = start + duration
+        offset = start
+        while offset < end:
+            for colors, frame_duration in frames:
+                if offset >= end:
+                    break
+                delay = offset - clock()
+                if delay > 0:
+                    sleep(delay)
+                self.show(colors)
+                offset += frame_duration
+        self.off()
+
+
+def open_device(kind=None):
+    ''' Abre el dispositivo configurado en led_device: blinkstick, fake o none '''
+
+    if kind is None:
+        kind = settings.get('led_device', 'blinkstick')
+
+    if kind == 'fake':
+        return FakeBlinkStick()
+    if kind == 'none':
+        return None
+
+    try:
+        from blinkstick import blinkstick
+    except ImportError:
+        # Sin el paquete (p. ej. en un equipo sin el coche) las señales funcionan sin luces
+        logging.info('No está instalado el paquete blinkstick, las luces están desactivadas')
+        return None
+
+    device = blinkstick.find_first()
+    if device is None:
+        logging.info('No se encontró ninguna BlinkStick, las luces están desactivadas')
+    return device
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    ''' Controlador compartido por todas las señales '''
+
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = LedController()
+        return _controller
+
+
+def set_controller(controller):
+    ''' Sustituye el controlador compartido (p. ej. por uno con el dispositivo falso) '''
+
+    global _controller
+    with _controller_lock:
+        _controller = controller
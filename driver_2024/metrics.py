@@ -0,0 +1,241 @@
+#------------------------------------------------------------------------------
+# Métricas de latencia de cada etapa del coche: captura, preprocesado, inferencia,
+# postprocesado, giro de las ruedas, pantalla y acciones de las señales.
+# Cada métrica guarda sus últimas muestras en un buffer circular (percentiles de
+# la ventana reciente) y un histograma acumulado con cubetas fijas, sin reservar
+# memoria al anotar. Se exportan en formato de texto de Prometheus por HTTP
+# (metrics_port) o como una línea JSON por intervalo en un fichero (metrics_file).
+#------------------------------------------------------------------------------
+
+import bisect
+import json
+import logging
+import threading
+import time
+import numpy as np
+import settings
+
+# Límites superiores de las cubetas del histograma, en segundos
+BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.2, 0.5, 1.0, 2.0)
+
+PREFIX = 'smartpicar'
+
+now = time.perf_counter
+
+
+class Timer(object):
+    ''' Muestras de una etapa: buffer circular + histograma acumulado '''
+
+    def __init__(self, samples=2048, buckets=BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._ring = np.zeros(samples, dtype=np.float64)
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._ring[self._index] = seconds
+            self._index = (self._index + 1) % len(self._ring)
+            self.count += 1
+            self.sum += seconds
+            self.bucket_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def recent(self):
+        ''' Muestras de la ventana reciente, de la más antigua a la más nueva '''
+
+        with self._lock:
+            if self.count < len(self._ring):
+                return self._ring[:self.count].copy()
+            return np.roll(self._ring, -self._index)
+
+    def summary(self):
+        samples = self.recent() * 1000
+        summary = {'count': self.count, 'sum_s': self.sum}
+        if samples.size:
+            p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+            summary.update({'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99),
+                            'max_ms': float(samples.max())})
+        return summary
+
+
+class Metrics(object):
+    ''' Registro de temporizadores, contadores y medidas instantáneas, con etiquetas '''
+
+    def __init__(self, samples=2048):
+        self.samples = samples
+        self.started = time.time()
+        self._timers = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def timer(self, stage, model=''):
+        key = (stage, model)
+        timer = self._timers.get(key)
+        if timer is None:
+            with self._lock:
+                timer = self._timers.setdefault(key, Timer(self.samples))
+        return timer
+
+    def observe(self, stage, seconds, model=''):
+        self.timer(stage, model).observe(seconds)
+
+    def since(self, stage, start, model=''):
+        ''' Anota el tiempo transcurrido desde start (tomado con metrics.now()) y devuelve el instante actual '''
+
+        end = now()
+        self.timer(stage, model).observe(end - start)
+        return end
+
+    def count(self, name, n=1, label=''):
+        key = (name, label)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def gauge(self, name, function):
+        ''' Medida que se lee al exportar, p. ej. la frecuencia de detección del planificador '''
+
+        self._gauges[name] = function
+
+    def _gauge_values(self):
+        values = {}
+        for name, function in list(self._gauges.items()):
+            try:
+                values[name] = float(function())
+            except Exception:
+                logging.exception(f"Error leyendo la métrica {name}")
+        return values
+
+    def snapshot(self):
+        ''' Estado actual como diccionario (una línea del fichero JSONL) '''
+
+        return {'time': time.time(),
+                'uptime_s': time.time() - self.started,
+                'stages': {f"{stage}/{model}" if model else stage: timer.summary()
+                           for (stage, model), timer in list(self._timers.items())},
+                'counters': {f"{name}/{label}" if label else name: value
+                             for (name, label), value in list(self._counters.items())},
+                'gauges': self._gauge_values()}
+
+    def prometheus(self):
+        ''' Texto en el formato de exposición de Prometheus '''
+
+        lines = [f"# HELP {PREFIX}_stage_seconds Latencia de cada etapa",
+                 f"# TYPE {PREFIX}_stage_seconds histogram"]
+        for (stage, model), timer in sorted(self._timers.items()):
+            labels = f'stage="{stage}",model="{model}"'
+            cumulative = 0
+            for bound, count in zip(self.bucket_bounds(timer), timer.bucket_counts):
+                cumulative += count
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{{labels}}} {timer.sum}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{{labels}}} {timer.count}')
+
+        lines += [f"# HELP {PREFIX}_stage_recent_seconds Percentiles de las últimas muestras de cada etapa",
+                  f"# TYPE {PREFIX}_stage_recent_seconds gauge"]
+        for (stage, model), timer in sorted(self._timers.items()):
+            samples = timer.recent()
+            if samples.size:
+                for quantile, value in zip((0.5, 0.95, 0.99), np.percentile(samples, (50, 95, 99))):
+                    lines.append(f'{PREFIX}_stage_recent_seconds{{stage="{stage}",model="{model}",quantile="{quantile}"}} {value}')
+
+        lines.append(f"# TYPE {PREFIX}_events_total counter")
+        for (name, label), value in sorted(self._counters.items()):
+            lines.append(f'{PREFIX}_events_total{{event="{name}",label="{label}"}} {value}')
+
+        for name, value in sorted(self._gauge_values().items()):
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def bucket_bounds(timer):
+        return [str(bound) for bound in timer.buckets] + ['+Inf']
+
+
+class PrometheusExporter(object):
+    ''' Servidor HTTP local que sirve las métricas en /metrics '''
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        # Solo se importa si se usa: http.server tarda en cargarse en la Raspberry
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+        logging.info(f"Métricas en http://{host}:{self.server.server_address[1]}/metrics")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JsonlExporter(object):
+    ''' Escribe una línea JSON con el estado de las métricas cada interval segundos '''
+
+    def __init__(self, metrics, path, interval=5.0):
+        self.metrics = metrics
+        self.interval = interval
+        self._file = open(path, 'a')
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-jsonl', daemon=True)
+        self._thread.start()
+        logging.info(f"Métricas en {path}")
+
+    def write(self):
+        self._file.write(json.dumps(self.metrics.snapshot()) + '\n')
+        self._file.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(1)
+        self.write()
+        self._file.close()
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    ''' Registro compartido por todas las etapas '''
+
+    return _metrics
+
+
+def start_exporters(metrics=None):
+    ''' Arranca los exportadores configurados (metrics_port, metrics_file) y los devuelve '''
+
+    if metrics is None:
+        metrics = _metrics
+    exporters = []
+    port = settings.get('metrics_port', 0, int)
+    if port:
+        # Por defecto solo desde el coche; metrics_host = 0.0.0.0 para que Prometheus lo lea por la red
+        exporters.append(PrometheusExporter(metrics, port, settings.get('metrics_host', '127.0.0.1')))
+    path = settings.get('metrics_file', None)
+    if path:
+        exporters.append(JsonlExporter(metrics, path, settings.get('metrics_interval', 5.0, float)))
+    return exporters
@@ -0,0 +1,102 @@
+#------------------------------------------------------------------------------
+# Línea de dirección sobre el fotograma sin cálculos ni reservas por fotograma:
+# - los extremos de la línea de cada ángulo entero de 45 a 135 se calculan una
+#   vez por resolución y se consultan en una tabla
+# - el fotograma oscurecido y la línea se dibujan en unos pocos buffers que se
+#   reutilizan cuando quien muestra el fotograma lo devuelve, en lugar de crear
+#   un fotograma negro y mezclarlo con cv2.addWeighted en cada fotograma
+#------------------------------------------------------------------------------
+
+import functools
+import math
+import threading
+from lazy import lazy_import
+cv2 = lazy_import('cv2')
+import numpy as np
+
+MIN_ANGLE = 45
+MAX_ANGLE = 135
+
+LINE_COLOR = (0, 0, 255)
+LINE_WIDTH = 5
+
+
+def _heading_line_points(steering_angle, width, height):
+    steering_angle_radian = steering_angle / 180.0 * math.pi
+    x1 = int(width / 2)
+    y1 = height
+    x2 = int(x1 - height / 2 / math.tan(steering_angle_radian))
+    y2 = int(height / 2)
+    return (x1, y1), (x2, y2)
+
+
+@functools.lru_cache(maxsize=8)
+def heading_line_table(width, height):
+    ''' Extremos de la línea para cada ángulo entero de MIN_ANGLE a MAX_ANGLE '''
+
+    return tuple(_heading_line_points(angle, width, height) for angle in range(MIN_ANGLE, MAX_ANGLE + 1))
+
+
+def heading_line_points(steering_angle, width, height):
+    ''' Extremos de la línea de dirección: del centro inferior a media altura '''
+
+    if steering_angle == int(steering_angle) and MIN_ANGLE <= steering_angle <= MAX_ANGLE:
+        return heading_line_table(width, height)[int(steering_angle) - MIN_ANGLE]
+    return _heading_line_points(steering_angle, width, height)
+
+
+def draw_heading_line(image, steering_angle, line_color=LINE_COLOR, line_width=LINE_WIDTH):
+    ''' Dibuja la línea de dirección directamente sobre image, sin reservar memoria '''
+
+    height, width = image.shape[:2]
+    start, end = heading_line_points(steering_angle, width, height)
+    cv2.line(image, start, end, line_color, line_width)
+    return image
+
+
+class HeadingOverlay(object):
+    ''' Fotograma oscurecido con la línea de dirección, en buffers reutilizados.
+        Cada buffer queda ocupado desde que se pinta hasta que quien consume el
+        fotograma lo devuelve con release (la pantalla después de mostrarlo, o la
+        cola que lo descarta). Con el pipeline bastan 3: el que se dibuja, el que
+        espera en el hueco de la pantalla y el que se está mostrando. Si no se ha
+        devuelto ninguno se pinta en un buffer nuevo, fuera de la reserva, en lugar
+        de pintar encima de uno publicado '''
+
+    def __init__(self, buffers=3, alpha=0.8, beta=1):
+        self.alpha = alpha
+        self.beta = beta
+        self._buffers = [None] * buffers
+        self._free = [True] * buffers
+        self._lock = threading.Lock()
+        self.allocations = 0
+
+    def _acquire(self, frame):
+        with self._lock:
+            for index, buffer in enumerate(self._buffers):
+                if not self._free[index]:
+                    continue
+                if buffer is None or buffer.shape != frame.shape or buffer.dtype != frame.dtype:
+                    buffer = self._buffers[index] = np.empty_like(frame)
+                    self.allocations += 1
+                self._free[index] = False
+                return buffer
+            self.allocations += 1
+        return np.empty_like(frame)
+
+    def release(self, image):
+        ''' Devuelve el buffer de un fotograma de render; cualquier otra imagen se ignora '''
+
+        base = image if image.base is None else image.base
+        with self._lock:
+            for index, buffer in enumerate(self._buffers):
+                if buffer is base:
+                    self._free[index] = True
+                    return True
+        return False
+
+    def render(self, frame, steering_angle, line_color=LINE_COLOR, line_width=LINE_WIDTH):
+        buffer = self._acquire(frame)
+        cv2.convertScaleAbs(frame, buffer, self.alpha, self.beta)
+        draw_heading_line(buffer, steering_angle, line_color, line_width)
+        return buffer.view()
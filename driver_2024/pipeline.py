@@ -0,0 +1,212 @@
+#------------------------------------------------------------------------------
+# Cadena de etapas (captura, carril, señales, pantalla) conectadas por colas de un
+# solo hueco en las que el último fotograma sustituye al pendiente. Así una etapa
+# lenta (la pantalla o la detección de señales) pierde fotogramas pero nunca
+# retrasa a las demás, en particular al cálculo del ángulo de giro.
+# Los fotogramas son inmutables una vez publicados y guardan la hora a la que
+# cada etapa los terminó.
+#------------------------------------------------------------------------------
+
+import logging
+import threading
+import time
+from collections import namedtuple
+
+
+class Frame(namedtuple('Frame', ['seq', 'image', 'timestamps'])):
+    ''' Fotograma publicado: número de secuencia, imagen de solo lectura y
+        tupla de (etapa, instante) en el orden en que se procesó '''
+
+    __slots__ = ()
+
+    @classmethod
+    def publish(cls, seq, image, stage='capture', timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        image.flags.writeable = False
+        return cls(seq, image, ((stage, timestamp),))
+
+    def stamp(self, stage, image=None, timestamp=None):
+        ''' Devuelve un fotograma nuevo con la marca de la etapa y, si se da, otra imagen '''
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if image is None:
+            image = self.image
+        elif image is not self.image:
+            image.flags.writeable = False
+        return Frame(self.seq, image, self.timestamps + ((stage, timestamp),))
+
+    def timestamp(self, stage):
+        for name, t in self.timestamps:
+            if name == stage:
+                return t
+        return None
+
+    def latency(self, start='capture', end=None):
+        ''' Segundos entre dos etapas; sin etapa final, hasta la última marca '''
+
+        end_time = self.timestamps[-1][1] if end is None else self.timestamp(end)
+        return end_time - self.timestamp(start)
+
+
+class LatestSlot(object):
+    ''' Cola acotada de un solo hueco: publicar sustituye al elemento no leído,
+        que se entrega a on_drop si se indica '''
+
+    def __init__(self, on_drop=None):
+        self._condition = threading.Condition()
+        self._item = None
+        self.on_drop = on_drop
+        self._closed = False
+        self.published = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self._condition:
+            dropped = self._item
+            if dropped is not None:
+                self.dropped += 1
+            self._item = item
+            self.published += 1
+            self._condition.notify_all()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+    def get(self, timeout=None):
+        ''' Espera al siguiente elemento; devuelve None si se agota el tiempo o se cierra '''
+
+        with self._condition:
+            if self._item is None and not self._closed:
+                self._condition.wait(timeout)
+            item = self._item
+            self._item = None
+            return item
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class Stage(object):
+    ''' Etapa que corre en su propio hilo: lee de una cola (o de nada, si es la
+        primera), llama a la función y publica el resultado en sus salidas '''
+
+    def __init__(self, name, function, source=None, outputs=(), idle=0.005):
+        self.name = name
+        self.function = function
+        self.source = source
+        self.outputs = list(outputs)
+        self.idle = idle  # espera de la primera etapa cuando no produce nada (cámara sin fotograma)
+        self.processed = 0
+        self.last_duration = 0.0
+        self.error = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def join(self, timeout=None):
+        ''' Espera al hilo y relanza el error que lo paró, si lo hubo '''
+
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        if self.error is not None:
+            raise RuntimeError(f"La etapa {self.name} se detuvo por un error") from self.error
+
+    def _run(self):
+        while self._running:
+            if self.source is None:
+                args = ()
+            else:
+                frame = self.source.get(timeout=0.1)
+                if frame is None:
+                    continue
+                args = (frame,)
+
+            start = time.monotonic()
+            try:
+                result = self.function(*args)
+            except Exception as error:
+                # El hilo termina, pero el error queda a la vista de Pipeline.error
+                # para que el bucle principal pare el coche
+                logging.exception(f"Error en la etapa {self.name}")
+                self.error = error
+                self._running = False
+                return
+            self.last_duration = time.monotonic() - start
+            self.processed += 1
+
+            if result is not None:
+                for output in self.outputs:
+                    output.put(result)
+            elif self.source is None:
+                time.sleep(self.idle)
+
+
+class Pipeline(object):
+    ''' Conjunto de etapas y colas que se arrancan y paran a la vez '''
+
+    def __init__(self):
+        self.stages = []
+        self.slots = {}
+
+    def slot(self, name, on_drop=None):
+        if name not in self.slots:
+            self.slots[name] = LatestSlot()
+        if on_drop is not None:
+            self.slots[name].on_drop = on_drop
+        return self.slots[name]
+
+    def add_stage(self, name, function, source=None, outputs=()):
+        stage = Stage(name,
+                      function,
+                      self.slot(source) if source is not None else None,
+                      [self.slot(output) for output in outputs])
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    @property
+    def error(self):
+        ''' Primer error que ha parado una etapa, o None '''
+
+        for stage in self.stages:
+            if stage.error is not None:
+                return stage.error
+        return None
+
+    def check(self):
+        ''' Lanza RuntimeError si alguna etapa se ha parado por un error '''
+
+        for stage in self.stages:
+            if stage.error is not None:
+                raise RuntimeError(f"La etapa {stage.name} se detuvo por un error") from stage.error
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+        for slot in self.slots.values():
+            slot.close()
+        for stage in self.stages:
+            try:
+                stage.join(1)
+            except RuntimeError:
+                pass  # ya se registró al producirse
+
+    def stats(self):
+        ''' Fotogramas procesados por etapa y perdidos por cola '''
+
+        return {'stages': {stage.name: {'processed': stage.processed,
+                                        'last_duration': stage.last_duration} for stage in self.stages},
+                'dropped': {name: slot.dropped for name, slot in self.slots.items()}}
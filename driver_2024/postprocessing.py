@@ -0,0 +1,218 @@
+#------------------------------------------------------------------------------
+# Postprocesado de las salidas de los modelos. Del detector de señales: umbral de
+# confianza, supresión de no máximos por clase y orden por confianza x proximidad,
+# con operaciones de NumPy si quedan muchas cajas y con bucles si quedan pocas.
+# El resultado es un array estructurado con una fila por detección, con las
+# cajas en píxeles del fotograma aunque el modelo haya visto varias ventanas.
+# Del modelo del carril: el ángulo, descuantizado si el modelo es de 8 bits.
+#------------------------------------------------------------------------------
+
+import numpy as np
+from roi import to_frame
+
+DETECTION_DTYPE = np.dtype([('class_id', np.int16),
+                            ('score', np.float32),
+                            ('ymin', np.float32),
+                            ('xmin', np.float32),
+                            ('ymax', np.float32),
+                            ('xmax', np.float32),
+                            ('proximity', np.float32),
+                            ('rank', np.float32)])
+
+# Orden de los tensores de salida del modelo SSD exportado con la API de detección de objetos
+SCORES_OUTPUT = 0
+BOXES_OUTPUT = 1
+COUNT_OUTPUT = 2
+CLASSES_OUTPUT = 3
+
+# Altura en píxeles a partir de la cual la señal está cerca: el 32% de un fotograma de 240
+NEAR_HEIGHT = 0.32 * 240
+
+
+def box_iou(boxes):
+    ''' Matriz de IoU entre todas las cajas [ymin, xmin, ymax, xmax] '''
+
+    ymin, xmin, ymax, xmax = boxes.T
+    areas = (ymax - ymin) * (xmax - xmin)
+
+    inter_h = np.minimum(ymax[:, None], ymax[None, :]) - np.maximum(ymin[:, None], ymin[None, :])
+    inter_w = np.minimum(xmax[:, None], xmax[None, :]) - np.maximum(xmin[:, None], xmin[None, :])
+    intersection = np.maximum(inter_h, 0) * np.maximum(inter_w, 0)
+
+    union = areas[:, None] + areas[None, :] - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+
+def class_aware_nms(boxes, classes, iou_threshold):
+    ''' Supresión de no máximos por clase sobre cajas ya ordenadas por confianza.
+        Desplaza cada clase a una zona distinta para que no se solapen entre sí y
+        descarta toda caja que solape demasiado con otra de mayor confianza (Fast NMS) '''
+
+    offset = float(boxes.max()) + 1
+    shifted = boxes + (classes.astype(np.float32) * offset)[:, None]
+    iou = box_iou(shifted)
+    order = np.arange(len(boxes))
+    iou[order[:, None] >= order[None, :]] = 0
+    return iou.max(axis=0) <= iou_threshold
+
+
+# Con pocas cajas por encima del umbral, los bucles de Python evitan el coste fijo
+# de las operaciones de numpy (unos 70 us frente a menos de 10 con 10 cajas)
+SMALL_COUNT = 16
+
+
+def postprocess(scores, boxes, classes, threshold=0.6, iou_threshold=0.5, near_height=NEAR_HEIGHT):
+    ''' Devuelve las detecciones válidas ordenadas de mayor a menor confianza x proximidad '''
+
+    selected = np.flatnonzero(scores > threshold)
+    if selected.size == 0:
+        return np.empty(0, dtype=DETECTION_DTYPE)
+    if selected.size <= SMALL_COUNT:
+        return postprocess_loop(scores, boxes, classes, selected, iou_threshold, near_height)
+    return postprocess_vectorized(scores, boxes, classes, selected, iou_threshold, near_height)
+
+
+def postprocess_loop(scores, boxes, classes, selected, iou_threshold=0.5, near_height=NEAR_HEIGHT):
+    ''' postprocess con bucles de Python sobre las cajas seleccionadas; misma supresión
+        que class_aware_nms: se descarta la caja que solapa con otra de mayor confianza '''
+
+    candidates = [(int(classes[i]), float(scores[i]), *boxes[i].tolist()) for i in selected.tolist()]
+    candidates.sort(key=lambda candidate: -candidate[1])
+
+    rows = []
+    for n, (class_id, score, ymin, xmin, ymax, xmax) in enumerate(candidates):
+        area = (ymax - ymin) * (xmax - xmin)
+        for other_class, _, other_ymin, other_xmin, other_ymax, other_xmax in candidates[:n]:
+            if other_class != class_id:
+                continue
+            inter_h = min(ymax, other_ymax) - max(ymin, other_ymin)
+            inter_w = min(xmax, other_xmax) - max(xmin, other_xmin)
+            if inter_h <= 0 or inter_w <= 0:
+                continue
+            intersection = inter_h * inter_w
+            union = area + (other_ymax - other_ymin) * (other_xmax - other_xmin) - intersection
+            if intersection / max(union, 1e-9) > iou_threshold:
+                break
+        else:
+            proximity = min((ymax - ymin) / near_height, 1)
+            rows.append((class_id, score, ymin, xmin, ymax, xmax, proximity, score * proximity))
+
+    rows.sort(key=lambda row: -row[7])
+    return np.array(rows, dtype=DETECTION_DTYPE)
+
+
+def postprocess_vectorized(scores, boxes, classes, selected, iou_threshold=0.5, near_height=NEAR_HEIGHT):
+    ''' postprocess con operaciones de numpy, para muchas cajas seleccionadas '''
+
+    selected = selected[np.argsort(-scores[selected], kind='stable')]
+    scores = scores[selected]
+    boxes = boxes[selected]
+    classes = classes[selected].astype(np.int16)
+
+    if selected.size > 1:
+        keep = class_aware_nms(boxes, classes, iou_threshold)
+        scores, boxes, classes = scores[keep], boxes[keep], classes[keep]
+
+    detections = np.empty(scores.size, dtype=DETECTION_DTYPE)
+    detections['class_id'] = classes
+    detections['score'] = scores
+    detections['ymin'] = boxes[:, 0]
+    detections['xmin'] = boxes[:, 1]
+    detections['ymax'] = boxes[:, 2]
+    detections['xmax'] = boxes[:, 3]
+    detections['proximity'] = np.minimum((boxes[:, 2] - boxes[:, 0]) / near_height, 1)
+    detections['rank'] = detections['score'] * detections['proximity']
+
+    return detections[np.argsort(-detections['rank'], kind='stable')]
+
+
+class DetectionPostprocessor(object):
+    ''' Lee las salidas del detector (índices resueltos una sola vez) de cada ventana
+        analizada, pasa sus cajas a píxeles del fotograma y las postprocesa juntas '''
+
+    def __init__(self, interpreter, threshold=0.6, iou_threshold=0.5, near_height=NEAR_HEIGHT):
+        self.threshold = threshold
+        self.iou_threshold = iou_threshold
+        self.near_height = near_height
+
+        _, self.input_height, self.input_width, _ = [int(d) for d in interpreter.get_input_details()[0]['shape']]
+        output_details = interpreter.get_output_details()
+        self._scores = interpreter.tensor(output_details[SCORES_OUTPUT]['index'])
+        self._boxes = interpreter.tensor(output_details[BOXES_OUTPUT]['index'])
+        self._classes = interpreter.tensor(output_details[CLASSES_OUTPUT]['index'])
+
+        # Salidas acumuladas de las ventanas del fotograma; crecen si hay más ventanas
+        self._detections_per_window = int(output_details[SCORES_OUTPUT]['shape'][-1])
+        self._all_scores = np.empty(0, dtype=np.float32)
+        self._all_boxes = np.empty((0, 4), dtype=np.float32)
+        self._all_classes = np.empty(0, dtype=np.float32)
+        self._count = 0
+
+    def collect(self, window):
+        ''' Guarda las salidas de la última inferencia, hecha sobre window '''
+
+        n = self._detections_per_window
+        if self._count + n > len(self._all_scores):
+            size = self._count + n
+            self._all_scores = np.resize(self._all_scores, size)
+            self._all_boxes = np.resize(self._all_boxes, (size, 4))
+            self._all_classes = np.resize(self._all_classes, size)
+
+        end = self._count + n
+        self._all_scores[self._count:end] = self._scores()[0]
+        self._all_classes[self._count:end] = self._classes()[0]
+        to_frame(self._boxes()[0], window, self.input_width, self.input_height, out=self._all_boxes[self._count:end])
+        self._count = end
+
+    def __call__(self):
+        ''' Detecciones de todas las ventanas recogidas desde la llamada anterior '''
+
+        count, self._count = self._count, 0
+        return postprocess(self._all_scores[:count],
+                           self._all_boxes[:count],
+                           self._all_classes[:count],
+                           self.threshold,
+                           self.iou_threshold,
+                           self.near_height)
+
+
+def quantization_params(details):
+    ''' (escala, punto cero) de un tensor; (1, 0) si no está cuantizado '''
+
+    scale, zero_point = details['quantization']
+    if not np.issubdtype(np.dtype(details['dtype']), np.integer) or scale == 0:
+        return 1.0, 0
+    return float(scale), int(zero_point)
+
+
+def dequantize(values, scale, zero_point, out=None):
+    ''' Valores reales de un tensor cuantizado: (q - zero_point) * scale '''
+
+    return np.multiply(np.subtract(values, zero_point, dtype=np.float32), scale, out=out)
+
+
+class SteeringPostprocessor(object):
+    ''' Ángulo de giro de la salida del modelo del carril, en float o cuantizada a 8 bits.
+        La descuantización y el redondeo se reducen a una multiplicación y una suma '''
+
+    def __init__(self, interpreter):
+        details = interpreter.get_output_details()[0]
+        self._output = interpreter.tensor(details['index'])
+        self.scale, self.zero_point = quantization_params(details)
+        # int((q - zero_point) * scale + 0.5) == int(q * scale + offset)
+        self._offset = 0.5 - self.zero_point * self.scale
+
+    def value(self):
+        ''' Ángulo sin redondear de la última inferencia '''
+
+        return (float(self._output()[0, 0]) - self.zero_point) * self.scale
+
+    def __call__(self):
+        ''' Ángulo redondeado de la última inferencia '''
+
+        return int(float(self._output()[0, 0]) * self.scale + self._offset)
+
+    def angles(self, count=1):
+        ''' Ángulos redondeados de las primeras count imágenes del lote de la última inferencia '''
+
+        return (self._output()[:count, 0].astype(np.float64) * self.scale + self._offset).astype(np.int64)
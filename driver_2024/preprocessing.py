@@ -0,0 +1,101 @@
+#------------------------------------------------------------------------------
+# Preprocesado de los fotogramas para los modelos sin reservar memoria por fotograma.
+# Cada modelo tiene su propio preprocesador, que guarda los buffers intermedios
+# y escribe el resultado directamente en el tensor de entrada del intérprete,
+# con el tipo y la cuantización que espera el modelo.
+# El detector de señales puede recibir una ventana del fotograma (ver roi.py),
+# que se coloca en la entrada con o sin bandas negras.
+#------------------------------------------------------------------------------
+
+from lazy import lazy_import
+cv2 = lazy_import('cv2')
+import numpy as np
+
+
+def make_lut(dtype, quantization=(0.0, 0), normalize=True):
+    ''' Tabla de 256 valores que pasa cada píxel al tipo y la escala del tensor de entrada.
+        Devuelve None si el tensor admite el píxel sin transformar (uint8 sin escalar) '''
+
+    scale, zero_point = quantization
+    pixels = np.arange(256, dtype=np.float64)
+    values = pixels / 255 if normalize else pixels
+
+    if np.issubdtype(dtype, np.floating):
+        return values.astype(dtype).reshape(256, 1)
+
+    if scale == 0:
+        # Tensor entero sin cuantizar: el modelo espera los píxeles tal cual
+        values = pixels
+    else:
+        values = np.round(values / scale + zero_point)
+
+    info = np.iinfo(dtype)
+    values = np.clip(values, info.min, info.max)
+    if dtype == np.uint8 and np.array_equal(values, pixels):
+        return None
+    return values.astype(dtype).reshape(256, 1)
+
+
+class Preprocessor(object):
+    ''' Recorta, redimensiona y pasa a RGB el fotograma sobre el tensor de entrada del modelo '''
+
+    def __init__(self, interpreter, crop_top=0.0, normalize=True):
+        details = interpreter.get_input_details()[0]
+        _, self.height, self.width, channels = [int(d) for d in details['shape']]
+        self.dtype = np.dtype(details['dtype'])
+        self.crop_top = crop_top
+
+        # Se guarda la función y no la vista: el intérprete no permite invocar
+        # mientras haya arrays apuntando a sus tensores
+        self._tensor = interpreter.tensor(details['index'])
+
+        self._lut = make_lut(self.dtype, details['quantization'], normalize)
+        self._resized = np.empty((self.height, self.width, channels), dtype=np.uint8)
+        self._rgb = np.empty_like(self._resized) if self._lut is not None else None
+        self._padding = None
+
+    def __call__(self, frame, window=None, index=0):
+        ''' index es la posición en el lote si el tensor admite varias imágenes (ver fleet.py) '''
+
+        if window is None:
+            top = int(len(frame) * self.crop_top)
+            cv2.resize(frame[top:], (self.width, self.height), dst=self._resized)
+            self._padding = None
+        else:
+            self._resize_window(frame, window)
+
+        tensor = self._tensor()[index]
+        if self._lut is None:
+            cv2.cvtColor(self._resized, cv2.COLOR_BGR2RGB, dst=tensor)
+        else:
+            cv2.cvtColor(self._resized, cv2.COLOR_BGR2RGB, dst=self._rgb)
+            cv2.LUT(self._rgb, self._lut, dst=tensor)
+
+    def _resize_window(self, frame, window):
+        ''' Redimensiona la ventana sobre su hueco de la entrada; las bandas solo se
+            vuelven a pintar de negro si cambia la colocación respecto a la anterior '''
+
+        padding = (window.pad_x, window.pad_y, window.resized_width, window.resized_height)
+        if padding != self._padding:
+            self._resized.fill(0)
+            self._padding = padding
+
+        crop = frame[window.y:window.y + window.height, window.x:window.x + window.width]
+        target = self._resized[window.pad_y:window.pad_y + window.resized_height,
+                               window.pad_x:window.pad_x + window.resized_width]
+        cv2.resize(crop, (window.resized_width, window.resized_height), dst=target)
+
+
+class LanePreprocessor(Preprocessor):
+    ''' Mitad inferior del fotograma, 200x66, RGB y normalizado a [0, 1].
+        Con el modelo cuantizado (quantize_lane.py) el píxel pasa tal cual a la entrada uint8 '''
+
+    def __init__(self, interpreter):
+        super().__init__(interpreter, crop_top=0.5, normalize=True)
+
+
+class SignalPreprocessor(Preprocessor):
+    ''' Fotograma completo o una ventana, 320x320 y RGB '''
+
+    def __init__(self, interpreter):
+        super().__init__(interpreter, crop_top=0.0, normalize=True)
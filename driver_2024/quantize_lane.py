@@ -0,0 +1,153 @@
+#------------------------------------------------------------------------------
+# Modelo del carril cuantizado a 8 bits (entrada y salida uint8) para el Edge TPU
+# y para la CPU, y comprobación de que gira igual que el modelo en float:
+# - convert: cuantiza el modelo de Keras (.h5/.keras) o SavedModel con las
+#   imágenes de entrenamiento como conjunto representativo. Necesita TensorFlow,
+#   así que se ejecuta en el ordenador, no en la Raspberry
+# - check: pasa las mismas imágenes por el .tflite en float y por el cuantizado y
+#   compara los ángulos entre sí y con las etiquetas, y la velocidad de cada uno
+# Uso:
+#   python3 quantize_lane.py convert modelo_carril.h5 ../footage/v101530 --output lane-int8.tflite
+#   python3 quantize_lane.py check ../lane-navigation-model-finetuned.tflite lane-int8.tflite ../footage/v101530
+#   edgetpu_compiler lane-int8.tflite
+#------------------------------------------------------------------------------
+
+import argparse
+import json
+import logging
+import sys
+import numpy as np
+from backends import make_interpreter, input_tensor, LANE_MODEL_SPEC
+from evaluate import steering_dataset, run_inference, _load
+from preprocessing import LanePreprocessor
+
+
+def representative_inputs(float_model, sources, samples=300):
+    ''' Entradas del modelo en float para las imágenes indicadas, preprocesadas
+        exactamente igual que en el coche (LanePreprocessor sobre el .tflite en float) '''
+
+    interpreter = make_interpreter(float_model, LANE_MODEL_SPEC, 'cpu', 1)
+    preprocessor = LanePreprocessor(interpreter)
+    step = max(len(sources) // samples, 1)
+    for source in sources[::step][:samples]:
+        image = _load(source)
+        if image is None:
+            continue
+        preprocessor(image)
+        yield input_tensor(interpreter)[np.newaxis].astype(np.float32)
+
+
+def convert(model_path, sources, float_model, output, samples=300):
+    ''' Cuantización completa a enteros con entrada y salida uint8 '''
+
+    try:
+        import tensorflow as tf
+    except ImportError:
+        raise ImportError('convert necesita TensorFlow (pip install tensorflow)')
+
+    if model_path.endswith(('.h5', '.keras')):
+        converter = tf.lite.TFLiteConverter.from_keras_model(tf.keras.models.load_model(model_path))
+    else:
+        converter = tf.lite.TFLiteConverter.from_saved_model(model_path)
+
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = lambda: ([data] for data in representative_inputs(float_model, sources, samples))
+    # Solo operaciones enteras: si alguna no se puede cuantizar, falla aquí y no en el Edge TPU
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+    converter.inference_output_type = tf.uint8
+
+    with open(output, 'wb') as f:
+        f.write(converter.convert())
+
+    interpreter = make_interpreter(output, backend='cpu')
+    return {'model': output,
+            'input': _describe(interpreter.get_input_details()[0]),
+            'output': _describe(interpreter.get_output_details()[0])}
+
+
+def _describe(details):
+    return {'dtype': np.dtype(details['dtype']).name,
+            'scale': float(details['quantization'][0]),
+            'zero_point': int(details['quantization'][1])}
+
+
+def _angle_errors(predicted, angles):
+    errors = np.abs(predicted - angles)
+    return {'mae': float(errors.mean()),
+            'max_error': float(errors.max()),
+            'within_3_deg': float((errors <= 3).mean())}
+
+
+def check(float_model, quantized_model, sources, angles, backend=None, workers=None, batch_size=16):
+    ''' Ángulos del modelo cuantizado frente a los del modelo en float y a las etiquetas '''
+
+    float_values, float_speed = run_inference('steering', sources, float_model, 'cpu', workers, batch_size)
+    quantized_values, quantized_speed = run_inference('steering', sources, quantized_model, backend, workers, batch_size)
+
+    valid = np.array([a is not None and b is not None for a, b in zip(float_values, quantized_values)])
+    if not valid.any():
+        raise ValueError('No se pudo leer ninguna imagen')
+    float_values = np.array([v for v, ok in zip(float_values, valid) if ok])
+    quantized_values = np.array([v for v, ok in zip(quantized_values, valid) if ok])
+    # El mismo redondeo que en el coche
+    float_angles = np.floor(float_values + 0.5)
+    quantized_angles = np.floor(quantized_values + 0.5)
+
+    agreement = _angle_errors(quantized_angles, float_angles)
+    agreement['raw_mae'] = float(np.abs(quantized_values - float_values).mean())
+    return {'images': int(valid.sum()),
+            'float': dict(_angle_errors(float_angles, angles[valid]), images_per_sec=float_speed),
+            'quantized': dict(_angle_errors(quantized_angles, angles[valid]), images_per_sec=quantized_speed),
+            'agreement': agreement}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cuantización a 8 bits del modelo del carril')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert_parser = subparsers.add_parser('convert', help='cuantiza el modelo de Keras o SavedModel')
+    convert_parser.add_argument('model', help='modelo de Keras (.h5/.keras) o carpeta SavedModel')
+    convert_parser.add_argument('dataset', help='imágenes etiquetadas o conjunto de recorder.py')
+    convert_parser.add_argument('--float-model', default='../lane-navigation-model-finetuned.tflite',
+                                help='.tflite en float con el que se preprocesan las imágenes')
+    convert_parser.add_argument('--samples', type=int, default=300)
+    convert_parser.add_argument('--output', default='lane-navigation-model-int8.tflite')
+
+    check_parser = subparsers.add_parser('check', help='compara el modelo cuantizado con el de float')
+    check_parser.add_argument('float_model')
+    check_parser.add_argument('quantized_model')
+    check_parser.add_argument('dataset', help='imágenes etiquetadas o conjunto de recorder.py')
+    check_parser.add_argument('--backend', choices=('edgetpu', 'cpu'), help='del modelo cuantizado')
+    check_parser.add_argument('--workers', type=int, help='procesos; por defecto, uno por núcleo')
+    check_parser.add_argument('--batch-size', type=int, default=16)
+    check_parser.add_argument('--max-mae', type=float, default=1.0,
+                              help='diferencia media máxima admitida, en grados, con el modelo en float')
+    check_parser.add_argument('--output', help='fichero JSON donde guardar el informe')
+    args = parser.parse_args()
+
+    sources, angles = steering_dataset(args.dataset)
+    if not sources:
+        parser.error(f"No hay imágenes etiquetadas con el ángulo en {args.dataset}")
+
+    if args.command == 'convert':
+        report = convert(args.model, sources, args.float_model, args.output, args.samples)
+        print(json.dumps(report, indent=2))
+        return
+
+    report = check(args.float_model, args.quantized_model, sources, angles,
+                   args.backend, args.workers, args.batch_size)
+    report['max_mae'] = args.max_mae
+    report['passed'] = report['agreement']['mae'] <= args.max_mae
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    if not report['passed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
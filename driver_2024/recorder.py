@@ -0,0 +1,257 @@
+#------------------------------------------------------------------------------
+# Grabación de datos de entrenamiento sin frenar la conducción.
+# Los fotogramas se pasan a un hilo que los escribe por bloques:
+# - raw: arrays uint8 (N, alto, ancho, 3) en ficheros .npy que se abren con mmap
+# - jpeg: fotogramas JPEG concatenados en ficheros .bin
+# Cada bloque tiene su índice .npy con el instante, el ángulo y la velocidad,
+# que se guarda cada vez que el hilo vacía la cola: si el programa se corta, lo
+# ya grabado se puede leer. El último bloque raw se recorta a lo escrito.
+# DatasetReader lee cualquiera de los dos formatos para entrenar directamente.
+#------------------------------------------------------------------------------
+
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from lazy import lazy_import
+cv2 = lazy_import('cv2')
+import numpy as np
+
+META_DTYPE = np.dtype([('frame', np.int64),
+                       ('timestamp', np.float64),
+                       ('angle', np.int16),
+                       ('speed', np.int16),
+                       ('chunk', np.int32),
+                       ('offset', np.int64),
+                       ('length', np.int64)])
+
+FORMATS = ('raw', 'jpeg')
+
+
+class DatasetRecorder(object):
+    ''' Graba fotogramas y etiquetas en un hilo aparte '''
+
+    def __init__(self, directory, frame_shape=(240, 320, 3), chunk_size=500, format='raw',
+                 jpeg_quality=90, queue_size=64):
+        if format not in FORMATS:
+            raise ValueError(f"Formato desconocido: {format} (opciones: {', '.join(FORMATS)})")
+
+        self.directory = directory
+        self.frame_shape = tuple(frame_shape)
+        self.chunk_size = chunk_size
+        self.format = format
+        self.jpeg_quality = jpeg_quality
+
+        self.recorded = 0
+        self.dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'dataset.json'), 'w') as f:
+            json.dump({'format': format, 'frame_shape': self.frame_shape, 'chunk_size': chunk_size}, f)
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._chunk = -1
+        self._frames = None
+        self._shard = None
+        self._offset = 0
+        self._meta = np.zeros(chunk_size, dtype=META_DTYPE)
+        self._count = 0
+
+        self._thread = threading.Thread(target=self._run, name='recorder', daemon=True)
+        self._thread.start()
+
+    def append(self, frame, angle, speed, timestamp=None):
+        ''' Encola el fotograma sin bloquear; si el hilo no da abasto se descarta '''
+
+        if timestamp is None:
+            timestamp = time.time()
+        try:
+            self._queue.put_nowait((frame, angle, speed, timestamp))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        ''' Espera a que se escriba todo lo pendiente y cierra el bloque actual '''
+
+        self._queue.put(None)
+        self._thread.join()
+        logging.info(f"Grabados {self.recorded} fotogramas en {self.directory} ({self.dropped} descartados)")
+
+    def _path(self, prefix, extension, chunk=None):
+        chunk = self._chunk if chunk is None else chunk
+        return os.path.join(self.directory, f"{prefix}_{chunk:05d}.{extension}")
+
+    def _open_chunk(self):
+        self._chunk += 1
+        self._count = 0
+        self._offset = 0
+        if self.format == 'raw':
+            self._frames = np.lib.format.open_memmap(self._path('frames', 'npy'), mode='w+', dtype=np.uint8,
+                                                     shape=(self.chunk_size,) + self.frame_shape)
+        else:
+            self._shard = open(self._path('shard', 'bin'), 'wb')
+
+    def _flush(self):
+        ''' Lleva al disco los fotogramas escritos y el índice del bloque actual '''
+
+        if self._chunk < 0:
+            return
+        if self.format == 'raw':
+            self._frames.flush()
+        else:
+            self._shard.flush()
+        # El índice solo contiene las filas escritas; se sustituye de una vez para que
+        # quien lo lea mientras se graba nunca vea un fichero a medias
+        path = self._path('meta', 'npy')
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, self._meta[:self._count])
+        os.replace(path + '.tmp', path)
+
+    def _close_chunk(self):
+        if self._chunk < 0:
+            return
+        self._flush()
+        if self.format == 'raw':
+            self._frames = None
+            if self._count < self.chunk_size:
+                _truncate_npy(self._path('frames', 'npy'), self._count)
+        else:
+            self._shard.close()
+            self._shard = None
+
+    def _write(self, frame, angle, speed, timestamp):
+        if self._chunk < 0 or self._count == self.chunk_size:
+            self._close_chunk()
+            self._open_chunk()
+
+        row = self._meta[self._count]
+        row['frame'] = self.recorded
+        row['timestamp'] = timestamp
+        row['angle'] = angle
+        row['speed'] = speed
+        row['chunk'] = self._chunk
+
+        if self.format == 'raw':
+            if frame.shape != self.frame_shape:
+                frame = cv2.resize(frame, (self.frame_shape[1], self.frame_shape[0]))
+            self._frames[self._count] = frame
+            row['offset'] = self._count
+            row['length'] = 1
+        else:
+            ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not ok:
+                return
+            self._shard.write(encoded.tobytes())
+            row['offset'] = self._offset
+            row['length'] = encoded.size
+            self._offset += encoded.size
+
+        self._count += 1
+        self.recorded += 1
+
+    def _run(self):
+        running = True
+        while running:
+            # Se escribe todo lo que haya en la cola y después se guarda el índice
+            item = self._queue.get()
+            while item is not None:
+                try:
+                    self._write(*item)
+                except Exception:
+                    logging.exception('Error grabando un fotograma')
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            running = item is not None
+            try:
+                self._flush()
+            except Exception:
+                logging.exception('Error guardando el índice')
+        self._close_chunk()
+
+
+def _truncate_npy(path, rows):
+    ''' Deja en un .npy solo sus primeras filas: reescribe la forma en la cabecera,
+        con la misma longitud, y recorta los datos sin copiarlos '''
+
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version != (1, 0):
+            raise ValueError(f"{path}: versión de .npy no admitida {version}")
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        data_start = f.tell()
+        shape = (rows,) + tuple(shape[1:])
+
+        header = repr({'descr': np.lib.format.dtype_to_descr(dtype),
+                       'fortran_order': fortran_order,
+                       'shape': shape})
+        # Magia (6 bytes), versión (2) y longitud de la cabecera (2)
+        length = data_start - 10
+        f.seek(10)
+        f.write(header.ljust(length - 1).encode('latin1') + b'\n')
+        f.truncate(data_start + rows * int(np.prod(shape[1:])) * dtype.itemsize)
+
+
+class DatasetReader(object):
+    ''' Acceso aleatorio y por lotes a un conjunto grabado con DatasetRecorder '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'dataset.json')) as f:
+            info = json.load(f)
+        self.format = info['format']
+        self.frame_shape = tuple(info['frame_shape'])
+
+        meta_paths = sorted(glob.glob(os.path.join(directory, 'meta_*.npy')))
+        metas = [np.load(path) for path in meta_paths]
+        self.index = np.concatenate(metas) if metas else np.zeros(0, dtype=META_DTYPE)
+        self._chunks = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def _chunk_data(self, chunk):
+        ''' Bloque abierto con mmap: solo se lee del disco lo que se usa '''
+
+        if chunk not in self._chunks:
+            if self.format == 'raw':
+                path = os.path.join(self.directory, f"frames_{chunk:05d}.npy")
+                self._chunks[chunk] = np.load(path, mmap_mode='r')
+            else:
+                path = os.path.join(self.directory, f"shard_{chunk:05d}.bin")
+                self._chunks[chunk] = np.memmap(path, dtype=np.uint8, mode='r')
+        return self._chunks[chunk]
+
+    def frame(self, i):
+        row = self.index[i]
+        data = self._chunk_data(int(row['chunk']))
+        if self.format == 'raw':
+            return data[row['offset']]
+        return cv2.imdecode(data[row['offset']:row['offset'] + row['length']], cv2.IMREAD_COLOR)
+
+    def __getitem__(self, i):
+        return self.frame(i), self.index[i]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def batches(self, batch_size=32, shuffle=False, seed=None):
+        ''' Lotes (fotogramas, ángulos) listos para entrenar, reutilizando el buffer de fotogramas '''
+
+        order = np.arange(len(self))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+
+        frames = np.empty((batch_size,) + self.frame_shape, dtype=np.uint8)
+        for start in range(0, len(order), batch_size):
+            selected = order[start:start + batch_size]
+            for j, i in enumerate(selected):
+                frames[j] = self.frame(i)
+            yield frames[:len(selected)], self.index['angle'][selected]
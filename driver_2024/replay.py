@@ -0,0 +1,226 @@
+#------------------------------------------------------------------------------
+# Reproducción sin coche: pasa las imágenes de imagenes/test (o un vídeo, o una
+# carpeta de fotogramas grabados) por LaneFollower.compute_steering_angle y
+# TrafficSignDetector.detect_signal con un coche falso, y mide la latencia de
+# cada etapa (p50/p95/p99), los fotogramas por segundo y la memoria reservada
+# por fotograma. El resultado se guarda en JSON y puede compararse con otro.
+# Uso:
+#   python3 replay.py [fuente] --backend cpu --output run.json
+#   python3 replay.py [fuente] --compare base.json
+#   python3 replay.py --diff base.json run.json
+#------------------------------------------------------------------------------
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from autonomous_driver_2024 import LaneFollower, TrafficSignDetector
+
+DEFAULT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'imagenes', 'test')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+STAGES = ('lane', 'signs')
+
+
+class FakeWheels(object):
+    ''' Ruedas que solo recuerdan las órdenes recibidas '''
+
+    def __init__(self, speed=30):
+        self._speed = speed
+        self.angles = []
+
+    @property
+    def speed(self):
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed):
+        self._speed = speed
+
+    def turn(self, angle):
+        self.angles.append(angle)
+
+
+class FakeCar(object):
+    ''' Lo mínimo de SmartPiCar que usan los modelos y las señales '''
+
+    STRAIGHT_ANGLE = 90
+
+    def __init__(self, speed=30):
+        self.back_wheels = FakeWheels(speed)
+        self.front_wheels = FakeWheels()
+        self.keep_following = True
+        self.keep_detecting = True
+        self.lights = False
+
+
+def load_frames(source, size=(320, 240), limit=None):
+    ''' Carga en memoria los fotogramas de una carpeta, un patrón glob o un vídeo '''
+
+    if os.path.isdir(source):
+        paths = sorted(path for path in glob.glob(os.path.join(source, '*'))
+                       if path.lower().endswith(IMAGE_EXTENSIONS))
+    elif any(char in source for char in '*?['):
+        paths = sorted(glob.glob(source))
+    else:
+        paths = None
+
+    frames = []
+    if paths is not None:
+        for path in paths[:limit]:
+            image = cv2.imread(path)
+            if image is not None:
+                frames.append(image)
+    else:
+        capture = cv2.VideoCapture(source)
+        while limit is None or len(frames) < limit:
+            ok, image = capture.read()
+            if not ok:
+                break
+            frames.append(image)
+        capture.release()
+
+    if size is not None:
+        frames = [cv2.resize(frame, size) if frame.shape[1::-1] != size else frame for frame in frames]
+    return frames
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    if samples.size == 0:
+        return {}
+    return {'p50_ms': float(np.percentile(samples, 50)),
+            'p95_ms': float(np.percentile(samples, 95)),
+            'p99_ms': float(np.percentile(samples, 99)),
+            'mean_ms': float(samples.mean()),
+            'max_ms': float(samples.max())}
+
+
+def run(frames, stages=STAGES, backend=None, repeat=1, warmup=5, measure_allocations=True):
+    ''' Pasa los fotogramas por las etapas y devuelve el informe como diccionario '''
+
+    car = FakeCar()
+    functions = {}
+    if 'lane' in stages:
+        functions['lane'] = LaneFollower(car, backend=backend).compute_steering_angle
+    if 'signs' in stages:
+        functions['signs'] = TrafficSignDetector(car, backend=backend).detect_signal
+
+    for frame in frames[:warmup]:
+        for function in functions.values():
+            function(frame)
+
+    timings = {name: [] for name in list(functions) + ['total']}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            frame_start = time.perf_counter()
+            for name, function in functions.items():
+                stage_start = time.perf_counter()
+                function(frame)
+                timings[name].append(time.perf_counter() - stage_start)
+            timings['total'].append(time.perf_counter() - frame_start)
+    elapsed = time.perf_counter() - start
+    processed = len(frames) * repeat
+
+    report = {'frames': processed,
+              'backend': backend,
+              'fps': processed / elapsed if elapsed > 0 else 0.0,
+              'stages': {name: percentiles(samples) for name, samples in timings.items()}}
+
+    if measure_allocations:
+        # Pasada aparte: tracemalloc ralentiza mucho y falsearía las latencias
+        peaks = []
+        blocks = []
+        tracemalloc.start()
+        for frame in frames:
+            tracemalloc.reset_peak()
+            before_size, _ = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            for function in functions.values():
+                function(frame)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before_size)
+            blocks.append(sum(stat.count_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, 'filename')
+                              if stat.count_diff > 0))
+        tracemalloc.stop()
+        report['allocations'] = {'peak_kib_per_frame': float(np.mean(peaks)) / 1024,
+                                 'retained_blocks_per_frame': float(np.mean(blocks))}
+
+    return report
+
+
+def compare(baseline, current, tolerance=0.1):
+    ''' Imprime las diferencias entre dos informes; devuelve True si alguna etapa empeora más de tolerance '''
+
+    regression = False
+    print(f"{'etapa':8s} {'métrica':8s} {'base':>10s} {'actual':>10s} {'cambio':>8s}")
+    for stage, metrics in current['stages'].items():
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if stage not in baseline['stages'] or metric not in metrics:
+                continue
+            before = baseline['stages'][stage][metric]
+            after = metrics[metric]
+            change = (after - before) / before if before > 0 else 0.0
+            flag = ' <-- peor' if change > tolerance else ''
+            regression |= change > tolerance
+            print(f"{stage:8s} {metric:8s} {before:10.2f} {after:10.2f} {change:+8.1%}{flag}")
+
+    change = (current['fps'] - baseline['fps']) / baseline['fps'] if baseline['fps'] > 0 else 0.0
+    print(f"{'total':8s} {'fps':8s} {baseline['fps']:10.1f} {current['fps']:10.1f} {change:+8.1%}")
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reproduce fotogramas grabados por los modelos sin el coche')
+    parser.add_argument('source', nargs='?', default=DEFAULT_SOURCE, help='carpeta, patrón glob o vídeo')
+    parser.add_argument('--backend', choices=('edgetpu', 'cpu', 'mock'), help='por defecto, el del fichero config')
+    parser.add_argument('--stages', default=','.join(STAGES), help='etapas separadas por comas: lane,signs')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--no-allocations', action='store_true', help='no medir la memoria por fotograma')
+    parser.add_argument('--output', help='fichero JSON donde guardar el informe')
+    parser.add_argument('--compare', help='informe JSON de referencia con el que comparar')
+    parser.add_argument('--diff', nargs=2, metavar=('BASE', 'ACTUAL'), help='solo compara dos informes ya guardados')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='empeoramiento permitido (0.1 = 10%%)')
+    args = parser.parse_args()
+
+    if args.diff:
+        with open(args.diff[0]) as f:
+            baseline = json.load(f)
+        with open(args.diff[1]) as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.tolerance) else 0)
+
+    frames = load_frames(args.source, limit=args.limit)
+    if not frames:
+        logging.error(f"No se encontraron fotogramas en {args.source}")
+        sys.exit(1)
+
+    report = run(frames,
+                 stages=[stage for stage in args.stages.split(',') if stage],
+                 backend=args.backend,
+                 repeat=args.repeat,
+                 measure_allocations=not args.no_allocations)
+    report['source'] = args.source
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(baseline, report, args.tolerance) else 0)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
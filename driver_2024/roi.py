@@ -0,0 +1,131 @@
+#------------------------------------------------------------------------------
+# Regiones de interés del detector de señales. En vez de aplastar el fotograma
+# entero a 320x320, se pasan al modelo solo las zonas donde aparecen las señales
+# (por ejemplo la mitad derecha o la franja superior), opcionalmente divididas en
+# teselas y con bandas negras para no deformar la imagen (letterbox).
+# Cada ventana guarda su geometría para devolver las cajas del modelo a píxeles
+# del fotograma.
+# Ajustes del fichero config:
+#   sign_rois = x,y,ancho,alto[;x,y,ancho,alto...]  en fracciones del fotograma (0,0,1,1 = entero)
+#   sign_tiles = 2x1           teselas (columnas x filas) de cada región
+#   sign_tile_overlap = 0.15   solape entre teselas vecinas
+#   sign_letterbox = true      conserva la proporción al pasar cada ventana al modelo
+#------------------------------------------------------------------------------
+
+from collections import namedtuple
+import numpy as np
+import settings
+
+Roi = namedtuple('Roi', ['x', 'y', 'width', 'height'])
+
+# Ventana del fotograma (en píxeles) y cómo se coloca en la entrada del modelo:
+# escala en cada eje y margen de las bandas del letterbox
+Window = namedtuple('Window', ['x', 'y', 'width', 'height',
+                               'scale_x', 'scale_y', 'pad_x', 'pad_y', 'resized_width', 'resized_height'])
+
+FULL_FRAME = (Roi(0.0, 0.0, 1.0, 1.0),)
+
+
+def parse_rois(text):
+    ''' "x,y,ancho,alto;x,y,ancho,alto" -> tupla de Roi '''
+
+    rois = []
+    for part in text.split(';'):
+        if not part.strip():
+            continue
+        values = [float(value) for value in part.split(',')]
+        if len(values) != 4:
+            raise ValueError(f"Región mal escrita: {part} (formato x,y,ancho,alto)")
+        roi = Roi(*values)
+        if roi.width <= 0 or roi.height <= 0 or roi.x < 0 or roi.y < 0 or roi.x + roi.width > 1 or roi.y + roi.height > 1:
+            raise ValueError(f"Región fuera del fotograma: {part}")
+        rois.append(roi)
+    return tuple(rois) or FULL_FRAME
+
+
+def parse_tiles(text):
+    ''' "2x1" -> (2, 1) '''
+
+    columns, rows = (int(value) for value in text.lower().split('x'))
+    if columns < 1 or rows < 1:
+        raise ValueError(f"Teselas mal escritas: {text}")
+    return columns, rows
+
+
+class RoiLayout(object):
+    ''' Regiones, teselas y letterbox; calcula las ventanas para cada tamaño de fotograma '''
+
+    def __init__(self, rois=FULL_FRAME, tiles=(1, 1), overlap=0.15, letterbox=False):
+        self.rois = tuple(rois)
+        self.tiles = tiles
+        self.overlap = overlap
+        self.letterbox = letterbox
+        self._windows = {}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(parse_rois(settings.get('sign_rois', '0,0,1,1')),
+                   parse_tiles(settings.get('sign_tiles', '1x1')),
+                   settings.get('sign_tile_overlap', 0.15, float),
+                   settings.get('sign_letterbox', False, bool))
+
+    def __len__(self):
+        return len(self.rois) * self.tiles[0] * self.tiles[1]
+
+    def windows(self, frame_width, frame_height, input_width, input_height):
+        ''' Ventanas para un fotograma y una entrada del modelo dados (se calculan una vez) '''
+
+        key = (frame_width, frame_height, input_width, input_height)
+        if key not in self._windows:
+            self._windows[key] = [self._window(x, y, width, height, input_width, input_height)
+                                  for x, y, width, height in self._regions(frame_width, frame_height)]
+        return self._windows[key]
+
+    def _regions(self, frame_width, frame_height):
+        columns, rows = self.tiles
+        for roi in self.rois:
+            x0 = roi.x * frame_width
+            y0 = roi.y * frame_height
+            width = roi.width * frame_width
+            height = roi.height * frame_height
+
+            # Cada tesela crece con el solape, sin salirse de la región
+            tile_width = width / (columns - (columns - 1) * self.overlap) if columns > 1 else width
+            tile_height = height / (rows - (rows - 1) * self.overlap) if rows > 1 else height
+            step_x = (width - tile_width) / (columns - 1) if columns > 1 else 0
+            step_y = (height - tile_height) / (rows - 1) if rows > 1 else 0
+
+            for row in range(rows):
+                for column in range(columns):
+                    x = int(round(x0 + column * step_x))
+                    y = int(round(y0 + row * step_y))
+                    yield (x, y,
+                           min(int(round(tile_width)), frame_width - x),
+                           min(int(round(tile_height)), frame_height - y))
+
+    def _window(self, x, y, width, height, input_width, input_height):
+        if self.letterbox:
+            scale = min(input_width / width, input_height / height)
+            resized_width = min(int(round(width * scale)), input_width)
+            resized_height = min(int(round(height * scale)), input_height)
+            pad_x = (input_width - resized_width) // 2
+            pad_y = (input_height - resized_height) // 2
+        else:
+            resized_width, resized_height = input_width, input_height
+            pad_x = pad_y = 0
+        return Window(x, y, width, height,
+                      resized_width / width, resized_height / height,
+                      pad_x, pad_y, resized_width, resized_height)
+
+
+def to_frame(boxes, window, input_width, input_height, out=None):
+    ''' Cajas normalizadas del modelo [ymin, xmin, ymax, xmax] -> píxeles del fotograma '''
+
+    out = np.multiply(boxes, (input_height, input_width, input_height, input_width), out=out)
+    out -= (window.pad_y, window.pad_x, window.pad_y, window.pad_x)
+    out /= (window.scale_y, window.scale_x, window.scale_y, window.scale_x)
+    # Lo que cae en las bandas negras se recorta al borde de la ventana
+    np.clip(out[:, 0::2], 0, window.height, out=out[:, 0::2])
+    np.clip(out[:, 1::2], 0, window.width, out=out[:, 1::2])
+    out += (window.y, window.x, window.y, window.x)
+    return out
@@ -0,0 +1,205 @@
+#------------------------------------------------------------------------------
+# Servicio que ejecuta los modelos del coche sobre un único acelerador.
+# Con el Edge TPU, LaneFollower y TrafficSignDetector ya no invocan cada uno su
+# intérprete desde su hilo: piden la inferencia al ModelRunner, que las ejecuta
+# de una en una desde una cola con prioridad (la dirección antes que las señales).
+# Los dos intérpretes comparten el delegado, así que con modelos compilados
+# juntos (edgetpu_compiler lane.tflite ultimo.tflite) los parámetros de ambos
+# caben en la caché del chip y cambiar de modelo no obliga a recargarlos.
+# Por cada petición se mide el tiempo en cola y el tiempo de cálculo.
+#------------------------------------------------------------------------------
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+import numpy as np
+import settings
+from backends import make_interpreter, load_edgetpu_delegate
+
+# Mayor valor = se atiende antes
+PRIORIDAD_SENALES = 0
+PRIORIDAD_DIRECCION = 1
+
+
+class _Request(object):
+
+    __slots__ = ('name', 'enqueued', 'started', 'finished', 'error', 'done')
+
+    def __init__(self, name, enqueued):
+        self.name = name
+        self.enqueued = enqueued
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ModelRunner(object):
+    ''' Dueño del acelerador: carga los modelos y serializa sus inferencias '''
+
+    def __init__(self, backend=None, device=None, exclusive=None, samples=1000, clock=time.perf_counter):
+        if backend is None:
+            backend = settings.get('inference_backend', 'edgetpu')
+        if device is None:
+            device = settings.get('edgetpu_device', None)
+
+        self.backend = backend
+        self.device = device
+        # En la CPU cada intérprete tiene sus hilos y pueden ir en paralelo;
+        # el Edge TPU solo ejecuta un modelo cada vez
+        self.exclusive = backend == 'edgetpu' if exclusive is None else exclusive
+        self.clock = clock
+
+        self._interpreters = {}
+        self._models = {}
+        self._priorities = {}
+        self._delegate = None
+        self._delegate_lock = threading.Lock()
+        self._samples = samples
+        self._waits = {}
+        self._computes = {}
+        self._requests = {}
+        self._last_model = None
+        self.switches = 0
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def load(self, name, model_path, spec=None, priority=PRIORIDAD_SENALES):
+        ''' Carga un modelo con el delegado compartido y devuelve (nombre, intérprete).
+            Cada carga tiene su propio intérprete: si name ya está en uso, el nombre
+            lleva un sufijo (lane_2, lane_3...) y es el que hay que pasar a invoke '''
+
+        # Al arrancar los dos modelos se cargan a la vez: un solo delegado para ambos
+        with self._delegate_lock:
+            if self.backend == 'edgetpu' and self._delegate is None:
+                self._delegate = load_edgetpu_delegate(self.device)
+
+        interpreter = make_interpreter(model_path, spec, self.backend, device=self.device, delegate=self._delegate)
+        with self._condition:
+            base, suffix = name, 1
+            while name in self._interpreters:
+                suffix += 1
+                name = f"{base}_{suffix}"
+            self._models[name] = model_path
+            self._priorities[name] = priority
+            self._waits[name] = deque(maxlen=self._samples)
+            self._computes[name] = deque(maxlen=self._samples)
+            self._requests[name] = 0
+            self._interpreters[name] = interpreter
+        if suffix > 1:
+            logging.info(f"{base} ya está cargado ({self._models[base]}): {model_path} se carga como {name}")
+        return name, interpreter
+
+    def interpreter(self, name):
+        return self._interpreters[name]
+
+    def invoke(self, name, priority=None):
+        ''' Ejecuta el modelo con lo que haya en su tensor de entrada y espera a que termine.
+            Devuelve (segundos en cola, segundos de cálculo) '''
+
+        request = _Request(name, self.clock())
+
+        if not self.exclusive:
+            self._execute(request)
+        else:
+            if priority is None:
+                priority = self._priorities[name]
+            with self._condition:
+                if not self._running:
+                    self._start()
+                heapq.heappush(self._queue, (-priority, next(self._seq), request))
+                self._condition.notify()
+            request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.started - request.enqueued, request.finished - request.started
+
+    def _start(self):
+        self._running = True
+        # Si el hilo anterior aún está vaciando la cola tras stop(), sigue sirviendo él
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='model-runner', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._queue:
+                    self._condition.wait()
+                if not self._queue:
+                    break
+                _, _, request = heapq.heappop(self._queue)
+            self._execute(request)
+
+    def _execute(self, request):
+        request.started = self.clock()
+        try:
+            self._interpreters[request.name].invoke()
+        except Exception as e:
+            request.error = e
+        request.finished = self.clock()
+
+        with self._condition:
+            if self._last_model is not None and request.name != self._last_model:
+                self.switches += 1
+            self._last_model = request.name
+            self._requests[request.name] += 1
+            self._waits[request.name].append(request.started - request.enqueued)
+            self._computes[request.name].append(request.finished - request.started)
+        request.done.set()
+
+    def stats(self):
+        ''' Peticiones, tiempo en cola y tiempo de cálculo (ms) de cada modelo '''
+
+        stats = {'backend': self.backend, 'exclusive': self.exclusive, 'model_switches': self.switches}
+        with self._condition:
+            for name in self._interpreters:
+                waits = np.asarray(self._waits[name]) * 1000
+                computes = np.asarray(self._computes[name]) * 1000
+                model = {'requests': self._requests[name]}
+                if computes.size:
+                    model['wait_p50_ms'] = float(np.percentile(waits, 50))
+                    model['wait_p95_ms'] = float(np.percentile(waits, 95))
+                    model['compute_p50_ms'] = float(np.percentile(computes, 50))
+                    model['compute_p95_ms'] = float(np.percentile(computes, 95))
+                stats[name] = model
+        return stats
+
+    def stop(self):
+        ''' Atiende las peticiones pendientes y para el hilo '''
+
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(1)
+
+
+_runners = {}
+_runners_lock = threading.Lock()
+
+
+def get_runner(backend=None):
+    ''' Runner compartido por todos los modelos que usan el mismo backend '''
+
+    if backend is None:
+        backend = settings.get('inference_backend', 'edgetpu')
+    with _runners_lock:
+        if backend not in _runners:
+            _runners[backend] = ModelRunner(backend)
+        return _runners[backend]
+
+
+def set_runner(runner):
+    ''' Sustituye el runner compartido de su backend '''
+
+    with _runners_lock:
+        _runners[runner.backend] = runner
@@ -0,0 +1,153 @@
+#------------------------------------------------------------------------------
+# Planificador de la detección de señales. Sustituye al time.sleep(2) fijo:
+# - la cadencia sale de la velocidad: se detecta cada cierta distancia recorrida
+# - tras ver una señal se detecta a la cadencia máxima hasta confirmarla
+# - el coste medido de la inferencia limita la fracción de tiempo que se dedica
+# - con el coche parado o por debajo de slow_speed, los fotogramas casi iguales
+#   al último analizado se saltan (diferencia media de una miniatura en escala de grises)
+# stats() muestra la frecuencia efectiva de detección y por qué se salta cada fotograma.
+#------------------------------------------------------------------------------
+
+import time
+from collections import deque
+from lazy import lazy_import
+cv2 = lazy_import('cv2')
+import numpy as np
+import settings
+from behaviors import DEFAULT_CONSTANTS
+
+
+class DetectionScheduler(object):
+
+    def __init__(self,
+                 distance=0.05,
+                 min_interval=0.1,
+                 max_interval=2.0,
+                 active_window=1.5,
+                 max_duty=0.5,
+                 change_threshold=4.0,
+                 slow_speed=10,
+                 thumbnail_size=(40, 30),
+                 clock=time.monotonic):
+        self.distance = distance                  # metros entre detecciones (ver DEFAULT_CONSTANTS de behaviors)
+        self.min_interval = min_interval
+        self.max_interval = max_interval          # siempre se detecta al menos con este intervalo
+        self.active_window = active_window        # segundos a cadencia máxima tras ver una señal
+        self.max_duty = max_duty                  # fracción máxima del tiempo dedicada a inferir
+        self.change_threshold = change_threshold  # diferencia media (0-255) para considerar el fotograma nuevo
+        self.slow_speed = slow_speed              # por encima, no se saltan fotogramas por parecerse al anterior
+        self.clock = clock
+
+        width, height = thumbnail_size
+        self._small = None
+        self._gray = np.zeros((height, width), dtype=np.uint8)
+        self._reference = self._gray.copy()
+        self._diff = self._gray.copy()
+        self._has_reference = False
+
+        self._last_detection = None
+        self._last_activity = None
+        self.inference_cost = 0.0
+        self.interval = min_interval
+        self.change = 0.0
+
+        self.offered = 0
+        self.detections = 0
+        self.skipped_interval = 0
+        self.skipped_unchanged = 0
+        self._recent = deque(maxlen=256)
+
+    @classmethod
+    def from_settings(cls, **kwargs):
+        return cls(distance=settings.get('detect_distance', 0.05, float),
+                   min_interval=settings.get('detect_min_interval', 0.1, float),
+                   max_interval=settings.get('detect_max_interval', 2.0, float),
+                   max_duty=settings.get('detect_max_duty', 0.5, float),
+                   change_threshold=settings.get('detect_change_threshold', 4.0, float),
+                   slow_speed=settings.get('detect_slow_speed', 10, float),
+                   **kwargs)
+
+    def target_interval(self, speed, now):
+        ''' Intervalo entre detecciones según la velocidad, la actividad reciente y el coste '''
+
+        if self._last_activity is not None and now - self._last_activity < self.active_window:
+            interval = self.min_interval
+        elif speed:
+            # Con meter_speed tarda meter_seconds en recorrer 1 metro
+            interval = self.distance * DEFAULT_CONSTANTS['meter_seconds'] * DEFAULT_CONSTANTS['meter_speed'] / speed
+        else:
+            # Parado: la cadencia la marcan los cambios en la imagen
+            interval = self.min_interval
+
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        if self.max_duty:
+            interval = max(interval, self.inference_cost / self.max_duty)
+        return interval
+
+    def _frame_change(self, image):
+        ''' Diferencia media con el último fotograma analizado, sobre una miniatura '''
+
+        height, width = self._gray.shape
+        self._small = cv2.resize(image, (width, height), dst=self._small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        if not self._has_reference:
+            return float('inf')
+        cv2.absdiff(self._gray, self._reference, dst=self._diff)
+        return cv2.mean(self._diff)[0]
+
+    def should_detect(self, image, speed=0, now=None):
+        ''' True si hay que pasar este fotograma por el detector '''
+
+        if now is None:
+            now = self.clock()
+        self.offered += 1
+        self.interval = self.target_interval(speed, now)
+
+        if self._last_detection is not None:
+            elapsed = now - self._last_detection
+            if elapsed < self.interval:
+                self.skipped_interval += 1
+                return False
+            self.change = self._frame_change(image)
+            if (speed <= self.slow_speed and self.change < self.change_threshold
+                    and elapsed < self.max_interval):
+                self.skipped_unchanged += 1
+                return False
+        else:
+            self.change = self._frame_change(image)
+
+        # El fotograma se analiza: pasa a ser la referencia
+        self._gray, self._reference = self._reference, self._gray
+        self._has_reference = True
+        self._last_detection = now
+        return True
+
+    def record(self, cost, detected, now=None):
+        ''' Anota el tiempo de la inferencia y si se vio alguna señal '''
+
+        if now is None:
+            now = self.clock()
+        # Media móvil exponencial: sigue los cambios sin saltar con un fotograma lento
+        self.inference_cost = cost if self.detections == 0 else 0.8 * self.inference_cost + 0.2 * cost
+        self.detections += 1
+        self._recent.append(now)
+        if detected:
+            self._last_activity = now
+
+    def stats(self, now=None):
+        if now is None:
+            now = self.clock()
+        recent = [t for t in self._recent if now - t <= 10]
+        if len(recent) > 1 and now > recent[0]:
+            rate = len(recent) / (now - recent[0])
+        else:
+            rate = 0.0
+        return {'offered': self.offered,
+                'detections': self.detections,
+                'skipped_interval': self.skipped_interval,
+                'skipped_unchanged': self.skipped_unchanged,
+                'detection_rate_hz': rate,
+                'interval_ms': self.interval * 1000,
+                'inference_ms': self.inference_cost * 1000,
+                'duty': rate * self.inference_cost,
+                'frame_change': self.change}
@@ -0,0 +1,46 @@
+#------------------------------------------------------------------------------
+# Lectura de los ajustes del coche desde el fichero config (formato clave = valor),
+# el mismo que utiliza picar para guardar la calibración de las ruedas.
+# Cualquier ajuste puede sobrescribirse con una variable de entorno
+# SMARTPICAR_<CLAVE>, útil para lanzar pruebas en otra máquina sin tocar el fichero.
+#------------------------------------------------------------------------------
+
+import os
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Etiquetas del detector de señales incluidas en el repositorio
+LABELMAP_PATH = os.path.join(REPO_PATH, 'modelo', 'labelmap.txt')
+
+
+def read_config(path=CONFIG_PATH):
+    ''' Devuelve un diccionario con las claves del fichero config '''
+
+    values = {}
+    if not os.path.exists(path):
+        return values
+
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            values[key.strip()] = value.strip()
+
+    return values
+
+
+def get(key, default=None, cast=str, path=CONFIG_PATH):
+    ''' Obtiene un ajuste: variable de entorno, después config y si no el valor por defecto '''
+
+    value = os.environ.get('SMARTPICAR_' + key.upper())
+    if value is None:
+        value = read_config(path).get(key)
+    if value is None:
+        return default
+
+    if cast is bool:
+        return value.lower() in ('1', 'true', 'yes', 'si', 'sí', 'on')
+    return cast(value)
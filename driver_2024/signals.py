@@ -1,276 +1,51 @@
-import logging
-import time
-from blinkstick import blinkstick
+#------------------------------------------------------------------------------
+# Acciones básicas de las señales y prioridades. Lo que hace el coche ante cada
+# señal se describe en behaviors.json y lo compila behaviors.py.
+#------------------------------------------------------------------------------
 
-class Signal(object):
-
-    def play(self, car):
-        pass
-
-    @staticmethod
-    def esta_cerca(signal_detected):
-        signal_detected_height = (signal_detected[2][2] - signal_detected[2][0]) * 100
-        
-        return signal_detected_height / 320 > 0.1
-
-
-class Stop(Signal):
-
-    def play(self, car):   
-        speed = car.back_wheels._speed
-        if(speed > 0):
-            logging.debug('Haciendo STOP...')
-            
-            car.keep_following = False
-            car.back_wheels.speed = 0
-
-            time.sleep(3)
-            
-            car.back_wheels.speed = speed
-            car.keep_following = True
-        
-        
-class Velocity(Signal):
+from actions import Timeline
+from postprocessing import NEAR_HEIGHT
 
-    def __init__(self, vel):
-        self.vel = vel
+# Prioridades de las acciones: una señal interrumpe a las de prioridad menor o igual
+PRIORIDAD_BAJA = 0
+PRIORIDAD_MANIOBRA = 1
+PRIORIDAD_STOP = 2
+PRIORIDAD_SEMAFORO = 3
 
-    def play(self, car):
-        logging.debug(f"Ajustando velocidad límite {self.vel}...")
-        
-        self.keep_following = True
-        car.back_wheels.speed = self.vel
-        
-        
-class Ceda(Signal):
-
-    def play(self, car):   
-        if(car.back_wheels._speed > 0):
-            logging.debug('Haciendo CEDA...')
-            
-            self.keep_following = True
-            car.back_wheels.speed = 20
-        
-            time.sleep(3)
-        
-            car.back_wheels.speed = 30
-
-                
-class Luces(Signal):
 
-    def play(self, car):    
-        logging.debug('Encendiendo LUCES...')
-        bstick = blinkstick.find_first()
+def set_speed(car, speed):
+    car.back_wheels.speed = speed
 
-        if bstick:
-            if(not car.lights):
-                for i in range(4):
-                    bstick.set_color(channel=0, index=i, name="white")
-                car.lights = True
-            else:
-                for i in range(4):
-                    bstick.set_color(channel=0, index=i, name="black")
-                car.lights = False
-        
 
-class Obras(Signal):
+def set_following(car, following):
+    car.keep_following = following
 
-    def play(self, car):    
-        if(car.back_wheels._speed > 0):
-            logging.debug('Conduciendo con precaución por OBRAS...')
-            
-            self.keep_following = True
-            car.back_wheels.speed = 10
 
-            time.sleep(5)
-            
-            car.back_wheels.speed = 20     
-        
+def turn(car, angle):
+    car.front_wheels.turn(angle)
 
-class Recto(Signal):
 
-    def play(self, car):    
-        if(car.back_wheels._speed > 0):
-            logging.debug('Yendo RECTO...')
-            
-            car.keep_following = False
-            car.front_wheels.turn(car.STRAIGHT_ANGLE)
-            
-            # En 10 segundos recorre 1 metro con una velocidad de 20
-            t = 10 
-            v = 20
-
-            actual_vel = car.back_wheels._speed
-            tiempo = (t * v) / actual_vel
-            time.sleep(tiempo)
-            
-            car.keep_following = True
-  
-        
-class Izquierda(Signal):
+class Signal(object):
 
-    def intermitentes(self, final):
-        bstick = blinkstick.find_first()
-        while(time.time() < final):
-                bstick.set_color(channel=0, index=0, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=1, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=2, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=3, red=255, green=41, blue=0)
-                time.sleep(0.2)
-                bstick.set_color(channel=0, index=0, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=1, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=2, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=3, red=255, green=41, blue=0)
-                time.sleep(0.2)
-                bstick.set_color(channel=0, index=0, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=1, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=2, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=3, red=255, green=41, blue=0)
-                time.sleep(0.2)
-                bstick.set_color(channel=0, index=0, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=1, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=2, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=3, red=255, green=41, blue=0)
-                time.sleep(0.3)
-                bstick.set_color(channel=0, index=0, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=1, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=2, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=3, red=0, green=0, blue=0)
-                time.sleep(0.2)
-        
-        for i in range(4):
-            bstick.set_color(channel=0, index=i, name="black")
+    priority = PRIORIDAD_BAJA
 
-    def play(self, car):    
-        actual_vel = car.back_wheels._speed
-        if(actual_vel > 0):
-            logging.debug('Yendo a la IZQUIERDA...')
-            start = time.time()
-            
-            # En 10 segundos recorre 1 metro con una velocidad de 20
-            t = 10 
-            v = 20
-            
-            duration = (t * v) / actual_vel
-            
-            final = start + duration
-            
-            car.keep_following = False
-            car.front_wheels.turn(80)
-            car.front_wheels.turn(70)
-            car.front_wheels.turn(60)
-            car.front_wheels.turn(50)
-            car.front_wheels.turn(45)
-            
-            self.intermitentes(final)
+    def timeline(self, car):
+        ''' Acción de la señal como línea temporal; None si no hay nada que hacer '''
+        return None
 
-            car.front_wheels.turn(car.STRAIGHT_ANGLE)
-            car.keep_following = True
-        
-        else:  self.intermitentes(time.time() + 5)
-            
-        
-class Derecha(Signal):
+    def play(self, car):
+        ''' Ejecuta la acción bloqueando el hilo actual '''
+        timeline = self.timeline(car)
+        if timeline is not None:
+            timeline.run()
 
-    def intermitentes(self, final):
-        bstick = blinkstick.find_first()
-        while(time.time() < final):
-                bstick.set_color(channel=0, index=0, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=1, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=2, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=3, red=0, green=0, blue=0)
-                time.sleep(0.2)
-                bstick.set_color(channel=0, index=0, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=1, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=2, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=3, red=0, green=0, blue=0)
-                time.sleep(0.2)
-                bstick.set_color(channel=0, index=0, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=1, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=2, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=3, red=0, green=0, blue=0)
-                time.sleep(0.2)
-                bstick.set_color(channel=0, index=0, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=1, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=2, red=255, green=41, blue=0)
-                bstick.set_color(channel=0, index=3, red=255, green=41, blue=0)
-                time.sleep(0.3)
-                bstick.set_color(channel=0, index=0, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=1, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=2, red=0, green=0, blue=0)
-                bstick.set_color(channel=0, index=3, red=0, green=0, blue=0)
-                time.sleep(0.2)
-                
-        for i in range(4):
-            bstick.set_color(channel=0, index=i, name="black")
-        
-    def play(self, car):   
-        actual_vel = car.back_wheels._speed 
-        if(actual_vel > 0):
-            logging.debug('Yendo a la DERECHA...')      
-            start = time.time()
-            
-            # En 10 segundos recorre 1 metro con una velocidad de 20
-            t = 10 
-            v = 20
-            duration = (t * v) / actual_vel
-            
-            final = start + duration
-            
-            car.keep_following = False
-            car.front_wheels.turn(100)
-            car.front_wheels.turn(110)
-            car.front_wheels.turn(120)
-            car.front_wheels.turn(130)
-            car.front_wheels.turn(135)
-            
-            self.intermitentes(final)
-            
-            car.front_wheels.turn(car.STRAIGHT_ANGLE)
-            car.keep_following = True
-        
-        else: self.intermitentes(time.time() + 5)
-              
-                     
-class Rojo(Signal):
+    def new_timeline(self, exclusive=True):
+        return Timeline(type(self).__name__, self.priority, exclusive)
 
-    def play(self, car):
-        logging.debug('Parando por SEMÁFORO ROJO...')
-        
-        bstick = blinkstick.find_first()
-        if bstick:
-            for i in range(4):
-                bstick.set_color(channel=0, index=i, name="red")
-        
-        car.keep_following = False
-        car.back_wheels.speed = 0
-        
-        time.sleep(3)
-        
-        if bstick:
-            for i in range(4):
-                bstick.set_color(channel=0, index=i, name="black")
-        
-        
-class Verde(Signal):
+    @staticmethod
+    def esta_cerca(signal_detected):
+        ''' Admite una detección o el array de detecciones completo (devuelve un array de booleanos).
+            Las cajas están en píxeles del fotograma: cerca si mide más de unos 77 píxeles de alto '''
+        signal_detected_height = signal_detected['ymax'] - signal_detected['ymin']
 
-    def play(self, car):
-        logging.debug('Continuando conducción por SEMÁFORO VERDE...')      
-        
-        bstick = blinkstick.find_first()
-        if bstick:
-            for i in range(4):
-                bstick.set_color(channel=0, index=i, name="green")
-        
-        vel = car.back_wheels._speed
-        
-        if(vel==0):
-            car.back_wheels.speed = 20
-            
-        car.keep_following = True
-        
-        time.sleep(3)
-        
-        if bstick:
-            for i in range(4):
-                bstick.set_color(channel=0, index=i, name="black")
\ No newline at end of file
+        return signal_detected_height > NEAR_HEIGHT
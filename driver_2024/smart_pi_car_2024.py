@@ -4,18 +4,38 @@
 # - Auto: mediante el modelo de aprendizaje profundo
 # - Entrenamiento manual: manual recopilando imágenes etiquetadas
 # - Entrenamiento auto: mediante una programación explícita, guardando un video de la conducción
+# Los módulos pesados (modelos, OpenCV, NumPy, hardware) se importan al usarse:
+# el modo se valida al instante, y los modelos y la cámara se preparan en paralelo.
 #------------------------------------------------------------------------------
 
+import time
+PROCESS_START = time.monotonic()
+
 import logging
-import picar
-import cv2
 import datetime
 import sys
 import os
-import time
 import traceback
-from autonomous_driver_2024 import LaneFollower, TrafficSignDetector
-import threading
+from concurrent.futures import ThreadPoolExecutor
+from pipeline import Pipeline, Frame
+from lazy import lazy_import
+import settings
+import leds
+autonomous_driver_2024 = lazy_import('autonomous_driver_2024')
+recorder = lazy_import('recorder')
+scheduler = lazy_import('scheduler')
+hal = lazy_import('hal')
+metrics = lazy_import('metrics')
+
+MODES = ['manual', 'entrenamiento_manual', 'auto', 'entrenamiento_auto']
+
+
+def timed(function, *args):
+    ''' (resultado, segundos) de llamar a function '''
+
+    start = time.monotonic()
+    result = function(*args)
+    return result, time.monotonic() - start
 
 #mode = 'auto'
 
@@ -25,78 +45,124 @@ class SmartPiCar(object):
     CAMERA_HEIGHT = 240
     STRAIGHT_ANGLE = 90
 
-    def __init__(self):
+    def __init__(self, hardware=None):
         """ Inicializa el coche y la cámara """
         logging.info("Creando un Smart Pi Car...")
-
-        picar.setup()
-
-        logging.debug("Preparando la cámara...")
-        self.camera = cv2.VideoCapture(0)
-        self.camera.set(3, self.CAMERA_WIDTH)
-        self.camera.set(4, self.CAMERA_HEIGHT)
+        start = time.monotonic()
+        self.first_steer = None
+
+        # El hardware (picar.setup, servos, cámara) y los dos modelos se preparan a la vez
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix='startup') as pool:
+            # Hardware real del Picar-V o simulado, según el fichero config
+            hardware_future = pool.submit(timed, hal.make_hardware) if hardware is None else None
+            lane_future = pool.submit(timed, self._load_lane_follower)
+            signs_future = pool.submit(timed, self._load_traffic_sign_detector)
+
+            if hardware_future is not None:
+                hardware, hardware_time = hardware_future.result()
+            else:
+                hardware_time = 0.0
+            self.lane_follower, lane_time = lane_future.result()
+            self.traffic_sign_detector, signs_time = signs_future.result()
+        self.hardware = hardware
+
+        self.camera = hardware.camera
+        self.horizontal_servo = hardware.horizontal_servo
+        self.vertical_servo = hardware.vertical_servo
+        self.back_wheels = hardware.back_wheels
+        self.front_wheels = hardware.front_wheels
+        self.display = hardware.display
+        leds.set_controller(hardware.leds)
         
         self.actual_frame = None
-
-        self.horizontal_servo = picar.Servo.Servo(1)
-        self.horizontal_servo.offset = 20  # calibra el servo al centro
-        self.horizontal_servo.write(self.STRAIGHT_ANGLE)
-
-        self.vertical_servo = picar.Servo.Servo(2)
-        self.vertical_servo.offset = 0  # calibra el servo al centro
-        self.vertical_servo.write(self.STRAIGHT_ANGLE)
-        logging.debug("Cámara lista.")
-
-        logging.debug("Preparando las ruedas...")
-        self.back_wheels = picar.back_wheels.Back_Wheels()
-        self.back_wheels.speed = 0  # El rango de velocidad es 0 - 100
+        self.pipeline = None
+        self.frame_seq = 0
+        self.stopped = False
 
         self.steering_angle = self.STRAIGHT_ANGLE
-        self.front_wheels = picar.front_wheels.Front_Wheels()
-        self.front_wheels.turning_offset = -10  # calibra el servo al centro
-        self.front_wheels.turn(self.steering_angle)  # El ángulo de giro es 45 (izquierda) - 90 (recto) - 135 (derecha)
-        logging.debug("Ruedas listas.")
         self.keep_following = True
         self.keep_detecting = True
         self.lights = False
         
         self.short_date_str = datetime.datetime.now().strftime("%d%H%M")
         
-        self.lane_follower = LaneFollower(self)
-        self.traffic_sign_detector = TrafficSignDetector(self)
+        self.recorder = None
+        
+        self.metrics = metrics.get_metrics()
+        self.detection_scheduler = scheduler.DetectionScheduler.from_settings()
         
-        logging.info("Smart Pi Car creado con éxito.")
+        self.metrics.gauge('detection_rate_hz', lambda: self.detection_scheduler.stats()['detection_rate_hz'])
+        self.metrics.gauge('speed', lambda: self.back_wheels.speed)
+        self.metrics.gauge('steering_angle', lambda: self.lane_follower.curr_steering_angle)
+        self.exporters = metrics.start_exporters(self.metrics)
+
+        self.startup = {'imports_s': start - PROCESS_START,
+                        'hardware_s': hardware_time,
+                        'lane_model_s': lane_time,
+                        'sign_model_s': signs_time,
+                        'ready_s': time.monotonic() - PROCESS_START}
+        logging.info(f"Smart Pi Car creado con éxito: {self.startup}")
+
+    def _load_lane_follower(self):
+        """ Carga el modelo del carril y hace las inferencias de calentamiento """
+        lane_follower = autonomous_driver_2024.LaneFollower(self)
+        lane_follower.warm_up()
+        return lane_follower
+
+    def _load_traffic_sign_detector(self):
+        """ Carga el detector de señales y hace las inferencias de calentamiento """
+        traffic_sign_detector = autonomous_driver_2024.TrafficSignDetector(self)
+        traffic_sign_detector.warm_up()
+        return traffic_sign_detector
 
     def __enter__(self):
         return self
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        if traceback is not None:
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_traceback is not None and exc_type is not SystemExit:
             self.keep_following = False
             self.keep_detecting = False
             self.back_wheels.speed = 0
-            error = traceback.format_exc()
+            error = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
             logging.error(f"Parando la ejecución con el error:\n{error}")
 
         self.cleanup()
 
     def cleanup(self):
-        """ Resetea el hardware """
+        """ Resetea el hardware; los bucles de drive() terminan al cerrarse la cámara """
+        if self.stopped:
+            return
+        self.stopped = True
+
         logging.info("Parando el coche, restaurando el hardware...")
+        self.keep_detecting = False
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+        self.traffic_sign_detector.actions.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
         self.back_wheels.speed = 0
         self.front_wheels.turn(self.STRAIGHT_ANGLE)
         self.camera.release()
+        if hasattr(self.camera, 'stats'):
+            logging.info(f"Cámara: {self.camera.stats()}")
+        logging.info(f"Detección de señales: {self.detection_scheduler.stats()}")
+        logging.info(f"Inferencia: {self.lane_follower.runner.stats()}")
+        self.lane_follower.runner.stop()
         
         self.keep_following = False
         self.keep_detecting = False
         
-        cv2.destroyAllWindows()
+        self.display.close()
+        for exporter in self.exporters:
+            exporter.close()
         logging.info("Coche detenido.")
-        sys.exit()
 
     def manual_driver(self):
         """ Conduce mediante las teclas A (derecha) y D (izquierda) """
-        pressed_key = cv2.waitKey(50) & 0xFF
+        pressed_key = self.display.key(50)
         if pressed_key == ord('a'):
             if self.steering_angle > 40: self.steering_angle -= 3
             self.front_wheels.turn(self.steering_angle)
@@ -118,19 +184,68 @@ class SmartPiCar(object):
         
         return False
 
-    def traffic_sign_detection_task(self):
-        while self.keep_detecting:
-            if(self.actual_frame is not None):
-                #start = time.time()
-                logging.info('detecting...........................')
-                signal = self.traffic_sign_detector.detect_signal(self.actual_frame)
-                #end = time.time()
-                logging.info(signal)
-                #logging.info(end-start)
-                time.sleep(2) 
-    
-    def start_detection_task(self):
-        threading.Thread(target=self.traffic_sign_detection_task).start()
+    def capture_step(self):
+        """ Etapa de captura: publica el fotograma como solo lectura """
+        start = metrics.now()
+        ok, image, timestamp = self.camera.read_timestamped()
+        if not ok:
+            return None
+        self.metrics.since('capture', start)
+
+        self.frame_seq += 1
+        frame = Frame.publish(self.frame_seq, image, timestamp=timestamp)
+        self.actual_frame = frame.image
+        return frame
+
+    def lane_step(self, frame):
+        """ Etapa del carril: gira las ruedas y devuelve el fotograma con la línea de dirección """
+        image_lane = frame.image
+        if(self.keep_following):
+            # Si la pantalla dibuja la línea por su cuenta, el carril no pierde tiempo en ello
+            image_lane = self.lane_follower.follow_lane(frame.image,
+                                                        render=not self.display.draws_heading,
+                                                        timestamp=frame.timestamp('capture'))
+            self.camera.report_actuation(frame.timestamp('capture'))
+            # Desde la captura hasta que las ruedas reciben el giro
+            self.metrics.observe('steering_latency', time.monotonic() - frame.timestamp('capture'))
+            if self.first_steer is None:
+                self.first_steer = time.monotonic() - PROCESS_START
+                self.metrics.observe('time_to_first_steer', self.first_steer)
+                logging.info(f"Primer giro a los {self.first_steer:.2f} s de arrancar el programa")
+        return frame.stamp('lane', image_lane)
+
+    def build_pipeline(self):
+        """ Captura -> carril -> pantalla, y captura -> señales, con colas de un hueco """
+        pipeline = Pipeline()
+        # Los fotogramas que la pantalla no llega a leer devuelven su buffer al carril
+        pipeline.slot('display', on_drop=self.release_lane_image)
+        pipeline.add_stage('capture', self.capture_step, outputs=('lane', 'signs'))
+        pipeline.add_stage('lane', self.lane_step, source='lane', outputs=('display',))
+        pipeline.add_stage('signs', self.signs_step, source='signs')
+        return pipeline
+
+    def release_lane_image(self, frame):
+        """ Devuelve el buffer de la línea de dirección cuando ya no se va a mostrar """
+        self.lane_follower.overlay.release(frame.image)
+
+    def signs_step(self, frame):
+        """ Etapa de señales: detecta con la cadencia que marca el planificador, sin esperas fijas """
+        if not self.keep_detecting or not self.detection_scheduler.should_detect(frame.image, self.back_wheels.speed):
+            return None
+
+        start = time.monotonic()
+        signal = self.traffic_sign_detector.detect_signal(frame.image)
+        self.detection_scheduler.record(time.monotonic() - start, signal != 'Nada')
+        logging.debug(signal)
+        return None
+
+    def start_recorder(self):
+        """ Grabación en ../footage/v<fecha>, en un hilo aparte """
+        directory = os.path.join(settings.get('footage_dir', '../footage'), f"v{self.short_date_str}")
+        self.recorder = recorder.DatasetRecorder(directory,
+                                        (self.CAMERA_HEIGHT, self.CAMERA_WIDTH, 3),
+                                        format=settings.get('record_format', 'raw'))
+        logging.info(f"Grabando los fotogramas en {directory}")
 
     def drive(self, mode='auto', speed=30):
         """ Arranca el coche """
@@ -142,19 +257,24 @@ class SmartPiCar(object):
             logging.info("Iniciando la conducción autónoma...")
             logging.info(f"Arrancando a una velocidad de {speed}...")
             
-            self.start_detection_task()
+            self.pipeline = self.build_pipeline()
+            self.pipeline.start()
+            display = self.pipeline.slot('display')
             
             while self.camera.isOpened():
-                _, self.actual_frame = self.camera.read()
-                
-                image_lane = self.actual_frame
-                
-                if(self.keep_following):
-                    image_lane = self.lane_follower.follow_lane(self.actual_frame)
-
-                cv2.imshow('Video', image_lane)
-
-                pressed_key = cv2.waitKey(1) & 0xFF
+                # Si una etapa falla, el error llega a __exit__, que para las ruedas
+                self.pipeline.check()
+
+                # La pantalla solo muestra el último fotograma procesado,
+                # si va lenta se salta fotogramas sin frenar al carril
+                frame = display.get(timeout=0.1)
+                if frame is not None:
+                    start = metrics.now()
+                    self.display.show(frame.image, self.lane_follower.curr_steering_angle)
+                    self.release_lane_image(frame)
+                    self.metrics.since('display', start)
+
+                pressed_key = self.display.key(1)
                 if pressed_key == ord('q'):
                    self.cleanup()
                    break
@@ -165,23 +285,26 @@ class SmartPiCar(object):
                 elif pressed_key == ord('g'):
                     self.keep_following = True
                     self.keep_detecting = True
-                    self.start_detection_task()
                     self.back_wheels.speed = speed
         
         elif mode == "entrenamiento_manual": 
             logging.info("Iniciando la conducción manual...")
             logging.info(f"Arrancando a una velocidad de {speed}...")
-            os.chdir('../footage')
+            self.start_recorder()
 
             while self.camera.isOpened():
-                _, self.actual_frame = self.camera.read()
-                
-                cv2.imshow('Video',self.actual_frame)
+                # Si la cámara no entrega fotograma a tiempo, se sigue atendiendo al teclado
+                ok, frame = self.camera.read()
+                if ok:
+                    self.actual_frame = frame
+                    self.display.show(self.actual_frame)
 
                 take_photo = self.manual_driver()
                 
-                if (take_photo==True):
-                    cv2.imwrite('v%s-f%03d-a%03d.png' % (self.short_date_str, i, self.steering_angle), self.actual_frame)
+                if take_photo and not ok:
+                    logging.warning("Sin fotograma de la cámara, no se guarda")
+                elif (take_photo==True):
+                    self.recorder.append(self.actual_frame, self.steering_angle, self.back_wheels.speed)
                     i += 1 
                     logging.info(f"Frame {i} guardado")
                 
@@ -190,20 +313,25 @@ class SmartPiCar(object):
         elif mode == "entrenamiento_auto":
             logging.info("Iniciando la conducción autónoma y capturando frames...")
             logging.info(f"Arrancando a una velocidad de {speed}...")
-            os.chdir('../footage')
+            self.start_recorder()
+            record_interval = settings.get('record_interval', 0.1, float)
+            last_record = 0
 
             while self.camera.isOpened():
                 
-                _, self.actual_frame = self.camera.read()
+                ok, frame = self.camera.read()
 
-                image_lane = self.actual_frame
+                if ok:
+                    self.actual_frame = frame
+                    image_lane = self.actual_frame
                 
-                if(self.keep_following):
-                    image_lane = self.lane_follower.follow_lane(self.actual_frame)
+                    if(self.keep_following):
+                        image_lane = self.lane_follower.follow_lane(self.actual_frame)
 
-                cv2.imshow('Video', image_lane)
+                    self.display.show(image_lane)
+                    self.lane_follower.overlay.release(image_lane)
                 
-                pressed_key = cv2.waitKey(50) & 0xFF
+                pressed_key = self.display.key(50)
                 if pressed_key == ord('q'):
                     self.cleanup()
                     break
@@ -216,19 +344,23 @@ class SmartPiCar(object):
                     self.keep_detecting = True
                     self.back_wheels.speed = speed
 
-                cv2.imwrite('v%s-f%03d-a%03d.png' % (self.short_date_str, i, self.steering_angle), self.actual_frame)
-                logging.info(f"Frame {i} guardado")
-                i += 1
-                time.sleep(2)
+                # La grabación ya no frena el bucle: solo se limita la frecuencia de muestreo
+                now = time.monotonic()
+                if ok and self.recorder is not None and now - last_record >= record_interval:
+                    self.recorder.append(self.actual_frame, self.lane_follower.curr_steering_angle, self.back_wheels.speed)
+                    last_record = now
+                    logging.debug(f"Frame {i} guardado")
+                    i += 1
                  
         else:
             logging.info("Iniciando la conducción manual...")
             logging.info(f"Arrancando a una velocidad de {speed}...")
 
             while self.camera.isOpened():
-                _, self.actual_frame = self.camera.read()
-
-                cv2.imshow('Video', self.actual_frame)
+                ok, frame = self.camera.read()
+                if ok:
+                    self.actual_frame = frame
+                    self.display.show(self.actual_frame)
 
                 _ = self.manual_driver()
 
@@ -236,13 +368,17 @@ class SmartPiCar(object):
 def main(mode):
     with SmartPiCar() as car:
         car.drive(mode)
+
+    report = hal.command_report(car.hardware)
+    if report:
+        logging.info(f"Órdenes enviadas a los actuadores: {report}")
             
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG, format='%(levelname)s: %(asctime)s: %(message)s')
 
     if len(sys.argv) > 1:
-        if sys.argv[1] not in ['manual', 'entrenamiento_manual','auto', 'entrenamiento_auto']:
+        if sys.argv[1] not in MODES:
             logging.error('Por favor, escriba el modo de conducción deseado después del nombre del programa.\n \
                             - "manual": conducción mediante el teclado\n \
                             - "auto": conducción autónoma mediante inteligencia artificial\n \
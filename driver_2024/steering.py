@@ -0,0 +1,129 @@
+#------------------------------------------------------------------------------
+# Controlador de la dirección que tiene en cuenta el tiempo. Sustituye al límite
+# de 3 grados por fotograma, que hacía depender la velocidad de giro de los FPS:
+# - limita el cambio del ángulo en grados por segundo
+# - suaviza el ángulo del modelo con una media exponencial o un filtro de Kalman
+#   (ángulo y velocidad angular), ambos con el intervalo real entre fotogramas
+# - compensa la latencia: extrapola el ángulo al instante en que girarán las
+#   ruedas, desde la captura del fotograma más el retardo del servo
+# Así cambiar la frecuencia de inferencia no cambia la forma de conducir.
+#------------------------------------------------------------------------------
+
+import math
+import time
+import numpy as np
+import settings
+
+FILTERS = ('none', 'ema', 'kalman')
+
+
+class SteeringController(object):
+
+    def __init__(self,
+                 max_rate=60.0,
+                 filter='none',
+                 time_constant=0.05,
+                 process_noise=10000.0,
+                 measurement_noise=4.0,
+                 predict=False,
+                 actuation_delay=0.0,
+                 initial_angle=90,
+                 min_angle=45,
+                 max_angle=135,
+                 default_dt=1 / 30,
+                 max_dt=0.5,
+                 clock=time.monotonic):
+        if filter not in FILTERS:
+            raise ValueError(f"Filtro desconocido: {filter} (opciones: {', '.join(FILTERS)})")
+
+        self.max_rate = max_rate                    # grados por segundo (0 = sin límite)
+        self.filter = filter
+        self.time_constant = time_constant          # segundos, para la media exponencial
+        self.process_noise = process_noise          # varianza de la aceleración angular (Kalman)
+        self.measurement_noise = measurement_noise  # varianza del ángulo del modelo (Kalman)
+        self.predict = predict
+        self.actuation_delay = actuation_delay      # segundos desde la orden hasta que gira el servo
+        self.min_angle = min_angle
+        self.max_angle = max_angle
+        self.default_dt = default_dt                # intervalo supuesto para el primer fotograma
+        self.max_dt = max_dt                        # tras una pausa no se extrapola más allá
+        self.clock = clock
+        self.reset(initial_angle)
+
+    @classmethod
+    def from_settings(cls, **kwargs):
+        return cls(max_rate=settings.get('steering_max_rate', 60.0, float),
+                   filter=settings.get('steering_filter', 'none'),
+                   time_constant=settings.get('steering_time_constant', 0.05, float),
+                   process_noise=settings.get('steering_process_noise', 10000.0, float),
+                   measurement_noise=settings.get('steering_measurement_noise', 4.0, float),
+                   predict=settings.get('steering_predict', False, bool),
+                   actuation_delay=settings.get('steering_actuation_delay', 0.0, float),
+                   **kwargs)
+
+    def reset(self, angle=90):
+        self.angle = float(angle)         # última orden enviada
+        self.estimate = float(angle)      # ángulo filtrado
+        self.rate = 0.0                   # velocidad angular estimada (grados/s)
+        self._covariance = np.diag([self.measurement_noise, 100.0])
+        self._last_timestamp = None
+        self._last_command = None
+
+    def _elapsed(self, previous, current):
+        if previous is None or current is None:
+            return self.default_dt
+        return min(max(current - previous, 0.0), self.max_dt)
+
+    def _ema(self, measured, dt):
+        previous = self.estimate
+        alpha = 1 - math.exp(-dt / self.time_constant) if self.time_constant > 0 else 1.0
+        self.estimate += alpha * (measured - self.estimate)
+        if dt > 0:
+            self.rate += alpha * ((self.estimate - previous) / dt - self.rate)
+
+    def _kalman(self, measured, dt):
+        ''' Modelo de velocidad angular constante: estado [ángulo, velocidad] '''
+
+        transition = np.array([[1.0, dt], [0.0, 1.0]])
+        noise = self.process_noise * np.array([[dt ** 4 / 4, dt ** 3 / 2], [dt ** 3 / 2, dt ** 2]])
+        state = transition @ np.array([self.estimate, self.rate])
+        covariance = transition @ self._covariance @ transition.T + noise
+
+        innovation = measured - state[0]
+        gain = covariance[:, 0] / (covariance[0, 0] + self.measurement_noise)
+        state = state + gain * innovation
+        self._covariance = covariance - np.outer(gain, covariance[0])
+        self.estimate, self.rate = float(state[0]), float(state[1])
+
+    def update(self, measured, timestamp=None, now=None):
+        ''' Ángulo que hay que enviar a las ruedas para el ángulo medido en el fotograma
+            capturado en timestamp (por defecto, ahora) '''
+
+        if now is None:
+            now = self.clock()
+        if timestamp is None:
+            timestamp = now
+
+        dt = self._elapsed(self._last_timestamp, timestamp)
+        self._last_timestamp = timestamp
+
+        if self.filter == 'ema':
+            self._ema(measured, dt)
+        elif self.filter == 'kalman':
+            self._kalman(measured, dt)
+        else:
+            self.estimate = float(measured)
+
+        target = self.estimate
+        if self.predict and self.filter != 'none':
+            # El ángulo que tendrá la curva cuando giren las ruedas, no cuando se capturó
+            target += self.rate * min(now - timestamp + self.actuation_delay, self.max_dt)
+
+        # Límite de velocidad de giro con el tiempo real entre órdenes
+        if self.max_rate:
+            max_step = self.max_rate * self._elapsed(self._last_command, now)
+            target = min(max(target, self.angle - max_step), self.angle + max_step)
+        self._last_command = now
+
+        self.angle = min(max(target, self.min_angle), self.max_angle)
+        return int(round(self.angle))
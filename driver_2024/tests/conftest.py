@@ -0,0 +1,9 @@
+#------------------------------------------------------------------------------
+# Las pruebas importan los módulos del coche igual que los scripts: desde la
+# carpeta driver_2024
+#------------------------------------------------------------------------------
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
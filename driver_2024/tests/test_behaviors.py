@@ -0,0 +1,50 @@
+import types
+from actions import ActionExecutor, Timeline
+from behaviors import BehaviorTable
+from leds import FakeBlinkStick, LedController, set_controller
+
+SPEC = {'colors': {'blanco': [255, 255, 255]},
+        'behaviors': {'luces': {'priority': 'baja', 'cooldown': 2,
+                                'steps': [{'do': 'toggle_lights', 'color': 'blanco'}]}}}
+
+
+def car():
+    return types.SimpleNamespace(back_wheels=types.SimpleNamespace(_speed=30), STRAIGHT_ANGLE=90, lights=False)
+
+
+def setup(now):
+    set_controller(LedController(FakeBlinkStick()))
+    clock = lambda: now[0]
+    return BehaviorTable(SPEC, clock).behaviors['luces'], ActionExecutor(clock, threaded=False)
+
+
+def test_accion_descartada_no_cambia_nada():
+    now = [0.0]
+    luces, actions = setup(now)
+    picar = car()
+    steps = []
+    assert actions.submit(Timeline('semaforo', priority=3).at(5, lambda: steps.append('semaforo')))
+
+    timeline = luces.timeline(picar)
+    assert not actions.submit(timeline)
+    actions.run_pending()
+    assert picar.lights is False
+    assert luces.last_fired is None
+    assert steps == []
+    # Sin espera: se puede volver a intentar en el siguiente fotograma
+    assert luces.timeline(picar) is not None
+
+
+def test_accion_aceptada_cambia_las_luces_y_espera():
+    now = [0.0]
+    luces, actions = setup(now)
+    picar = car()
+
+    assert actions.submit(luces.timeline(picar))
+    assert picar.lights is False
+    actions.run_pending()
+    assert picar.lights is True
+    assert luces.timeline(picar) is None
+
+    now[0] = 2.5
+    assert luces.timeline(picar) is not None
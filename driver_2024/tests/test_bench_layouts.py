@@ -0,0 +1,16 @@
+import multiprocessing
+import time
+import pytest
+from bench_layouts import collect_results
+
+
+def test_proceso_que_termina_sin_resultado():
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=time.sleep, args=(0,))
+    process.start()
+    try:
+        with pytest.raises(RuntimeError, match='sin enviar su resultado'):
+            collect_results(results, {0: (process, None)}, timeout=5)
+    finally:
+        process.join(1)
@@ -0,0 +1,10 @@
+import pytest
+from evaluate import evaluate_steering
+
+
+def test_ninguna_imagen_legible(tmp_path):
+    for angle in (80, 90, 100):
+        (tmp_path / f"frame-a{angle:03d}.jpg").write_bytes(b'no es un jpeg')
+
+    with pytest.raises(ValueError, match='No se pudo leer'):
+        evaluate_steering(str(tmp_path), 'lane.tflite', backend='mock', workers=1)
@@ -0,0 +1,42 @@
+import socket
+import numpy as np
+from fleet import (FleetServer, FleetClient, FleetResult, ENCODING_RAW, LENGTH, MAX_MESSAGE, REQUEST,
+                   TASK_LANE, STATUS_OK, STATUS_ERROR, _send_message)
+from leds import FakeBlinkStick, LedController, set_controller
+
+
+def test_fotograma_en_bruto_con_tamano_erroneo():
+    set_controller(LedController(FakeBlinkStick()))
+    server = FleetServer(port=0, backend='mock', lane_model='lane.tflite', signal_model='signs.tflite')
+    client = FleetClient('127.0.0.1', server.port, 'picar-1', encoding=ENCODING_RAW)
+    try:
+        image = np.zeros((240, 320, 3), dtype=np.uint8)
+        assert client.submit(TASK_LANE, image).result(2).status == STATUS_OK
+
+        # La cabecera dice 320x240 pero llega la mitad de los bytes
+        with client._send_lock:
+            client._seq += 1
+            seq = client._seq
+            result = client._pending[seq] = FleetResult(client.clock())
+            _send_message(client._connection, REQUEST.pack(seq, TASK_LANE, ENCODING_RAW, 320, 240, 100),
+                          image[:120].tobytes())
+        assert result.result(2).status == STATUS_ERROR
+
+        # La conexión sigue atendiendo
+        assert client.submit(TASK_LANE, image).result(2).status == STATUS_OK
+    finally:
+        client.close()
+        server.close()
+
+
+def test_longitud_excesiva_cierra_la_conexion():
+    server = FleetServer(port=0, backend='mock', lane_model='lane.tflite', signal_model='signs.tflite')
+    connection = socket.create_connection(('127.0.0.1', server.port), timeout=2)
+    try:
+        _send_message(connection, b'picar-1')
+        connection.sendall(LENGTH.pack(MAX_MESSAGE + 1))
+        # El servidor cierra sin esperar al cuerpo del mensaje
+        assert connection.recv(1) == b''
+    finally:
+        connection.close()
+        server.close()
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from frame_ring import FrameRing
+
+SHAPE = (24, 32, 3)
+
+
+@pytest.fixture
+def ring():
+    now = [0.0]
+    ring = FrameRing(slots=4, shape=SHAPE, max_consumers=2, clock=lambda: now[0])
+    ring.now = now
+    yield ring
+    ring.close()
+    ring.unlink()
+
+
+def test_lector_recibe_el_ultimo_fotograma(ring):
+    consumer = ring.register()
+    assert ring.read(consumer, timeout=0) is None
+
+    for value in (1, 2, 3):
+        ring.publish(np.full(SHAPE, value, dtype=np.uint8), timestamp=value)
+    frame = ring.read(consumer, timeout=0)
+    assert (frame.seq, frame.timestamp, int(frame.image[0, 0, 0])) == (3, 3, 3)
+    assert not frame.image.flags.writeable
+    assert ring.valid(frame, consumer)
+    assert ring.read(consumer, timeout=0) is None
+
+
+def test_fotograma_pisado_no_es_valido(ring):
+    consumer = ring.register()
+    ring.publish(np.zeros(SHAPE, dtype=np.uint8))
+    frame = ring.read(consumer, timeout=0)
+
+    # El productor da la vuelta al anillo mientras el lector usa el fotograma
+    for _ in range(ring.slots):
+        ring.publish(np.ones(SHAPE, dtype=np.uint8))
+    assert not ring.valid(frame, consumer)
+    assert ring.copy(frame) is None
+    assert ring.stats()['consumers'][consumer]['overruns'] == 1
+
+
+def test_lector_parado(ring):
+    lane = ring.register()
+    signs = ring.register()
+    with pytest.raises(RuntimeError):
+        ring.register()
+
+    ring.now[0] = 1.0
+    ring.publish(np.zeros(SHAPE, dtype=np.uint8))
+    ring.read(lane, timeout=0)
+    assert ring.stalled(0.5) == [signs]
+    assert ring.stats()['consumers'][signs]['lag'] == 1
+
+    # Sin captura no hay lectores parados
+    ring.now[0] = 5.0
+    assert ring.stalled(0.5) == []
+
@@ -0,0 +1,60 @@
+import threading
+import time
+import leds
+from leds import FakeBlinkStick, LedController, LED_COUNT, OFF
+
+ROJO = (255, 0, 0)
+VERDE = (0, 255, 0)
+
+
+def test_una_escritura_por_fotograma_distinto():
+    device = FakeBlinkStick()
+    controller = LedController(device)
+
+    controller.fill(ROJO)
+    controller.fill(ROJO)
+    controller.show((VERDE,) + (ROJO,) * (LED_COUNT - 1))
+    controller.off()
+    controller.off()
+
+    assert (controller.writes, controller.skipped) == (3, 2)
+    assert len(device.writes) == 3
+    assert device.frames() == [(ROJO,) * LED_COUNT, (VERDE,) + (ROJO,) * (LED_COUNT - 1), OFF]
+
+
+def test_patron_sin_escrituras_repetidas():
+    device = FakeBlinkStick()
+    controller = LedController(device)
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    frames = [((ROJO,) * LED_COUNT, 0.2), ((ROJO,) * LED_COUNT, 0.2), (OFF, 0.2)]
+    controller.play(frames, 1.2, clock=lambda: now[0], sleep=sleep)
+
+    # rojo, apagado, rojo, apagado; el off final repite el último fotograma
+    assert len(device.writes) == controller.writes == 4
+    assert controller.skipped == 3
+
+
+def test_dispositivo_se_abre_una_vez(monkeypatch):
+    opened = []
+
+    def open_device(kind=None):
+        opened.append(threading.current_thread().name)
+        time.sleep(0.01)
+        return FakeBlinkStick()
+
+    monkeypatch.setattr(leds, 'open_device', open_device)
+    controller = LedController()
+    # Las acciones preguntan si hay luces mientras otro hilo ya las enciende
+    threads = [threading.Thread(target=lambda: controller.available) for _ in range(4)]
+    threads += [threading.Thread(target=controller.fill, args=(ROJO,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(opened) == 1
+    assert controller.writes == 1
@@ -0,0 +1,43 @@
+import numpy as np
+from overlay import HeadingOverlay
+from pipeline import Frame
+
+
+def test_fotograma_publicado_no_se_pinta_encima():
+    overlay = HeadingOverlay(buffers=2)
+    image = np.full((240, 320, 3), 200, dtype=np.uint8)
+    published = [Frame.publish(0, image.copy()).stamp('lane', overlay.render(image, angle))
+                 for angle in (60, 90, 120)]
+    copies = [frame.image.copy() for frame in published]
+
+    # Nadie ha devuelto los fotogramas: cada render pinta en un buffer nuevo
+    for angle in range(45, 136, 5):
+        overlay.render(image, angle)
+
+    for frame, copy in zip(published, copies):
+        assert not frame.image.flags.writeable
+        assert np.array_equal(frame.image, copy)
+
+
+def test_buffer_devuelto_se_reutiliza():
+    overlay = HeadingOverlay()
+    image = np.zeros((240, 320, 3), dtype=np.uint8)
+    for angle in range(45, 136):
+        assert overlay.release(overlay.render(image, angle))
+    assert overlay.allocations == 1
+
+
+def test_sin_devolver_se_reserva_otro():
+    overlay = HeadingOverlay(buffers=2)
+    image = np.zeros((240, 320, 3), dtype=np.uint8)
+    first = overlay.render(image, 90)
+    second = overlay.render(image, 90)
+    third = overlay.render(image, 90)
+    assert overlay.allocations == 3
+    assert not np.shares_memory(third, first) and not np.shares_memory(third, second)
+
+    # Una imagen que no es de la reserva no libera nada
+    assert not overlay.release(third)
+    assert not overlay.release(image)
+    assert overlay.release(first)
+    assert np.shares_memory(overlay.render(image, 90), first)
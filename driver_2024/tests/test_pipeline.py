@@ -0,0 +1,50 @@
+import time
+import pytest
+from pipeline import Pipeline
+
+
+def test_error_de_etapa_queda_en_el_pipeline():
+    def fail(frame):
+        raise ValueError('modelo roto')
+
+    pipeline = Pipeline()
+    frames = iter(range(3))
+    pipeline.add_stage('capture', lambda: next(frames, None), outputs=('lane',))
+    pipeline.add_stage('lane', fail, source='lane')
+    pipeline.start()
+    deadline = time.monotonic() + 2
+    while pipeline.error is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pipeline.stop()
+
+    assert isinstance(pipeline.error, ValueError)
+    with pytest.raises(RuntimeError):
+        pipeline.check()
+
+
+def test_etapa_sin_fuente_espera_si_no_produce():
+    calls = [0]
+
+    def empty():
+        calls[0] += 1
+        return None
+
+    pipeline = Pipeline()
+    pipeline.add_stage('capture', empty)
+    pipeline.start()
+    time.sleep(0.2)
+    pipeline.stop()
+
+    # Sin espera daría cientos de miles de vueltas
+    assert calls[0] < 200
+
+
+def test_hueco_entrega_el_elemento_descartado():
+    dropped = []
+    slot = Pipeline().slot('display', on_drop=dropped.append)
+    slot.put(1)
+    slot.put(2)
+    assert slot.get(timeout=0) == 2
+    slot.put(3)
+
+    assert dropped == [1]
@@ -0,0 +1,40 @@
+import numpy as np
+from postprocessing import postprocess, postprocess_loop, postprocess_vectorized, class_aware_nms
+
+
+def outputs(n, rng):
+    ''' Salidas simuladas del detector con cajas agrupadas para que la NMS tenga trabajo '''
+    centers = rng.uniform(0.1, 0.9, (max(1, n // 5), 2))
+    center = centers[rng.integers(0, len(centers), n)] + rng.normal(0, 0.01, (n, 2))
+    size = rng.uniform(0.05, 0.4, (n, 1))
+    boxes = np.hstack([center - size / 2, center + size / 2]).astype(np.float32)
+    scores = rng.uniform(0, 1, n).astype(np.float32)
+    classes = rng.integers(0, 3, n).astype(np.float32)
+    return scores, boxes, classes
+
+
+def test_bucle_y_vectorizado_coinciden():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        scores, boxes, classes = outputs(int(rng.integers(2, 40)), rng)
+        selected = np.flatnonzero(scores > 0.6)
+        loop = postprocess_loop(scores, boxes, classes, selected)
+        vectorized = postprocess_vectorized(scores, boxes, classes, selected)
+        assert len(loop) == len(vectorized)
+        for name in loop.dtype.names:
+            np.testing.assert_allclose(np.sort(loop[name]), np.sort(vectorized[name]), rtol=1e-5)
+
+
+def test_nms_solo_entre_cajas_de_la_misma_clase():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 10, 10], [0, 0, 10, 10]], dtype=np.float32)
+    classes = np.array([0, 0, 1])
+    assert class_aware_nms(boxes, classes, 0.5).tolist() == [True, False, True]
+
+
+def test_pocas_cajas_sin_solape():
+    scores = np.array([0.9, 0.3, 0.7], dtype=np.float32)
+    boxes = np.array([[0, 0, 10, 10], [0, 0, 10, 10], [50, 50, 150, 150]], dtype=np.float32)
+    classes = np.array([0, 0, 0], dtype=np.float32)
+    detections = postprocess(scores, boxes, classes, near_height=100)
+    # La caja grande va primero: confianza x proximidad
+    assert detections['score'].tolist() == [np.float32(0.7), np.float32(0.9)]
@@ -0,0 +1,37 @@
+import os
+import time
+import numpy as np
+from recorder import DatasetRecorder, DatasetReader
+
+
+def frames(count):
+    return [np.full((24, 32, 3), i, dtype=np.uint8) for i in range(count)]
+
+
+def test_ultimo_bloque_raw_recortado(tmp_path):
+    recorder = DatasetRecorder(str(tmp_path), frame_shape=(24, 32, 3), chunk_size=4)
+    for i, frame in enumerate(frames(6)):
+        while not recorder.append(frame, 90 + i, 30):
+            pass
+    recorder.close()
+
+    last = np.load(tmp_path / 'frames_00001.npy', mmap_mode='r')
+    assert last.shape == (2, 24, 32, 3)
+    assert os.path.getsize(tmp_path / 'frames_00001.npy') < os.path.getsize(tmp_path / 'frames_00000.npy')
+
+    reader = DatasetReader(str(tmp_path))
+    assert len(reader) == 6
+    assert [int(reader.frame(i)[0, 0, 0]) for i in range(6)] == list(range(6))
+    assert reader.index['angle'].tolist() == list(range(90, 96))
+
+
+def test_indice_guardado_antes_de_cerrar(tmp_path):
+    recorder = DatasetRecorder(str(tmp_path), frame_shape=(24, 32, 3), chunk_size=10)
+    for frame in frames(3):
+        recorder.append(frame, 90, 30)
+    # El hilo vacía la cola y guarda el índice sin esperar a que el bloque se cierre
+    deadline = time.monotonic() + 2
+    while len(DatasetReader(str(tmp_path))) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(DatasetReader(str(tmp_path))) == 3
+    recorder.close()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from roi import RoiLayout, Roi, parse_rois, parse_tiles, to_frame
+
+INPUT = (320, 320)
+
+
+def to_model(box, window):
+    ''' Caja en píxeles del fotograma -> coordenadas normalizadas que vería el modelo '''
+    ymin, xmin, ymax, xmax = box
+    y = lambda value: ((value - window.y) * window.scale_y + window.pad_y) / INPUT[1]
+    x = lambda value: ((value - window.x) * window.scale_x + window.pad_x) / INPUT[0]
+    return [y(ymin), x(xmin), y(ymax), x(xmax)]
+
+
+@pytest.mark.parametrize('letterbox', [False, True])
+def test_cajas_vuelven_a_pixeles_del_fotograma(letterbox):
+    layout = RoiLayout((Roi(0.5, 0.0, 0.5, 0.6),), tiles=(2, 1), letterbox=letterbox)
+    box = (30.0, 200.0, 90.0, 230.0)
+    checked = 0
+    for window in layout.windows(320, 240, *INPUT):
+        if not (window.x <= box[1] and box[3] <= window.x + window.width):
+            continue
+        boxes = np.array([to_model(box, window)], dtype=np.float32)
+        np.testing.assert_allclose(to_frame(boxes, window, *INPUT)[0], box, atol=1e-3)
+        checked += 1
+    assert checked > 0
+
+
+def test_teselas_cubren_la_region_con_solape():
+    layout = RoiLayout((Roi(0.5, 0.0, 0.5, 1.0),), tiles=(2, 1), overlap=0.2)
+    left, right = layout.windows(320, 240, *INPUT)
+    assert left.x == 160 and right.x + right.width == 320
+    assert left.x + left.width > right.x
+    assert left.height == right.height == 240
+
+
+def test_letterbox_recorta_lo_que_cae_en_las_bandas():
+    layout = RoiLayout(letterbox=True)
+    (window,) = layout.windows(320, 240, *INPUT)
+    assert window.pad_y > 0 and window.pad_x == 0
+    boxes = np.array([[0.0, 0.0, 1.0, 1.0]], dtype=np.float32)
+    assert to_frame(boxes, window, *INPUT)[0].tolist() == [0, 0, 240, 320]
+
+
+def test_regiones_mal_escritas():
+    assert parse_rois('') == parse_rois('0,0,1,1')
+    assert parse_tiles('2x1') == (2, 1)
+    with pytest.raises(ValueError):
+        parse_rois('0.5,0,0.6,1')
+    with pytest.raises(ValueError):
+        parse_rois('0,0,1')
@@ -0,0 +1,17 @@
+from backends import LANE_MODEL_SPEC
+from runner import ModelRunner
+
+
+def test_cada_carga_tiene_su_interprete():
+    runner = ModelRunner('mock')
+    first, first_interpreter = runner.load('lane', 'a.tflite', LANE_MODEL_SPEC)
+    second, second_interpreter = runner.load('lane', 'b.tflite', LANE_MODEL_SPEC)
+
+    assert (first, second) == ('lane', 'lane_2')
+    assert first_interpreter is not second_interpreter
+    assert runner.interpreter('lane') is first_interpreter
+    assert runner.interpreter('lane_2') is second_interpreter
+
+    runner.invoke(second)
+    stats = runner.stats()
+    assert (stats['lane']['requests'], stats['lane_2']['requests']) == (0, 1)
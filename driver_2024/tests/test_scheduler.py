@@ -0,0 +1,16 @@
+import numpy as np
+from scheduler import DetectionScheduler
+
+
+def test_fotograma_igual_solo_se_salta_despacio():
+    image = np.zeros((240, 320, 3), dtype=np.uint8)
+    for speed, expected in ((0, False), (30, True)):
+        scheduler = DetectionScheduler(min_interval=0.1, max_duty=0, clock=lambda: 0)
+        assert scheduler.should_detect(image, speed, now=0)
+        assert scheduler.should_detect(image, speed, now=1.0) == expected
+
+
+def test_intervalo_segun_la_velocidad():
+    scheduler = DetectionScheduler(distance=0.05, max_duty=0)
+    # A velocidad 20 un metro son 10 s: 5 cm cada 0.5 s
+    assert scheduler.target_interval(20, now=0) == 0.5
@@ -0,0 +1,66 @@
+import math
+import pytest
+from steering import SteeringController
+
+AMPLITUDE = 20   # grados
+FREQUENCY = 0.5  # Hz: hasta unos 63 grados/s, casi el límite de giro por defecto
+
+
+def curve(t):
+    return 90 + AMPLITUDE * math.sin(2 * math.pi * FREQUENCY * t)
+
+
+def old_clamp():
+    ''' Límite anterior: como mucho 3 grados por fotograma '''
+    state = {'angle': 90}
+
+    def update(measured, t):
+        deviation = measured - state['angle']
+        if abs(deviation) > 3:
+            measured = state['angle'] + math.copysign(3, deviation)
+        state['angle'] = int(measured)
+        return state['angle']
+    return update
+
+
+def controller(**kwargs):
+    steering = SteeringController(clock=lambda: 0.0, **kwargs)
+    return lambda measured, t: steering.update(measured, timestamp=t, now=t)
+
+
+def tracking_error(update, fps, seconds=10, warmup=1):
+    ''' Error absoluto medio entre la orden y la curva en cada fotograma '''
+    errors = []
+    for k in range(int(seconds * fps)):
+        t = k / fps
+        angle = update(curve(t), t)
+        if t >= warmup:
+            errors.append(abs(angle - curve(t)))
+    return sum(errors) / len(errors)
+
+
+@pytest.mark.parametrize('fps', [5, 10, 30])
+def test_seguimiento_no_depende_de_los_fps(fps):
+    assert tracking_error(controller(), fps) < 1
+
+
+def test_limite_por_fotograma_si_dependia_de_los_fps():
+    assert tracking_error(old_clamp(), 5) > 10 * tracking_error(old_clamp(), 30)
+
+
+def test_limite_en_grados_por_segundo():
+    steering = SteeringController(max_rate=60, clock=lambda: 0.0)
+    angles = [steering.update(135, timestamp=t / 10, now=t / 10) for t in range(5)]
+    # La primera orden supone default_dt (1/30 s); después, 6 grados cada 0.1 s
+    assert angles == [92, 98, 104, 110, 116]
+
+
+@pytest.mark.parametrize('filter', ['ema', 'kalman'])
+def test_filtros_siguen_la_curva(filter):
+    for fps in (5, 10, 30):
+        assert tracking_error(controller(filter=filter), fps) < 3
+
+
+def test_filtro_desconocido():
+    with pytest.raises(ValueError):
+        SteeringController(filter='media')
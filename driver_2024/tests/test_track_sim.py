@@ -0,0 +1,56 @@
+import math
+import pytest
+from track_sim import KinematicCar, Track, TrackSimulator, compare, load_sprites, load_tracks
+
+
+# El modelo del backend mock devuelve ceros, que giran a tope: solo los primeros
+# segundos siguen dentro del carril
+def simulate(seconds=1.5):
+    spec = load_tracks()
+    track = Track.from_spec('ovalo', spec['tracks']['ovalo'])
+    simulator = TrackSimulator(track, load_sprites(spec['sprites']), backend='mock',
+                               lane_model='lane.tflite', signal_model='signs.tflite')
+    try:
+        return simulator.run(seconds)
+    finally:
+        simulator.close()
+
+
+def test_simulacion_determinista():
+    first = simulate()
+    second = simulate()
+
+    assert first['lost_at_s'] is None
+    assert first['deviation'] == second['deviation']
+    assert first['sign_events'] == second['sign_events']
+
+
+def test_coche_recto():
+    car = KinematicCar(0.0, 0.0, 0.0)
+    for _ in range(30):
+        car.step(1 / 30, 30, 90)
+
+    assert car.x > 0
+    assert car.y == pytest.approx(0.0)
+    assert car.heading == pytest.approx(0.0)
+
+
+def test_coche_gira_a_la_izquierda():
+    car = KinematicCar(0.0, 0.0, 0.0)
+    for _ in range(30):
+        car.step(1 / 30, 30, 60)
+
+    # Menos de 90 gira a la izquierda: la orientación crece y el coche sube
+    assert 0 < car.heading < math.pi
+    assert car.y > 0
+
+
+def test_compare_senala_mas_desviacion():
+    def report(rms_cm):
+        return {'deviation': {'rms_cm': rms_cm, 'p95_cm': 2.0, 'max_cm': 3.0},
+                'signs': {},
+                'stages': {'loop': {'p50_ms': 10.0, 'p99_ms': 20.0}},
+                'lost_at_s': None}
+
+    assert not compare(report(1.0), report(1.05))
+    assert compare(report(1.0), report(3.0))
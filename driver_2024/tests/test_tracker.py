@@ -0,0 +1,82 @@
+import types
+import numpy as np
+from actions import ActionExecutor
+from autonomous_driver_2024 import TrafficSignDetector
+from leds import FakeBlinkStick, LedController, set_controller
+from postprocessing import DETECTION_DTYPE, NEAR_HEIGHT
+from runner import ModelRunner
+from tracker import SignTracker
+
+STOP = 0
+LUCES = 4
+
+
+def detections(*signs):
+    ''' Detecciones cercanas: (class_id, xmin) '''
+    result = np.zeros(len(signs), dtype=DETECTION_DTYPE)
+    for detection, (class_id, xmin) in zip(result, signs):
+        detection['class_id'] = class_id
+        detection['score'] = 0.9
+        detection['ymin'] = 20
+        detection['ymax'] = 20 + NEAR_HEIGHT + 10
+        detection['xmin'] = xmin
+        detection['xmax'] = xmin + 80
+    return result
+
+
+def confirm(tracker, frame, start=0.0):
+    tracker.update(frame, start)
+    return tracker.update(frame, start + 0.1)
+
+
+def test_confirma_en_n_de_m_fotogramas():
+    tracker = SignTracker(confirm_hits=2, window=3)
+    assert len(tracker.update(detections((STOP, 10)), 0.0)) == 0
+    assert len(tracker.update(detections((STOP, 12)), 0.1)) == 1
+
+
+def test_pista_sin_marcar_se_devuelve_otra_vez():
+    tracker = SignTracker()
+    confirmed = confirm(tracker, detections((STOP, 10)))
+    assert len(tracker.update(detections((STOP, 10)), 0.2)) == 1
+
+    tracker.mark_fired(confirmed[0]['track_id'])
+    assert len(tracker.update(detections((STOP, 10)), 0.3)) == 0
+
+
+def car():
+    return types.SimpleNamespace(back_wheels=types.SimpleNamespace(_speed=30),
+                                 front_wheels=None, STRAIGHT_ANGLE=90, lights=False,
+                                 keep_following=True)
+
+
+def detector(actions):
+    set_controller(LedController(FakeBlinkStick()))
+    return TrafficSignDetector(car(), backend='mock', runner=ModelRunner('mock'),
+                               clock=lambda: 0.0, actions=actions)
+
+
+def test_dos_senales_confirmadas_en_el_mismo_fotograma():
+    actions = ActionExecutor(clock=lambda: 0.0, threaded=False)
+    signs = detector(actions)
+    confirmed = confirm(signs.tracker, detections((STOP, 10), (LUCES, 200)))
+    assert sorted(confirmed['class_id']) == [STOP, LUCES]
+
+    signs.act(confirmed)
+
+    # stop es exclusiva y luces va en segundo plano: se aceptan las dos
+    assert actions.current == 'stop'
+    assert [running.timeline.name for running in actions._background] == ['luces']
+    assert len(signs.tracker.update(detections((STOP, 10), (LUCES, 200)), 0.2)) == 0
+
+
+def test_accion_rechazada_se_reintenta():
+    actions = ActionExecutor(clock=lambda: 0.0, threaded=False)
+    signs = detector(actions)
+    semaforo = signs.behaviors[signs.labels.index('rojo')].timeline(signs.car)
+    assert actions.submit(semaforo)
+
+    confirmed = confirm(signs.tracker, detections((STOP, 10)))
+    signs.act(confirmed)
+    assert actions.current == 'rojo'
+    assert len(signs.tracker.update(detections((STOP, 10)), 0.2)) == 1
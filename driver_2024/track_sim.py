@@ -0,0 +1,773 @@
+#------------------------------------------------------------------------------
+# Simulador de circuito en 2D, determinista y más rápido que el tiempo real, para
+# comprobar sin el coche que un cambio de rendimiento no empeora la conducción:
+# - el circuito (tracks.json) es la línea central de un carril limitado por dos
+#   cintas sobre un suelo de terrazo visto desde arriba; la cámara del coche
+#   (320x240) se obtiene proyectando cada píxel sobre el suelo con una tabla
+#   calculada una vez, y las señales son recortes de imagenes/señales.jpg sobre
+#   su poste
+# - el coche es un modelo de bicicleta con el servo de la dirección limitado en
+#   grados por segundo; las órdenes le llegan por el hardware simulado de hal.py
+#   con un retardo de actuación
+# - cada fotograma pasa por LaneFollower.follow_lane y, cuando lo pide el
+#   planificador, por TrafficSignDetector.detect_signal; las acciones de las
+#   señales se ejecutan con ActionExecutor sin hilo y con el reloj simulado
+# Muestra en JSON la desviación respecto al centro del carril, la distancia a la
+# señal al detectarla y al reaccionar, y la latencia del bucle (p50/p95/p99).
+# Con --latency measured el retardo de cada orden es el tiempo real del bucle
+# (multiplicado por --latency-scale para imitar la Raspberry), así una etapa
+# más lenta se nota en la conducción; entonces la ejecución deja de ser determinista.
+# Uso:
+#   python3 track_sim.py ovalo --seconds 60 --backend cpu --output base.json
+#   python3 track_sim.py ovalo --seconds 60 --backend cpu --compare base.json
+#   python3 track_sim.py circuito --latency measured --latency-scale 4 --video vuelta.mp4
+#------------------------------------------------------------------------------
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import time
+from lazy import lazy_import
+cv2 = lazy_import('cv2')
+import numpy as np
+import settings
+from actions import ActionExecutor
+from behaviors import DEFAULT_CONSTANTS
+from hal import DedupSteering, RecordingDrive, RecordingSteering, RecordingServo, command_report
+
+TRACKS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracks.json')
+
+LATENCIES = ('fixed', 'measured')
+
+# Metros por segundo de cada punto de velocidad: 1 metro en 10 segundos con 20
+METERS_PER_SPEED = 1.0 / (DEFAULT_CONSTANTS['meter_seconds'] * DEFAULT_CONSTANTS['meter_speed'])
+
+SIDES = {'izquierda': 1, 'derecha': -1}
+
+TAPE_COLOR = (180, 110, 230)
+FLOOR_COLOR = (176, 186, 192)
+STONE_COLORS = ((120, 130, 140), (92, 102, 112), (150, 160, 170), (205, 210, 214), (110, 128, 150))
+WALL_COLOR = (222, 226, 228)
+SKIRTING_COLOR = (150, 160, 166)
+POLE_COLOR = (235, 235, 235)
+BASE_COLOR = (120, 120, 125)
+
+
+def load_tracks(path=None):
+    ''' Circuitos y recortes de las señales de tracks.json (o de la clave sim_tracks) '''
+
+    if path is None:
+        path = settings.get('sim_tracks', TRACKS_PATH)
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_sprites(spec):
+    ''' Imagen de cada señal recortada de la foto de sprites.image '''
+
+    path = os.path.join(settings.REPO_PATH, spec['image'])
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f"No se pudo leer la imagen de las señales {path}")
+    return {label: image[y0:y1, x0:x1].copy() for label, (x0, y0, x1, y1) in spec['boxes'].items()}
+
+
+def _chaikin(points, iterations=4):
+    ''' Suaviza un polígono cerrado cortando sus esquinas '''
+
+    for _ in range(iterations):
+        following = np.roll(points, -1, axis=0)
+        smoothed = np.empty((len(points) * 2, 2))
+        smoothed[0::2] = 0.75 * points + 0.25 * following
+        smoothed[1::2] = 0.25 * points + 0.75 * following
+        points = smoothed
+    return points
+
+
+class SignPlacement(object):
+    ''' Señal sobre la cinta de un lado, a at metros de la salida, con su poste y su base '''
+
+    def __init__(self, label, at, position, size=0.11, height=0.18):
+        self.label = label
+        self.at = at
+        self.position = position
+        self.size = size        # lado de la placa en metros
+        self.height = height    # altura del centro de la placa
+
+
+class Track(object):
+    ''' Línea central cerrada del carril, remuestreada cada step metros. Las cintas
+        van a width/2 a cada lado, como en imagenes/circuito_cerrado.jpg '''
+
+    def __init__(self, name, waypoints, width=0.3, tape=0.05, signs=(), step=0.01, resolution=0.005,
+                 margin=1.5, seed=0):
+        self.name = name
+        self.width = width            # metros entre los centros de las dos cintas
+        self.tape = tape
+        self.resolution = resolution  # metros por píxel del suelo
+        self.margin = margin
+        self.seed = seed
+
+        smoothed = _chaikin(np.asarray(waypoints, dtype=np.float64))
+        closed = np.vstack([smoothed, smoothed[:1]])
+        lengths = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(closed, axis=0), axis=1))])
+        self.length = float(lengths[-1])
+        self.s = np.arange(0.0, self.length, step)
+        self.points = np.stack([np.interp(self.s, lengths, closed[:, 0]),
+                                np.interp(self.s, lengths, closed[:, 1])], axis=1)
+        tangents = np.roll(self.points, -1, axis=0) - np.roll(self.points, 1, axis=0)
+        self.tangents = tangents / np.linalg.norm(tangents, axis=1)[:, None]
+
+        self.signs = [self._place(sign) for sign in signs]
+        self._texture = None
+
+    @classmethod
+    def from_spec(cls, name, spec):
+        return cls(name, spec['waypoints'], spec.get('width', 0.3), spec.get('tape', 0.05), spec.get('signs', ()))
+
+    def _place(self, sign):
+        side = sign.get('side', 'derecha')
+        if side not in SIDES:
+            raise ValueError(f"Lado desconocido: {side} (opciones: {', '.join(SIDES)})")
+        x, y, heading = self.pose(sign['at'])
+        offset = SIDES[side] * (self.width / 2 + sign.get('offset', 0.0))
+        position = (x - offset * math.sin(heading), y + offset * math.cos(heading))
+        return SignPlacement(sign['label'], sign['at'] % self.length, position,
+                             sign.get('size', 0.11), sign.get('height', 0.18))
+
+    def pose(self, s):
+        ''' Punto y orientación de la línea central a s metros de la salida '''
+
+        i = int(round((s % self.length) / (self.s[1] - self.s[0]))) % len(self.s)
+        tx, ty = self.tangents[i]
+        return float(self.points[i, 0]), float(self.points[i, 1]), math.atan2(ty, tx)
+
+    def project(self, x, y):
+        ''' (metros desde la salida, desviación lateral) del punto; a la izquierda es positiva '''
+
+        offsets = self.points - (x, y)
+        i = int(np.argmin(np.einsum('ij,ij->i', offsets, offsets)))
+        dx, dy = x - self.points[i, 0], y - self.points[i, 1]
+        tx, ty = self.tangents[i]
+        return (float(self.s[i]) + dx * tx + dy * ty) % self.length, tx * dy - ty * dx
+
+    def texture(self):
+        ''' Suelo visto desde arriba con las cintas: (imagen, x mínima, y máxima) '''
+
+        if self._texture is not None:
+            return self._texture
+
+        low = self.points.min(axis=0) - self.width / 2 - self.margin
+        high = self.points.max(axis=0) + self.width / 2 + self.margin
+        width, height = [int(math.ceil(extent / self.resolution)) for extent in high - low]
+
+        # Terrazo: grano fino y piedras de varios tonos, siempre las mismas para la misma semilla
+        rng = np.random.default_rng(self.seed)
+        image = np.empty((height, width, 3), dtype=np.uint8)
+        image[:] = FLOOR_COLOR
+        grain = rng.integers(-10, 11, size=(height, width, 1), dtype=np.int16)
+        image[:] = np.clip(image + grain, 0, 255)
+        for _ in range(width * height // 150):
+            center = (int(rng.integers(width)), int(rng.integers(height)))
+            axes = (int(rng.integers(2, 9)), int(rng.integers(2, 7)))
+            color = STONE_COLORS[int(rng.integers(len(STONE_COLORS)))]
+            cv2.ellipse(image, center, axes, float(rng.uniform(0, 180)), 0, 360, color, -1)
+
+        shift = 4
+        normals = np.stack([-self.tangents[:, 1], self.tangents[:, 0]], axis=1)
+        for side in (1, -1):
+            edge = self.points + side * self.width / 2 * normals
+            pixels = np.stack([(edge[:, 0] - low[0]) / self.resolution,
+                               (high[1] - edge[:, 1]) / self.resolution], axis=1)
+            pixels = np.round(pixels * (1 << shift)).astype(np.int32)
+            cv2.polylines(image, [pixels], True, TAPE_COLOR, int(round(self.tape / self.resolution)),
+                          cv2.LINE_AA, shift)
+
+        self._texture = (image, float(low[0]), float(high[1]))
+        return self._texture
+
+
+class GroundCamera(object):
+    ''' Cámara del coche: cada píxel por debajo del horizonte corta el suelo en un
+        punto fijo respecto al coche, calculado una vez; en cada fotograma solo se
+        giran y desplazan esos puntos y se muestrea el suelo con cv2.remap '''
+
+    def __init__(self, width=320, height=240, fov=62.0, camera_height=0.14, pitch=8.0, max_range=3.0):
+        self.width = width
+        self.height = height
+        self.focal = width / 2 / math.tan(math.radians(fov) / 2)
+        self.camera_height = camera_height
+        self.max_range = max_range
+        self.pitch = math.radians(pitch)
+        self.cx = width / 2
+        self.cy = height / 2
+
+        left = (self.cx - (np.arange(width) + 0.5)) / self.focal
+        up = (self.cy - (np.arange(height) + 0.5)) / self.focal
+        forward = math.cos(self.pitch) + up * math.sin(self.pitch)
+        down = math.sin(self.pitch) - up * math.cos(self.pitch)
+        with np.errstate(divide='ignore'):
+            distance = np.where(down > 0, camera_height / down, np.inf)
+        # Más allá de max_range se ve la pared
+        ground = distance * forward <= max_range
+        self.horizon = int(np.argmax(ground)) if ground.any() else height
+
+        rows = distance[self.horizon:, None]
+        self.ground_x = (rows * forward[self.horizon:, None] * np.ones((1, width))).astype(np.float32)
+        self.ground_y = (rows * left[None, :]).astype(np.float32)
+
+        self.background = self._background()
+        self.image = np.empty((height, width, 3), dtype=np.uint8)
+        self._map_x = np.empty_like(self.ground_x)
+        self._map_y = np.empty_like(self.ground_x)
+        self._scratch = np.empty_like(self.ground_x)
+
+    def _background(self):
+        ''' Pared clara con el rodapié justo encima del suelo '''
+
+        background = np.empty((self.horizon, self.width, 3), dtype=np.uint8)
+        background[:] = WALL_COLOR
+        skirting = min(max(self.horizon // 8, 2), self.horizon)
+        background[self.horizon - skirting:] = SKIRTING_COLOR
+        return background
+
+    def project(self, x, y, z):
+        ''' Píxel (u, v) y profundidad de un punto en metros respecto al coche:
+            x hacia delante, y a la izquierda, z altura sobre el suelo '''
+
+        z = z - self.camera_height
+        depth = x * math.cos(self.pitch) - z * math.sin(self.pitch)
+        up = x * math.sin(self.pitch) + z * math.cos(self.pitch)
+        if depth <= 0:
+            return None
+        return self.cx - self.focal * y / depth, self.cy - self.focal * up / depth, depth
+
+    def render(self, track, pose, sprites):
+        ''' Fotograma visto desde pose (x, y, orientación) de la cámara '''
+
+        x, y, heading = pose
+        texture, left, top = track.texture()
+        cos, sin = math.cos(heading), math.sin(heading)
+        resolution = track.resolution
+
+        # Píxel del suelo de cada píxel de la cámara, sin reservar memoria
+        np.multiply(self.ground_x, cos / resolution, out=self._map_x)
+        np.multiply(self.ground_y, -sin / resolution, out=self._scratch)
+        self._map_x += self._scratch
+        self._map_x += (x - left) / resolution
+        np.multiply(self.ground_x, -sin / resolution, out=self._map_y)
+        np.multiply(self.ground_y, -cos / resolution, out=self._scratch)
+        self._map_y += self._scratch
+        self._map_y += (top - y) / resolution
+
+        self.image[:self.horizon] = self.background
+        cv2.remap(texture, self._map_x, self._map_y, cv2.INTER_LINEAR,
+                  dst=self.image[self.horizon:], borderMode=cv2.BORDER_REFLECT_101)
+
+        # Las señales de la más lejana a la más cercana
+        visible = []
+        for sign in track.signs:
+            dx, dy = sign.position[0] - x, sign.position[1] - y
+            forward, lateral = dx * cos + dy * sin, -dx * sin + dy * cos
+            if forward > 0.05:
+                visible.append((forward, lateral, sign))
+        for forward, lateral, sign in sorted(visible, key=lambda item: -item[0]):
+            self._draw_sign(forward, lateral, sign, sprites.get(sign.label))
+        return self.image
+
+    def _draw_sign(self, forward, lateral, sign, sprite):
+        base = self.project(forward, lateral, 0.0)
+        head = self.project(forward, lateral, sign.height)
+        if base is None or head is None:
+            return
+
+        scale = self.focal / head[2]
+        pole = max(int(round(0.01 * scale)), 1)
+        cv2.ellipse(self.image, (int(base[0]), int(base[1])), (max(int(0.04 * scale), 1), max(int(0.015 * scale), 1)),
+                    0, 0, 360, BASE_COLOR, -1)
+        cv2.line(self.image, (int(base[0]), int(base[1])), (int(head[0]), int(head[1])), POLE_COLOR, pole)
+        if sprite is None:
+            return
+
+        height = int(round(sign.size * scale))
+        width = int(round(height * sprite.shape[1] / sprite.shape[0]))
+        if height < 2 or width < 2:
+            return
+        x0, y0 = int(round(head[0] - width / 2)), int(round(head[1] - height / 2))
+        x1, y1 = x0 + width, y0 + height
+        cx0, cy0 = max(x0, 0), max(y0, 0)
+        cx1, cy1 = min(x1, self.width), min(y1, self.height)
+        if cx0 >= cx1 or cy0 >= cy1:
+            return
+        resized = cv2.resize(sprite, (width, height), interpolation=cv2.INTER_AREA)
+        self.image[cy0:cy1, cx0:cx1] = resized[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+
+
+class KinematicCar(object):
+    ''' Modelo de bicicleta: posición del eje trasero, orientación y ángulo real del servo '''
+
+    def __init__(self, x, y, heading, wheelbase=0.14, camera_ahead=0.12, servo_rate=300.0,
+                 straight_angle=90, meters_per_speed=METERS_PER_SPEED):
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.wheelbase = wheelbase
+        self.camera_ahead = camera_ahead    # metros de la cámara por delante del eje trasero
+        self.servo_rate = servo_rate        # grados por segundo del servo de la dirección
+        self.straight_angle = straight_angle
+        self.meters_per_speed = meters_per_speed
+        self.angle = float(straight_angle)
+        self.odometer = 0.0
+
+    def step(self, dt, speed, target_angle):
+        change = self.servo_rate * dt
+        self.angle += min(max(target_angle - self.angle, -change), change)
+
+        # Menos de 90 gira a la izquierda, que es el sentido positivo
+        delta = math.radians(self.straight_angle - self.angle)
+        distance = speed * self.meters_per_speed * dt
+        if abs(delta) < 1e-6:
+            self.x += distance * math.cos(self.heading)
+            self.y += distance * math.sin(self.heading)
+        else:
+            radius = self.wheelbase / math.tan(delta)
+            turn = distance / radius
+            self.x += radius * (math.sin(self.heading + turn) - math.sin(self.heading))
+            self.y -= radius * (math.cos(self.heading + turn) - math.cos(self.heading))
+            self.heading += turn
+        self.odometer += abs(distance)
+
+    def point(self, ahead):
+        return (self.x + ahead * math.cos(self.heading), self.y + ahead * math.sin(self.heading))
+
+    def camera_pose(self):
+        return self.point(self.camera_ahead) + (self.heading,)
+
+    def center(self):
+        return self.point(self.wheelbase / 2)
+
+
+class SimClock(object):
+    ''' Reloj simulado. Con measured, dentro de un fotograma avanza con el tiempo
+        real transcurrido (por scale) para que las órdenes lleguen con el retardo medido '''
+
+    def __init__(self, measured=False, scale=1.0):
+        self.measured = measured
+        self.scale = scale
+        self.now = 0.0
+        self._wall_start = None
+
+    def tick(self, now):
+        self.now = now
+        self._wall_start = time.perf_counter()
+
+    def __call__(self):
+        if self.measured and self._wall_start is not None:
+            return self.now + (time.perf_counter() - self._wall_start) * self.scale
+        return self.now
+
+
+class SimCar(object):
+    ''' Lo que usan de SmartPiCar los modelos y las señales, con el hardware simulado de hal.py '''
+
+    STRAIGHT_ANGLE = 90
+
+    def __init__(self, clock, speed=30):
+        self.back_wheels = RecordingDrive(clock)
+        self.front_wheels = DedupSteering(RecordingSteering(clock))
+        self.horizontal_servo = RecordingServo(clock)
+        self.vertical_servo = RecordingServo(clock)
+        self.keep_following = True
+        self.keep_detecting = True
+        self.lights = False
+        self.front_wheels.turn(self.STRAIGHT_ANGLE)
+        self.back_wheels.speed = speed
+
+
+class _ActuatorDelay(object):
+    ''' Última orden de un actuador que ya ha llegado, delay segundos después de darla '''
+
+    def __init__(self, recorder, delay, initial):
+        self.recorder = recorder
+        self.delay = delay
+        self.value = initial
+        self._next = 0
+
+    def __call__(self, now):
+        commands = self.recorder.commands
+        while self._next < len(commands) and commands[self._next][0] + self.delay <= now:
+            self.value = commands[self._next][1]
+            self._next += 1
+        return self.value
+
+
+class _RecordingExecutor(ActionExecutor):
+    ''' Ejecutor sin hilo que avisa de cada acción aceptada '''
+
+    def __init__(self, clock, on_submit):
+        super().__init__(clock, threaded=False)
+        self.on_submit = on_submit
+
+    def submit(self, timeline):
+        accepted = super().submit(timeline)
+        if accepted:
+            self.on_submit(timeline.name)
+        return accepted
+
+
+def _percentiles(values):
+    values = np.asarray(values) * 1000
+    if not values.size:
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return {'count': int(values.size), 'mean_ms': float(values.mean()), 'p50_ms': float(p50),
+            'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(values.max())}
+
+
+class TrackSimulator(object):
+
+    def __init__(self,
+                 track,
+                 sprites,
+                 fps=30.0,
+                 speed=30,
+                 backend=None,
+                 lane_model=None,
+                 signal_model=None,
+                 signs=True,
+                 latency='fixed',
+                 latency_scale=1.0,
+                 actuation_delay=0.03,
+                 sign_cost=0.05,
+                 substeps=4,
+                 lost_distance=0.25,
+                 camera=None):
+        from autonomous_driver_2024 import LaneFollower, TrafficSignDetector
+        from scheduler import DetectionScheduler
+
+        if latency not in LATENCIES:
+            raise ValueError(f"Latencia desconocida: {latency} (opciones: {', '.join(LATENCIES)})")
+
+        self.track = track
+        self.sprites = sprites
+        self.fps = fps
+        self.latency = latency
+        self.sign_cost = sign_cost          # segundos de inferencia que ve el planificador con latencia fija
+        self.substeps = substeps
+        self.lost_distance = lost_distance  # desviación a partir de la cual el coche se ha salido del carril
+
+        self.clock = SimClock(latency == 'measured', latency_scale)
+        self.car = SimCar(self.clock, speed)
+        self.vehicle = KinematicCar(*track.pose(0.0))
+        # La salida está en la cinta: la cámara, y no el eje trasero, empieza en el punto 0
+        self.vehicle.x, self.vehicle.y = self.vehicle.point(-self.vehicle.camera_ahead)
+        self.camera = camera if camera is not None else GroundCamera()
+        track.texture()
+        self.steering = _ActuatorDelay(self.car.front_wheels.steering, actuation_delay, self.car.STRAIGHT_ANGLE)
+        self.drive = _ActuatorDelay(self.car.back_wheels, actuation_delay, speed)
+
+        self.lane_follower = LaneFollower(self.car, lane_model, backend, clock=self.clock)
+        self.detector = None
+        if signs:
+            actions = _RecordingExecutor(self.clock, self._on_action)
+            self.detector = TrafficSignDetector(self.car, signal_model, backend, clock=self.clock, actions=actions)
+            self.scheduler = DetectionScheduler.from_settings(clock=self.clock)
+
+        self.progress = 0.0
+        self._s = track.project(*self.vehicle.center())[0]
+        self.events = {}
+        self.false_detections = {}
+
+    # Señales
+
+    def _upcoming(self, label):
+        ''' Próxima señal con esa etiqueta: (clave de la pasada, metros hasta ella) '''
+
+        best = None
+        for index, sign in enumerate(self.track.signs):
+            if sign.label != label:
+                continue
+            ahead = (sign.at - self._s) % self.track.length
+            if ahead > self.track.length - 0.3:
+                ahead -= self.track.length  # recién pasada
+            if best is None or abs(ahead) < abs(best[1]):
+                passing = int(round((self.progress + ahead - sign.at) / self.track.length))
+                best = ((index, passing), ahead)
+        return best
+
+    def _visible(self, label):
+        ''' True si alguna señal con esa etiqueta cae dentro del fotograma '''
+
+        x, y, heading = self.vehicle.camera_pose()
+        cos, sin = math.cos(heading), math.sin(heading)
+        for sign in self.track.signs:
+            if sign.label != label:
+                continue
+            dx, dy = sign.position[0] - x, sign.position[1] - y
+            forward = dx * cos + dy * sin
+            if not 0.05 < forward <= self.camera.max_range:
+                continue
+            pixel = self.camera.project(forward, -dx * sin + dy * cos, sign.height)
+            if pixel is not None and 0 <= pixel[0] < self.camera.width:
+                return True
+        return False
+
+    def _event(self, label):
+        upcoming = self._upcoming(label)
+        if upcoming is None:
+            return None, None
+        key, ahead = upcoming
+        if ahead > self.camera.max_range:
+            # Ninguna señal con esa etiqueta delante en el recorrido: o se ve una de
+            # otra parte del circuito o el detector se ha equivocado
+            if not self._visible(label):
+                self.false_detections[label] = self.false_detections.get(label, 0) + 1
+            return None, None
+        event = self.events.setdefault(key, {'label': label, 'at_m': self.track.signs[key[0]].at,
+                                             'pass': key[1], 'detected_m': None, 'reacted_m': None})
+        return event, ahead
+
+    def _on_detection(self, label):
+        event, ahead = self._event(label)
+        if event is not None and event['detected_m'] is None:
+            event['detected_m'] = ahead
+
+    def _on_action(self, label):
+        event, ahead = self._event(label)
+        if event is not None and event['reacted_m'] is None:
+            event['reacted_m'] = ahead
+
+    def _passed(self):
+        ''' Señales ya rebasadas, aunque no se vieran '''
+
+        for index, sign in enumerate(self.track.signs):
+            passes = int(math.floor((self.progress - sign.at) / self.track.length)) + 1
+            for passing in range(passes):
+                self.events.setdefault((index, passing), {'label': sign.label, 'at_m': sign.at, 'pass': passing,
+                                                          'detected_m': None, 'reacted_m': None})
+
+    # Bucle
+
+    def run(self, seconds, video=None):
+        dt = 1.0 / self.fps
+        frames = int(round(seconds * self.fps))
+        deviations = []
+        render_times, lane_times, sign_times, loop_times = [], [], [], []
+        lost_at = None
+        wall_start = time.perf_counter()
+
+        for frame in range(frames):
+            now = frame * dt
+            self.clock.tick(now)
+            if self.detector is not None:
+                self.detector.actions.run_pending(now)
+
+            start = time.perf_counter()
+            image = self.camera.render(self.track, self.vehicle.camera_pose(), self.sprites)
+            render_times.append(time.perf_counter() - start)
+
+            # El bucle del coche: el clock avanza aquí con el tiempo real si latency es measured
+            self.clock.tick(now)
+            start = time.perf_counter()
+            if self.car.keep_following:
+                self.lane_follower.follow_lane(image, render=False, timestamp=now)
+                lane_times.append(time.perf_counter() - start)
+            if (self.detector is not None and self.car.keep_detecting
+                    and self.scheduler.should_detect(image, self.car.back_wheels.speed, now)):
+                sign_start = time.perf_counter()
+                signal = self.detector.detect_signal(image, now)
+                cost = time.perf_counter() - sign_start
+                sign_times.append(cost)
+                if self.latency == 'measured':
+                    cost *= self.clock.scale
+                else:
+                    cost = self.sign_cost
+                self.scheduler.record(cost, signal != 'Nada', now)
+                if signal != 'Nada':
+                    self._on_detection(signal)
+            loop_times.append(time.perf_counter() - start)
+
+            if video is not None:
+                video.write(self._annotate(image))
+
+            # Física hasta el siguiente fotograma
+            step = dt / self.substeps
+            for substep in range(self.substeps):
+                t = now + substep * step
+                self.vehicle.step(step, self.drive(t), self.steering(t))
+
+            s, lateral = self.track.project(*self.vehicle.center())
+            delta = s - self._s
+            if delta < -self.track.length / 2:
+                delta += self.track.length
+            elif delta > self.track.length / 2:
+                delta -= self.track.length
+            self.progress += delta
+            self._s = s
+            deviations.append(lateral)
+            if abs(lateral) > self.lost_distance:
+                lost_at = now + dt
+                logging.warning(f"El coche se ha salido del carril a los {lost_at:.1f} s "
+                                f"({self.progress:.2f} m, desviación {lateral * 100:.1f} cm)")
+                break
+
+        wall = time.perf_counter() - wall_start
+        simulated = len(deviations) * dt
+        self._passed()
+        return self._report(simulated, wall, deviations, lost_at,
+                            render_times, lane_times, sign_times, loop_times)
+
+    def _annotate(self, image):
+        from overlay import draw_heading_line
+
+        return draw_heading_line(image.copy(), self.lane_follower.curr_steering_angle)
+
+    def _report(self, simulated, wall, deviations, lost_at, render_times, lane_times, sign_times, loop_times):
+        deviations = np.abs(np.asarray(deviations)) * 100
+        events = sorted(self.events.values(), key=lambda event: (event['pass'], event['at_m']))
+        signs = {}
+        for event in events:
+            summary = signs.setdefault(event['label'], {'passes': 0, 'detected': 0, 'reacted': 0})
+            summary['passes'] += 1
+            summary['detected'] += event['detected_m'] is not None
+            summary['reacted'] += event['reacted_m'] is not None
+        for label, summary in signs.items():
+            reacted = [event['reacted_m'] for event in events if event['label'] == label and event['reacted_m'] is not None]
+            summary['mean_reacted_m'] = float(np.mean(reacted)) if reacted else None
+
+        report = {'track': self.track.name,
+                  'fps': self.fps,
+                  'latency': self.latency,
+                  'simulated_s': simulated,
+                  'wall_s': wall,
+                  'realtime_factor': simulated / wall if wall > 0 else 0.0,
+                  'distance_m': self.vehicle.odometer,
+                  'laps': self.progress / self.track.length,
+                  'lost_at_s': lost_at,
+                  'deviation': {'mean_cm': float(deviations.mean()) if deviations.size else 0.0,
+                                'rms_cm': float(np.sqrt((deviations ** 2).mean())) if deviations.size else 0.0,
+                                'p95_cm': float(np.percentile(deviations, 95)) if deviations.size else 0.0,
+                                'max_cm': float(deviations.max()) if deviations.size else 0.0,
+                                'on_tape': float((deviations > (self.track.width - self.track.tape) * 50).mean())
+                                if deviations.size else 0.0},
+                  'signs': signs,
+                  'sign_events': events,
+                  'false_detections': self.false_detections,
+                  'stages': {'render': _percentiles(render_times),
+                             'lane': _percentiles(lane_times),
+                             'signs': _percentiles(sign_times),
+                             'loop': _percentiles(loop_times)},
+                  'commands': command_report(self.car)}
+        if self.detector is not None:
+            report['detection'] = self.scheduler.stats(self.clock.now)
+        return report
+
+    def close(self):
+        if self.detector is not None:
+            self.detector.actions.stop()
+
+
+def compare(baseline, current, tolerance=0.1):
+    ''' Imprime las diferencias entre dos informes; devuelve True si la conducción o el bucle empeoran '''
+
+    regression = False
+    print(f"{'métrica':24s} {'base':>10s} {'actual':>10s} {'cambio':>8s}")
+
+    def row(name, before, after, worse):
+        nonlocal regression
+        change = (after - before) / before if before else 0.0
+        flag = ' <-- peor' if worse else ''
+        regression |= worse
+        print(f"{name:24s} {before:10.2f} {after:10.2f} {change:+8.1%}{flag}")
+
+    # Medio centímetro de margen para que el ruido de una desviación pequeña no cuente
+    for metric in ('rms_cm', 'p95_cm', 'max_cm'):
+        before = baseline['deviation'][metric]
+        after = current['deviation'][metric]
+        row(f"desviación {metric}", before, after, after > before * (1 + tolerance) + 0.5)
+
+    for label, summary in current['signs'].items():
+        before = baseline['signs'].get(label, {}).get('reacted', 0)
+        row(f"reacciones {label}", before, summary['reacted'], summary['reacted'] < before)
+
+    for metric in ('p50_ms', 'p99_ms'):
+        before = baseline['stages']['loop'].get(metric, 0.0)
+        after = current['stages']['loop'].get(metric, 0.0)
+        row(f"bucle {metric}", before, after, before > 0 and after > before * (1 + tolerance))
+
+    if current['lost_at_s'] is not None and baseline['lost_at_s'] is None:
+        print(f"el coche se sale del carril a los {current['lost_at_s']:.1f} s <-- peor")
+        regression = True
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulador de circuito para probar la conducción sin el coche')
+    parser.add_argument('track', nargs='?', default='ovalo', help='circuito de tracks.json')
+    parser.add_argument('--tracks', help='fichero de circuitos; por defecto, tracks.json')
+    parser.add_argument('--seconds', type=float, default=60.0, help='segundos simulados')
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--speed', type=int, default=30)
+    parser.add_argument('--backend', choices=('edgetpu', 'cpu', 'mock'), help='por defecto, el del fichero config')
+    parser.add_argument('--no-signs', action='store_true', help='solo el carril')
+    parser.add_argument('--latency', choices=LATENCIES, default='fixed',
+                        help='retardo de las órdenes: fijo (determinista) o el tiempo real del bucle')
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help='con measured, cuántas veces más lento es el coche que este equipo')
+    parser.add_argument('--actuation-delay', type=float, default=0.03, help='segundos hasta que llega cada orden')
+    parser.add_argument('--video', help='vídeo con lo que ve el coche y la línea de dirección')
+    parser.add_argument('--output', help='fichero JSON donde guardar el informe')
+    parser.add_argument('--compare', help='informe JSON de referencia con el que comparar')
+    parser.add_argument('--diff', nargs=2, metavar=('BASE', 'ACTUAL'), help='solo compara dos informes ya guardados')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='empeoramiento permitido (0.1 = 10%%)')
+    args = parser.parse_args()
+
+    if args.diff:
+        with open(args.diff[0]) as f:
+            baseline = json.load(f)
+        with open(args.diff[1]) as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.tolerance) else 0)
+
+    spec = load_tracks(args.tracks)
+    if args.track not in spec['tracks']:
+        parser.error(f"Circuito desconocido: {args.track} (opciones: {', '.join(spec['tracks'])})")
+    track = Track.from_spec(args.track, spec['tracks'][args.track])
+
+    simulator = TrackSimulator(track, load_sprites(spec['sprites']),
+                               fps=args.fps,
+                               speed=args.speed,
+                               backend=args.backend,
+                               signs=not args.no_signs,
+                               latency=args.latency,
+                               latency_scale=args.latency_scale,
+                               actuation_delay=args.actuation_delay)
+    video = None
+    if args.video:
+        video = cv2.VideoWriter(args.video, cv2.VideoWriter_fourcc(*'mp4v'), args.fps,
+                                (simulator.camera.width, simulator.camera.height))
+    try:
+        report = simulator.run(args.seconds, video)
+    finally:
+        simulator.close()
+        if video is not None:
+            video.release()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(baseline, report, args.tolerance) else 0)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,187 @@
+#------------------------------------------------------------------------------
+# Seguimiento de las señales detectadas a lo largo de varios fotogramas.
+# Una señal solo se confirma si aparece en N de los últimos M fotogramas, y
+# la acción de cada señal se dispara una única vez mientras siga a la vista
+# (se marca al aceptarse la acción; si se rechaza, se reintenta en el siguiente).
+# El estado de las pistas vive en arrays reservados al crear el tracker.
+#------------------------------------------------------------------------------
+
+import time
+import numpy as np
+from postprocessing import box_iou, NEAR_HEIGHT
+
+TRACK_DTYPE = np.dtype([('track_id', np.int64),
+                        ('class_id', np.int16),
+                        ('score', np.float32),
+                        ('ymin', np.float32),
+                        ('xmin', np.float32),
+                        ('ymax', np.float32),
+                        ('xmax', np.float32),
+                        ('growth', np.float32),
+                        ('time_to_contact', np.float32)])
+
+# Número de bits a 1 de cada byte, para contar apariciones en la ventana
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class SignTracker(object):
+    ''' Asocia detecciones entre fotogramas por IoU o por cercanía de los centros '''
+
+    def __init__(self,
+                 max_tracks=16,
+                 confirm_hits=2,
+                 window=3,
+                 iou_threshold=0.3,
+                 max_center_distance=32,
+                 max_missed=3,
+                 smoothing=0.5,
+                 diagonal=400):
+        if not 1 <= confirm_hits <= window <= 8:
+            raise ValueError('Se necesita 1 <= confirm_hits <= window <= 8')
+
+        self.confirm_hits = confirm_hits
+        self.window_mask = np.uint8((1 << window) - 1)
+        self.iou_threshold = iou_threshold
+        self.max_center_distance = max_center_distance  # píxeles del fotograma
+        self.diagonal = diagonal                        # diagonal del fotograma de 320x240
+        self.max_missed = max_missed
+        self.smoothing = smoothing
+        self.next_id = 1
+
+        self.active = np.zeros(max_tracks, dtype=bool)
+        self.fired = np.zeros(max_tracks, dtype=bool)
+        self.track_ids = np.zeros(max_tracks, dtype=np.int64)
+        self.class_ids = np.full(max_tracks, -1, dtype=np.int16)
+        self.scores = np.zeros(max_tracks, dtype=np.float32)
+        self.boxes = np.zeros((max_tracks, 4), dtype=np.float32)
+        self.history = np.zeros(max_tracks, dtype=np.uint8)   # bit 0 = visto en el último fotograma
+        self.missed = np.zeros(max_tracks, dtype=np.int32)
+        self.growth = np.zeros(max_tracks, dtype=np.float32)  # crecimiento relativo de la altura (1/s)
+        self.last_seen = np.zeros(max_tracks, dtype=np.float64)
+
+    def reset(self):
+        self.active[:] = False
+        self.fired[:] = False
+
+    def confirmed(self):
+        ''' Pistas activas vistas en al menos confirm_hits de los últimos fotogramas '''
+
+        return self.active & (_POPCOUNT[self.history & self.window_mask] >= self.confirm_hits)
+
+    def _match(self, tracks, detections):
+        ''' Emparejamiento voraz pista-detección de la misma clase '''
+
+        boxes = np.stack([detections['ymin'], detections['xmin'], detections['ymax'], detections['xmax']], axis=1)
+        all_boxes = np.concatenate([self.boxes[tracks], boxes])
+        n = len(tracks)
+        affinity = box_iou(all_boxes)[:n, n:]
+
+        centers = (all_boxes[:, :2] + all_boxes[:, 2:]) / 2
+        distance = np.linalg.norm(centers[:n, None, :] - centers[None, n:, :], axis=2)
+
+        # Sin solape suficiente, los centros cercanos todavía cuentan como la misma señal
+        valid = (affinity >= self.iou_threshold) | (distance <= self.max_center_distance)
+        valid &= self.class_ids[tracks][:, None] == detections['class_id'][None, :]
+        affinity = np.where(valid, affinity + 1 - distance / self.diagonal, -1)
+
+        matches = []
+        while affinity.size and affinity.max() >= 0:
+            t, d = np.unravel_index(np.argmax(affinity), affinity.shape)
+            matches.append((tracks[t], d))
+            affinity[t, :] = -1
+            affinity[:, d] = -1
+        return matches, boxes
+
+    def update(self, detections, timestamp=None, is_near=None):
+        ''' Actualiza las pistas con las detecciones de un fotograma y devuelve las pistas
+            confirmadas y cercanas cuya acción todavía no se ha disparado. Quien actúe
+            debe llamar a mark_fired con las pistas cuya acción se ha aceptado '''
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        self.history[self.active] <<= 1
+        tracks = np.flatnonzero(self.active)
+        matched_detections = np.zeros(len(detections), dtype=bool)
+
+        if len(tracks) and len(detections):
+            matches, boxes = self._match(tracks, detections)
+            for track, detection in matches:
+                self._update_track(track, detections[detection], boxes[detection], timestamp)
+                matched_detections[detection] = True
+
+        seen = self.active & (self.history & 1).astype(bool)
+        self.missed[self.active & ~seen] += 1
+        self.missed[seen] = 0
+        self.active &= self.missed <= self.max_missed
+
+        for detection in detections[~matched_detections]:
+            self._new_track(detection, timestamp)
+
+        ready = np.flatnonzero(self.confirmed() & ~self.fired & ((self.history & 1) == 1))
+        candidates = self.tracks(ready)
+        if is_near is None:
+            near = (candidates['ymax'] - candidates['ymin']) >= NEAR_HEIGHT
+        else:
+            near = np.asarray(is_near(candidates), dtype=bool)
+
+        candidates = candidates[near]
+        return candidates[np.argsort(-candidates['score'], kind='stable')]
+
+    def mark_fired(self, track_id):
+        ''' La acción de la pista ya se ha disparado: no se vuelve a devolver mientras siga a la vista '''
+
+        self.fired[self.active & (self.track_ids == track_id)] = True
+
+    def _update_track(self, track, detection, box, timestamp):
+        old_height = self.boxes[track, 2] - self.boxes[track, 0]
+        new_height = box[2] - box[0]
+        dt = timestamp - self.last_seen[track]
+        if dt > 0 and old_height > 0:
+            growth = (new_height - old_height) / old_height / dt
+            self.growth[track] += self.smoothing * (growth - self.growth[track])
+
+        self.boxes[track] += self.smoothing * (box - self.boxes[track])
+        self.scores[track] = detection['score']
+        self.history[track] |= 1
+        self.last_seen[track] = timestamp
+
+    def _new_track(self, detection, timestamp):
+        free = np.flatnonzero(~self.active)
+        if free.size == 0:
+            # Sin huecos: se sustituye la pista vista hace más tiempo
+            track = int(np.argmin(self.last_seen))
+        else:
+            track = int(free[0])
+
+        self.active[track] = True
+        self.fired[track] = False
+        self.track_ids[track] = self.next_id
+        self.next_id += 1
+        self.class_ids[track] = detection['class_id']
+        self.scores[track] = detection['score']
+        self.boxes[track] = (detection['ymin'], detection['xmin'], detection['ymax'], detection['xmax'])
+        self.history[track] = 1
+        self.missed[track] = 0
+        self.growth[track] = 0
+        self.last_seen[track] = timestamp
+
+    def tracks(self, selected=None):
+        ''' Estado de las pistas indicadas como array estructurado (por defecto, las activas) '''
+
+        if selected is None:
+            selected = np.flatnonzero(self.active)
+        result = np.empty(len(selected), dtype=TRACK_DTYPE)
+        result['track_id'] = self.track_ids[selected]
+        result['class_id'] = self.class_ids[selected]
+        result['score'] = self.scores[selected]
+        result['ymin'] = self.boxes[selected, 0]
+        result['xmin'] = self.boxes[selected, 1]
+        result['ymax'] = self.boxes[selected, 2]
+        result['xmax'] = self.boxes[selected, 3]
+        result['growth'] = self.growth[selected]
+
+        # Con la altura creciendo a un ritmo g (1/s), la señal se alcanza en unos 1/g segundos
+        growth = self.growth[selected]
+        result['time_to_contact'] = np.where(growth > 1e-3, 1 / np.maximum(growth, 1e-3), np.inf)
+        return result